@@ -2,3 +2,4 @@ __version__ = '1.11rc2'
 __released__ = '2025-12-03'
 
 from .psf import PSF, UnknownSignal, Quantity
+from .progress import Cancelled
@@ -0,0 +1,205 @@
+"""
+Asynchronous Loading
+
+Coroutines that load PSF data without blocking the event loop of an asyncio
+application, such as a web service that browses simulation results.  Parsing
+and reading the cache are done in an executor, by default the thread pool of the
+event loop, so other requests continue to be served while a large file loads.
+
+Concurrent requests for the same file share a single load (single-flight):
+the first request starts the load and later ones wait for it to finish, then
+all receive the same PSF object.  If every request waiting on a load is
+cancelled, the load itself is cancelled.
+
+Example::
+
+    from psf_utils import PSF
+    from psf_utils.aio import iter_chunks
+
+    async def handler(request):
+        psf = await PSF.aopen(request.query['path'])
+        ...
+
+    async def stream(path):
+        async for time, values in iter_chunks(path, ['out']):
+            ...
+"""
+
+# License {{{1
+# Copyright (C) 2016-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+# Imports {{{1
+from . import cache
+from .psf import PSF
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from inform import Error
+from pathlib import Path
+import asyncio
+import threading
+
+
+# Globals {{{1
+_flights = {}
+
+
+# Utilities {{{1
+# _Flight class {{{2
+class _Flight:
+    # a load that is shared by every coroutine that requests the same file
+    def __init__(self):
+        self.future = None
+        self.waiters = 0
+        self.callbacks = []
+        self.cancel = threading.Event()
+
+
+# _key() {{{2
+def _key(loop, path, kwargs):
+    # identifies a load; loads of the same file with different arguments, such
+    # as precision, are distinct
+    options = tuple(sorted((k, repr(v)) for k, v in kwargs.items()))
+    return loop, Path(path).resolve(), options
+
+
+# _has_compressed_cache() {{{2
+def _has_compressed_cache(path):
+    # true if the file has a current compressed cache
+    cache_path = cache._cache_path(path)
+    try:
+        if cache_path.stat().st_mtime <= Path(path).stat().st_mtime:
+            return False
+        return cache.is_compressed(cache_path)
+    except OSError:
+        return False
+
+
+# open_psf() {{{1
+async def open_psf(path, executor=None, progress=None, **kwargs):
+    """
+    Open PSF
+
+    Loads a PSF file in an executor and returns the PSF object.  Concurrent
+    requests for the same file with the same arguments share a single load and
+    receive the same object, which should therefore not be modified.
+
+    path (str or Path):
+        Path to ASCII PSF file.
+    executor (concurrent.futures.Executor):
+        The executor that runs the load, the default executor of the event loop
+        if None.  A process pool avoids contention for the interpreter between
+        the load and the event loop, but then the load cannot report progress
+        or be cancelled.
+    progress (callable):
+        Called on the event loop with a :class:`psf_utils.progress.Progress`
+        object as the load proceeds.
+    kwargs:
+        Passed to :class:`psf_utils.PSF`.
+
+    If the coroutine is cancelled, the load continues for the benefit of any
+    other coroutine waiting on it.  Once none remain, it is cancelled too.
+    """
+    loop = asyncio.get_running_loop()
+    key = _key(loop, path, kwargs)
+    flight = _flights.get(key)
+    if flight is None:
+        flight = _flights[key] = _Flight()
+        if isinstance(executor, ProcessPoolExecutor):
+            load = partial(PSF, path, **kwargs)
+        else:
+            def report(status):
+                for callback in list(flight.callbacks):
+                    loop.call_soon_threadsafe(callback, status)
+            load = partial(PSF, path, progress=report, cancel=flight.cancel, **kwargs)
+        flight.future = loop.run_in_executor(executor, load)
+
+        def landed(future):
+            if _flights.get(key) is flight:
+                del _flights[key]
+            if not future.cancelled():
+                future.exception()   # retrieved so an abandoned load is quiet
+        flight.future.add_done_callback(landed)
+
+    if progress:
+        flight.callbacks.append(progress)
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.future)
+    finally:
+        flight.waiters -= 1
+        if progress:
+            flight.callbacks.remove(progress)
+        if not flight.waiters and not flight.future.done():
+            # every coroutine waiting on the load was cancelled, so stop it
+            flight.cancel.set()
+            if _flights.get(key) is flight:
+                del _flights[key]
+
+
+# iter_chunks() {{{1
+async def iter_chunks(path, names=None, rows=None, executor=None, **kwargs):
+    """
+    Iterate Chunks
+
+    An asynchronous generator that gives the signals of a swept PSF file
+    a block of rows at a time.  If the file has a current compressed cache
+    (see :mod:`psf_utils.cache`) and no other arguments are given, the blocks
+    are read from the cache in an executor, one at a time, so the signals are
+    never held in memory as a whole.  Otherwise the file is loaded using
+    :func:`open_psf` and the blocks are views of its signals.
+
+    path (str or Path):
+        Path to ASCII PSF file.
+    names (list of str):
+        Names of the signals, all signals if None.
+    rows (int):
+        The number of rows in each block, the number of values in each chunk of
+        the cache if None.
+    executor (concurrent.futures.Executor):
+        The executor that reads the blocks or loads the file.
+    kwargs:
+        Passed to :class:`psf_utils.PSF`.
+
+    Yields the sweep values of each block and a dictionary of the corresponding
+    values of the signals.
+    """
+    loop = asyncio.get_running_loop()
+    # the reader holds an open file, so it cannot be sent to another process
+    reader = None if isinstance(executor, ProcessPoolExecutor) else executor
+    if not kwargs and await loop.run_in_executor(reader, _has_compressed_cache, path):
+        blocks = cache.iter_rows(path, names, rows)
+        try:
+            while True:
+                block = await loop.run_in_executor(reader, next, blocks, None)
+                if block is None:
+                    return
+                yield block
+        finally:
+            blocks.close()
+
+    psf = await open_psf(path, executor, **kwargs)
+    sweep = psf.get_sweep(-1)
+    if not sweep:
+        raise Error('chunks require swept data.', culprit=path)
+    if names is None:
+        names = list(psf.signals)
+    ordinates = {name: psf.get_signal(name).ordinate for name in names}
+    abscissa = sweep.abscissa
+    rows = rows or cache.DEFAULT_CHUNK
+    for start in range(0, len(abscissa), rows):
+        stop = start + rows
+        yield abscissa[start:stop], {n: o[start:stop] for n, o in ordinates.items()}
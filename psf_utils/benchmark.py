@@ -0,0 +1,539 @@
+# Usage {{{1
+"""
+Benchmark
+
+Measures the time and memory needed to read, cache and plot synthetic PSF
+files of various sizes and kinds.
+
+Usage:
+    bench-psf [options] compare <baseline> <results>
+    bench-psf [options] [<kind>...]
+
+Options:
+    -p <counts>, --points <counts>    numbers of points [default: 1000,10000]
+    -n <counts>, --signals <counts>   numbers of signals [default: 10,100]
+    -P <names>, --phases <names>      phases to measure
+                                      [default: parse,load,cache-write,cache-read,plot]
+    -r <count>, --repeat <count>      number of timed runs [default: 3]
+    -d <dir>, --dir <dir>             directory for the synthetic files
+    -o <file>, --output <file>        save the results as JSON
+    -b <file>, --baseline <file>      compare the results to earlier results
+    -t <ratio>, --threshold <ratio>   largest acceptable slowdown [default: 1.2]
+    -s <file>, --svg <file>           plot scaling curves to an SVG file
+
+The kinds are tran (real values), ac (complex values in a group), noise (noise
+contributions held in structs along with a group) and dcop (unswept values).
+All kinds are measured if none are given.
+
+The phases are:
+    parse:        parsing the file, by the fast reader where possible
+    load:         parsing the file and building the signals
+    cache-write:  writing the cache
+    cache-read:   reading the PSF data from its cache
+    plot:         running show-psf to plot the signals to an SVG file
+
+Each phase is run in a fresh process.  The time reported is the shortest of
+the timed runs, the RSS is the peak resident memory of the process, which
+includes the preparation for the phase, and the allocation is the peak memory
+allocated by Python during the phase, as measured by tracemalloc.
+
+Synthetic files are written to a temporary directory that is deleted when
+done, unless --dir is given, in which case existing files are reused.
+
+With --baseline, the times and allocations are compared to those found in an
+earlier results file.  The exit status is 1 if any exceeds its baseline by more
+than the threshold ratio.  Times shorter than 10 ms are not compared.  The
+compare command compares two results files without running the benchmarks.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .psf import PSF, Quantity
+from .parse import ParsePSF
+from .write import synthesize
+from . import __version__, __released__
+from docopt import docopt
+from inform import (
+    Error, display, fatal, full_stop, os_error, terminate, warn
+)
+from pathlib import Path
+import datetime
+import json
+import os
+import numpy as np
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+# Globals {{{1
+kinds = {
+    # kind: arguments to synthesize(), structs are given per signal
+    'tran': dict(kind='tran'),
+    'ac': dict(kind='ac', group='group'),
+    'noise': dict(kind='noise', group='group', structs=0.25),
+    'dcop': dict(kind='dcop', structs=0.25),
+}
+phases = ['parse', 'load', 'cache-write', 'cache-read', 'plot']
+MIN_TIME = 0.01   # shorter times are too noisy to compare
+
+
+# Utilities {{{1
+# _counts() {{{2
+def _counts(text):
+    try:
+        return [int(Quantity(c)) for c in text.split(',')]
+    except ValueError:
+        raise Error('expected comma separated counts.', culprit=text)
+
+
+# _max_rss() {{{2
+def _max_rss():
+    # returns the peak resident memory of this process in bytes
+    if resource is None:  # pragma: no cover
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss*1024
+
+
+# _commit() {{{2
+def _commit():
+    # returns the current git commit, if any
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, cwd=Path(__file__).parent,
+        )
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+# _key() {{{2
+def _key(result):
+    return (result['kind'], result['points'], result['signals'], result['phase'])
+
+
+# Phases {{{1
+# Each phase is given by a function that prepares for the phase and returns a
+# function that performs it.
+
+def _parse(path, workdir):
+    parser = ParsePSF()
+    content = Path(path).read_text()
+    return lambda: parser.parse(str(path), content)
+
+
+def _load(path, workdir):
+    return lambda: PSF(path, use_cache=False, update_cache=False)
+
+
+def _cache_write(path, workdir):
+    psf = PSF(path, use_cache=False, update_cache=False)
+    cache = Path(workdir) / 'benchmark.cache'
+    return lambda: psf._write_cache(cache)
+
+
+def _cache_read(path, workdir):
+    PSF(path)   # assures the cache is current
+    return lambda: PSF(path, update_cache=False)
+
+
+def _plot(path, workdir):
+    import matplotlib
+    matplotlib.use('SVG')
+    import matplotlib.pyplot as plt
+    from .show import show_signals
+    PSF(path)   # assures the cache is current
+    os.chdir(workdir)   # show-psf saves its arguments in the current directory
+    argv = ['show-psf', '-f', str(path), '-s', 'benchmark.svg', '-m', '*']
+
+    def plot():
+        sys.argv = argv
+        show_signals()
+        plt.close('all')
+    return plot
+
+
+setups = {
+    'parse': _parse,
+    'load': _load,
+    'cache-write': _cache_write,
+    'cache-read': _cache_read,
+    'plot': _plot,
+}
+
+
+# measure() {{{2
+def measure(phase, path, workdir, repeat=3):
+    """
+    Measure
+
+    Measures one phase for one file.  Should be run in a fresh process so the
+    peak resident memory reflects the phase alone.
+
+    phase (str):
+        The name of the phase.
+    path (str or Path):
+        The path to the PSF file.
+    workdir (str or Path):
+        A directory for files created by the phase.
+    repeat (int):
+        The number of timed runs.
+
+    Returns a dictionary that contains the shortest time, the peak resident
+    memory of the process and the peak memory allocated by Python during the
+    phase.
+    """
+    action = setups[phase](path, workdir)
+
+    action()
+    rss = _max_rss()
+
+    times = []
+    for i in range(max(repeat, 1)):
+        start = time.perf_counter()
+        action()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        action()
+        allocated = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return dict(time=min(times), rss=rss, allocated=allocated)
+
+
+# _measure_in_child() {{{2
+child = """
+import json, sys
+from psf_utils.benchmark import measure
+phase, path, workdir, repeat, output = sys.argv[1:]
+result = measure(phase, path, workdir, int(repeat))
+with open(output, 'w') as f:
+    json.dump(result, f)
+"""
+
+
+def _measure_in_child(phase, path, workdir, repeat):
+    # runs measure() in a new process
+    output = Path(workdir) / 'measured.json'
+    env = dict(os.environ)
+    package_dir = str(Path(__file__).parent.parent)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in [package_dir, env.get('PYTHONPATH')] if p
+    )
+    process = subprocess.run(
+        [sys.executable, '-c', child, phase, str(path), str(workdir), str(repeat),
+        str(output)],
+        env=env, capture_output=True, text=True,
+    )
+    if process.returncode:
+        raise Error(
+            f'{phase} failed.', culprit=path,
+            codicil=process.stderr.strip().splitlines()[-1:]
+        )
+    with open(output) as f:
+        return json.load(f)
+
+
+# run_benchmarks() {{{1
+def run_benchmarks(
+    kinds_=None, points=(1000, 10000), signals=(10, 100), phases_=None,
+    repeat=3, directory=None, progress=None
+):
+    """
+    Run Benchmarks
+
+    Measures each phase for synthetic files of each kind, number of points and
+    number of signals.
+
+    kinds_ (list of str):
+        The kinds of files, all if None.
+    points (list of int):
+        The numbers of points in the sweep.  Ignored for dcop.
+    signals (list of int):
+        The numbers of signals.
+    phases_ (list of str):
+        The phases, all if None.
+    repeat (int):
+        The number of timed runs of each phase.
+    directory (str or Path):
+        The directory that holds the synthetic files.  Existing files are
+        reused.  A temporary directory is used if None.
+    progress (callable):
+        Called with each result as it becomes available.
+
+    Returns a list of results, each a dictionary.
+    """
+    kinds_ = kinds_ or list(kinds)
+    phases_ = phases_ or phases
+    for kind in kinds_:
+        if kind not in kinds:
+            raise Error(
+                f'unknown kind: {kind}.', codicil=f"Choose from {', '.join(kinds)}."
+            )
+    for phase in phases_:
+        if phase not in setups:
+            raise Error(
+                f'unknown phase: {phase}.', codicil=f"Choose from {', '.join(phases)}."
+            )
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        directory = Path(directory or tmpdir)
+        directory.mkdir(parents=True, exist_ok=True)
+        results = []
+        for kind in kinds_:
+            args = dict(kinds[kind])
+            for n in signals:
+                for p in [1] if kind == 'dcop' else points:
+                    path = directory / f'{kind}-{p}x{n}.psf'
+                    if not path.exists():
+                        structs = args.pop('structs', 0)
+                        synthesize(
+                            path, points=p, signals=n,
+                            structs=int(structs*n), seed=0, **args
+                        )
+                        args['structs'] = structs
+                    for phase in phases_:
+                        if phase == 'plot' and kind == 'dcop':
+                            continue   # unswept values are printed, not plotted
+                        measured = _measure_in_child(phase, path, tmpdir, repeat)
+                        result = dict(
+                            kind=kind, points=p, signals=n, phase=phase,
+                            size=path.stat().st_size, **measured
+                        )
+                        results.append(result)
+                        if progress:
+                            progress(result)
+        return results
+
+
+# scaling() {{{1
+def scaling(results):
+    """
+    Scaling
+
+    Estimates how the time of each phase grows with the number of points by
+    fitting a line to the logarithm of time versus the logarithm of the number
+    of points.  A slope of 1 indicates linear growth.
+
+    Returns a dictionary that maps (kind, signals, phase) to the slope.
+    """
+    curves = {}
+    for r in results:
+        key = (r['kind'], r['signals'], r['phase'])
+        curves.setdefault(key, []).append((r['points'], r['time']))
+    slopes = {}
+    for key, curve in curves.items():
+        points, times = np.array(sorted(curve)).T
+        if len(set(points)) > 1 and all(times > 0):
+            slopes[key] = np.polyfit(np.log(points), np.log(times), 1)[0]
+    return slopes
+
+
+# compare() {{{1
+def compare(results, baseline, threshold=1.2):
+    """
+    Compare
+
+    Compares results to a baseline.
+
+    results (list of dict):
+        The new results.
+    baseline (list of dict):
+        The earlier results.
+    threshold (float):
+        The largest acceptable ratio of a new time or allocation to its
+        baseline.  Times shorter than MIN_TIME are not compared.
+
+    Returns a list of regressions, each a tuple containing the key of the
+    result, the quantity (time or allocated), the baseline value, the new value
+    and their ratio.
+    """
+    earlier = {_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = earlier.get(_key(result))
+        if not old:
+            continue
+        for quantity in ['time', 'allocated']:
+            if quantity == 'time' and old['time'] < MIN_TIME:
+                continue
+            if not old.get(quantity):
+                continue
+            ratio = result[quantity]/old[quantity]
+            if ratio > threshold:
+                regressions.append(
+                    (_key(result), quantity, old[quantity], result[quantity], ratio)
+                )
+    return regressions
+
+
+# save() {{{1
+def save(path, results):
+    """
+    Save
+
+    Saves results as JSON along with a description of the environment.
+    """
+    data = dict(
+        version = __version__,
+        commit = _commit(),
+        date = datetime.datetime.now().isoformat(timespec='seconds'),
+        python = platform.python_version(),
+        numpy = np.__version__,
+        machine = platform.machine(),
+        results = results,
+    )
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+# load() {{{1
+def load(path):
+    """
+    Load
+
+    Loads results saved with :func:`save`.
+    """
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+# plot_curves() {{{1
+def plot_curves(results, svg_file):
+    """
+    Plot Curves
+
+    Plots time versus number of points for each kind, number of signals and
+    phase to an SVG file.
+    """
+    import matplotlib
+    matplotlib.use('SVG')
+    import matplotlib.pyplot as plt
+
+    kinds_ = sorted({r['kind'] for r in results if r['kind'] != 'dcop'})
+    if not kinds_:
+        raise Error('scaling curves require swept kinds.')
+    figure, axes = plt.subplots(
+        len(kinds_), 1, squeeze=False, figsize=(8, 4*len(kinds_))
+    )
+    for ax, kind in zip(axes[:, 0], kinds_):
+        curves = {}
+        for r in results:
+            if r['kind'] == kind:
+                key = f"{r['phase']}, {r['signals']} signals"
+                curves.setdefault(key, []).append((r['points'], r['time']))
+        for label, curve in curves.items():
+            points, times = np.array(sorted(curve)).T
+            ax.loglog(points, times, marker='o', label=label)
+        ax.set_title(kind)
+        ax.set_xlabel('points')
+        ax.set_ylabel('time (s)')
+        ax.grid(which='both')
+        ax.legend(frameon=False, fontsize='small')
+    figure.tight_layout()
+    plt.savefig(svg_file)
+    plt.close(figure)
+
+
+# report() {{{1
+def report(result):
+    """
+    Report
+
+    Displays a result.
+    """
+    display(
+        f"{result['kind']:>6} {result['points']:>8} {result['signals']:>5}",
+        f"{result['phase']:<12}",
+        f"{Quantity(result['time'], 's'):>9}",
+        f"rss {Quantity(result['rss'], 'B'):>7}",
+        f"alloc {Quantity(result['allocated'], 'B'):>7}",
+    )
+
+
+# benchmark() {{{1
+def benchmark():
+    try:
+        # process command line {{{2
+        cmdline = docopt(__doc__, version=f"{__version__} ({__released__})")
+        threshold = float(cmdline['--threshold'])
+        baseline = cmdline['--baseline']
+
+        with Quantity.prefs(prec=3):
+            if cmdline['compare']:
+                results = load(cmdline['<results>'])
+                baseline = cmdline['<baseline>']
+            else:
+                display(
+                    f"{'kind':>6} {'points':>8} {'sigs':>5} {'phase':<12}",
+                    f"{'time':>9}",
+                )
+                results = run_benchmarks(
+                    cmdline['<kind>'],
+                    points = _counts(cmdline['--points']),
+                    signals = _counts(cmdline['--signals']),
+                    phases_ = cmdline['--phases'].split(','),
+                    repeat = int(cmdline['--repeat']),
+                    directory = cmdline['--dir'],
+                    progress = report,
+                )
+                if cmdline['--output']:
+                    save(cmdline['--output'], results)
+                if cmdline['--svg']:
+                    plot_curves(results, cmdline['--svg'])
+                slopes = scaling(results)
+                if slopes:
+                    display('\nscaling exponents (time versus points):')
+                    for (kind, signals, phase), slope in slopes.items():
+                        display(f'{kind:>6} {signals:>5} {phase:<12} {slope:.2f}')
+
+            # compare to baseline {{{2
+            if baseline:
+                regressions = compare(results, load(baseline), threshold)
+                for key, quantity, old, new, ratio in regressions:
+                    kind, points, signals, phase = key
+                    units = 's' if quantity == 'time' else 'B'
+                    warn(
+                        f'{quantity} of {phase} increased by {ratio:.2f}×',
+                        f'from {Quantity(old, units)} to {Quantity(new, units)}.',
+                        culprit = f'{kind} {points}×{signals}',
+                    )
+                if regressions:
+                    display(f'{len(regressions)} regressions.')
+                    terminate(1)
+                display('no regressions.')
+    except ValueError as e:
+        fatal(full_stop(e))
+    except Error as e:
+        e.terminate()
+    except OSError as e:
+        fatal(os_error(e))
+    except KeyboardInterrupt:
+        terminate(2)
@@ -0,0 +1,229 @@
+"""
+Buses
+
+Groups signals whose names end in an index in chevrons, such as out<3>, into
+buses whose bits are held in a single 2D array, and decodes buses into integer
+codes with whole-array operations.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .resample import Interpolator
+from inform import Error, Info
+import numpy as np
+import re
+
+
+# Globals {{{1
+bit_pattern = re.compile(r'^(.+)<(\d+)>$')
+range_pattern = re.compile(r'<(\d+):(\d+)>$')
+MAX_BITS = 63
+
+
+# Utilities {{{1
+# split_bit() {{{2
+def split_bit(name):
+    """
+    Split Bit
+
+    Returns the bus name and bit index of a name such as out<3>, or None if
+    the name does not end in an index.
+    """
+    match = bit_pattern.match(name)
+    if match:
+        return match.group(1), int(match.group(2))
+
+
+# expand_range() {{{2
+def expand_range(name):
+    """
+    Expand Range
+
+    Expands a name that ends in a range of bits, such as out<7:4>, into the
+    names of the individual bits, in the order given.  Other names are
+    returned unchanged, in a list.
+    """
+    match = range_pattern.search(name)
+    if not match:
+        return [name]
+    first, last = int(match.group(1)), int(match.group(2))
+    step = -1 if first > last else 1
+    base = name[:match.start()]
+    return [f'{base}<{i}>' for i in range(first, last + step, step)]
+
+
+# pack() {{{2
+def pack(logic, bits, signed=False):
+    """
+    Pack
+
+    Packs logic levels into integer codes.
+
+    logic (array of bool):
+        The logic levels, the bits are along the second to last axis.  So for
+        a single bus the shape is (bits, points) and for many runs of the same
+        bus it is (runs, bits, points).
+    bits (list of int):
+        The index of each bit, which gives its weight.
+    signed (bool):
+        If True the codes are interpreted as two's complement, with the bit of
+        highest index as the sign bit.
+
+    Returns an integer array with the bit axis removed.
+    """
+    bits = np.asarray(bits, dtype=np.int64)
+    width = bits.max() + 1 if len(bits) else 0
+    if width > MAX_BITS:
+        raise Error(f'bus is too wide to pack ({width} bits).')
+    weights = np.left_shift(1, bits)
+    codes = np.tensordot(weights, np.asarray(logic, dtype=np.int64), axes=([0], [-2]))
+    if signed and width:
+        sign = np.int64(1) << (width - 1)
+        codes = np.where(codes & sign, codes - (sign << 1), codes)
+    return codes
+
+
+# decode() {{{2
+def decode(values, bits, threshold, signed=False):
+    """
+    Decode
+
+    Converts analog bit values to integer codes by comparing them to a
+    threshold and packing the result.
+
+    values (array):
+        The bit values, the bits are along the second to last axis.
+    bits (list of int):
+        The index of each bit.
+    threshold (float):
+        The values above which a bit is considered high.
+    signed (bool):
+        If True the codes are interpreted as two's complement.
+    """
+    return pack(np.asarray(values) > threshold, bits, signed)
+
+
+# Bus class {{{1
+class Bus(Info):
+    """
+    Bus
+
+    A collection of signals that share a name and differ only in their index.
+    The values of the bits are held in the 2D array *ordinate*, one row per
+    bit, ordered from most to least significant.
+
+    The following attributes are available:
+
+    name (str):
+        The name of the bus without the index, for example out.
+    bits (list of int):
+        The index of each row of ordinate.
+    names (list of str):
+        The name of the signal that corresponds to each row of ordinate.
+    ordinate (2D array):
+        The values of the bits.
+    units (str):
+        The units of the bits.
+    """
+
+    def threshold(self):
+        """
+        Threshold
+
+        Returns the midpoint between the smallest and largest values of the
+        bus, which is used when no threshold is given.
+        """
+        if not self.ordinate.size:
+            return 0
+        return (self.ordinate.min() + self.ordinate.max())/2
+
+    def decode(self, threshold=None, signed=False, at=None, abscissa=None):
+        """
+        Decode
+
+        Converts the bus to a sequence of integer codes.
+
+        threshold (float):
+            The value above which a bit is considered high.  By default the
+            midpoint of the bus values is used.
+        signed (bool):
+            If True the codes are interpreted as two's complement, with the
+            bit of highest index as the sign bit.
+        at (array):
+            If given, the bus is interpolated at these points, for example
+            the clock edges, before being decoded.
+        abscissa (array):
+            The sweep, required if at is given.
+
+        Returns an integer array with one code per point.
+        """
+        if threshold is None:
+            threshold = self.threshold()
+        values = self.ordinate
+        if at is not None:
+            if abscissa is None:
+                raise Error('abscissa is required to decode at given points.')
+            values = Interpolator(abscissa, at)(values)
+        return decode(values, self.bits, threshold, signed)
+
+
+# find_buses() {{{1
+def find_buses(psf):
+    """
+    Find Buses
+
+    Groups the swept signals whose names end in an index into buses.  The
+    values of each bus are gathered into a single 2D array, and the member
+    signals are updated to hold views into that array, so the bits are stored
+    only once.
+
+    psf (PSF):
+        The PSF data.
+
+    Returns a dictionary of Bus objects indexed by bus name.
+    """
+    sweep = psf.get_sweep(-1)
+    if not sweep:
+        return {}
+    members = {}
+    for name, signal in psf.signals.items():
+        split = split_bit(name)
+        kind = signal.type.kind or ''
+        if split and 'complex' not in kind and 'string' not in kind:
+            members.setdefault(split[0], []).append((split[1], name))
+
+    buses = {}
+    for bus_name, bits in members.items():
+        bits.sort(reverse=True)
+        signals = [psf.signals[n] for b, n in bits]
+        # the bits keep the precision in which they are stored
+        dtype = np.result_type(*{np.asarray(s.ordinate).dtype for s in signals})
+        ordinate = np.empty((len(bits), len(sweep.abscissa)), dtype=dtype)
+        for row, signal in zip(ordinate, signals):
+            row[:] = signal.ordinate
+        for row, signal in zip(ordinate, signals):
+            signal.ordinate = row
+        buses[bus_name] = Bus(
+            name = bus_name,
+            bits = [b for b, n in bits],
+            names = [n for b, n in bits],
+            ordinate = ordinate,
+            units = signals[0].units,
+        )
+    return buses
@@ -0,0 +1,522 @@
+"""
+Compressed Cache
+
+An alternative to the pickled cache in which numeric arrays are split into
+chunks that are compressed independently.  The remaining data is pickled and
+compressed as a whole.  As the chunks of all signals of a sweep are aligned, a window of the
+sweep can be read by decompressing only the chunks that overlap it.
+
+The file consists of a short magic string, the compressed chunks, the directory
+that describes them together with the compressed pickle of the remainder, and
+finally the offset of the directory.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from inform import Error, Info
+from contextlib import contextmanager
+from pathlib import Path
+import bz2
+import io
+import lzma
+import numpy as np
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+
+# Globals {{{1
+MAGIC = b'PSFZ\x00\x01\r\n'
+TRAILER = struct.Struct('<Q')
+DEFAULT_CHUNK = 1 << 16
+MIN_SIZE = 256   # smaller arrays are simply pickled
+codecs = {
+    'zlib': (lambda b: zlib.compress(b, 6), zlib.decompress),
+    'bz2': (lambda b: bz2.compress(b, 9), bz2.decompress),
+    'lzma': (lambda b: lzma.compress(b, preset=1), lzma.decompress),
+}
+filters = ['shuffle', 'delta']
+
+
+# Filters {{{1
+# Both filters first view the values as unsigned integers, one column per real
+# component.  The delta filter replaces each value with its difference from the
+# previous one, which wraps around and so is lossless even for floats.  Then the
+# bytes are shuffled so that the bytes of equal significance are adjacent,
+# which greatly improves compression of smooth waveforms.
+
+def _as_words(values):
+    values = np.ascontiguousarray(values)
+    size = values.dtype.itemsize
+    if values.dtype.kind == 'c':
+        size //= 2
+    return values.view(f'u{size}').reshape(len(values), -1)
+
+
+def _encode(values, filter):
+    words = _as_words(values)
+    if filter == 'delta':
+        zeros = np.zeros((1, words.shape[1]), words.dtype)
+        words = np.diff(words, axis=0, prepend=zeros)
+    return np.ascontiguousarray(words.view(np.uint8).reshape(len(values), -1).T).tobytes()
+
+
+def _decode(data, filter, dtype, count):
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(data, dtype=np.uint8).reshape(-1, count)
+    words = np.ascontiguousarray(shuffled.T)
+    size = dtype.itemsize // 2 if dtype.kind == 'c' else dtype.itemsize
+    words = words.view(f'u{size}')
+    if filter == 'delta':
+        words = np.cumsum(words, axis=0, dtype=words.dtype)
+    return words.view(dtype).reshape(count)
+
+
+# Writer {{{1
+class _Writer(pickle.Pickler):
+    # pickles the object, diverting large numeric arrays into chunks
+
+    def __init__(self, buffer, stream, codec, chunk):
+        super().__init__(buffer, pickle.HIGHEST_PROTOCOL)
+        self.stream = stream
+        self.compress = codecs[codec][0]
+        self.codec = codec
+        self.chunk = chunk
+        self.directory = {}
+        self.seen = {}
+
+    def persistent_id(self, obj):
+        if type(obj) is not np.ndarray:
+            return None
+        if obj.dtype.kind not in 'fciu' or obj.size < MIN_SIZE:
+            return None
+        key = self.seen.get(id(obj))
+        if key is None:
+            key = len(self.directory)
+            self.seen[id(obj)] = key
+            # keep obj alive so its id cannot be reused while pickling
+            self.directory[key] = self._write(obj), obj
+        return ('chunked', key)
+
+    def _write(self, array):
+        flat = array.reshape(-1)
+        filter = None
+        chunks = []
+        firsts = []
+        for start in range(0, len(flat), self.chunk):
+            values = flat[start:start + self.chunk]
+            if filter is None:
+                # choose the filter that works best on the first chunk
+                trials = [(len(self.compress(_encode(values, f))), f) for f in filters]
+                filter = min(trials)[1]
+            data = self.compress(_encode(values, filter))
+            chunks.append((self.stream.tell(), len(data), len(values)))
+            self.stream.write(data)
+            firsts.append(values[0])
+        return Info(
+            dtype = array.dtype.str,
+            shape = array.shape,
+            chunk = self.chunk,
+            filter = filter,
+            codec = self.codec,
+            chunks = chunks,
+            firsts = np.array(firsts) if array.ndim == 1 else None,
+        )
+
+
+# atomic_write() {{{1
+@contextmanager
+def atomic_write(path):
+    """
+    Atomic Write
+
+    Returns a context manager that opens a temporary file beside the given path
+    for writing in binary mode, and renames it to the path once it has been
+    written in full.  If writing is interrupted by an error, a cancellation or
+    Ctrl-C, the temporary file is removed and any existing file at the path is
+    left untouched, so a truncated file is never left behind.
+
+    path (str or Path):
+        The path to the file.
+    """
+    path = Path(path)
+    temp = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with open(temp, 'wb') as stream:
+            yield stream
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            temp.unlink()
+        except OSError:
+            pass
+        raise
+
+
+# dump() {{{1
+def dump(stream, obj, codec='zlib', chunk=DEFAULT_CHUNK):
+    """
+    Dump
+
+    Writes an object to a binary stream in the form of a compressed cache.
+    The stream must support tell().
+
+    stream (file):
+        The stream.
+    obj:
+        The object, generally the attribute dictionary of a PSF object.
+    codec (str):
+        The compressor, one of zlib, bz2 or lzma.  zlib is fastest, lzma
+        produces the smallest files.
+    chunk (int):
+        The number of values in each compressed chunk.
+    """
+    if codec not in codecs:
+        raise Error(
+            f'unknown codec: {codec}.', codicil=f"Choose from {', '.join(codecs)}."
+        )
+    stream.write(MAGIC)
+    buffer = io.BytesIO()
+    writer = _Writer(buffer, stream, codec, chunk)
+    writer.dump(obj)
+    directory = {k: v[0] for k, v in writer.directory.items()}
+    remainder = codecs[codec][0](buffer.getvalue())
+    offset = stream.tell()
+    pickle.dump((directory, codec, remainder), stream, pickle.HIGHEST_PROTOCOL)
+    stream.write(TRAILER.pack(offset))
+
+
+# write() {{{1
+def write(path, obj, codec='zlib', chunk=DEFAULT_CHUNK):
+    """
+    Write
+
+    Writes an object to a compressed cache file.  The file is written
+    atomically (see :func:`atomic_write`).
+
+    path (str or Path):
+        The path to the cache file.
+    obj:
+        The object, generally the attribute dictionary of a PSF object.
+    codec (str):
+        The compressor, one of zlib, bz2 or lzma.  zlib is fastest, lzma
+        produces the smallest files.
+    chunk (int):
+        The number of values in each compressed chunk.
+    """
+    with atomic_write(path) as stream:
+        dump(stream, obj, codec, chunk)
+
+
+# Reader {{{1
+class _Reader(pickle.Unpickler):
+    # unpickles the object, reading the chunked arrays
+
+    def __init__(self, data, stream, directory, lazy):
+        super().__init__(io.BytesIO(data))
+        self.stream = stream
+        self.directory = directory
+        self.lazy = lazy
+        self.loaded = {}
+
+    def persistent_load(self, pid):
+        kind, key = pid
+        if kind != 'chunked':
+            raise pickle.UnpicklingError(f'unknown persistent id: {kind}.')
+        if key not in self.loaded:
+            if self.lazy:
+                self.loaded[key] = ChunkedArray(self.stream, self.directory[key])
+            else:
+                self.loaded[key] = _read(self.stream, self.directory[key])
+        return self.loaded[key]
+
+
+def _read(stream, info, first=0, last=None):
+    # reads chunks first through last, inclusive
+    chunks = info.chunks[first:None if last is None else last + 1]
+    decompress = codecs[info.codec][1]
+    count = sum(c[2] for c in chunks)
+    result = np.empty(count, dtype=info.dtype)
+    pos = 0
+    for offset, length, n in chunks:
+        stream.seek(offset)
+        data = decompress(stream.read(length))
+        result[pos:pos + n] = _decode(data, info.filter, info.dtype, n)
+        pos += n
+    if first == 0 and last is None:
+        return result.reshape(info.shape)
+    return result
+
+
+def _open(path):
+    stream = open(path, 'rb')
+    try:
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise Error('not a compressed cache.', culprit=path)
+        stream.seek(-TRAILER.size, io.SEEK_END)
+        offset, = TRAILER.unpack(stream.read(TRAILER.size))
+        stream.seek(offset)
+        directory, codec, remainder = pickle.load(stream)
+        return stream, directory, codecs[codec][1](remainder)
+    except Exception:
+        stream.close()
+        raise
+
+
+# is_compressed() {{{1
+def is_compressed(path):
+    """
+    Is Compressed
+
+    True if the file is a compressed cache.
+    """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+# current() {{{1
+def current(path):
+    """
+    Current
+
+    Returns the path to the compressed cache of a PSF file if there is one and
+    it is newer than the file, otherwise None.
+
+    path (str or Path):
+        The path to the PSF file.
+    """
+    path = Path(path)
+    cache_path = _cache_path(path)
+    try:
+        if cache_path.stat().st_mtime <= path.stat().st_mtime:
+            return None
+        return cache_path if is_compressed(cache_path) else None
+    except OSError:
+        return None
+
+
+# read() {{{1
+def read(path):
+    """
+    Read
+
+    Reads an object from a compressed cache file.
+    """
+    stream, directory, data = _open(path)
+    with stream:
+        return _Reader(data, stream, directory, lazy=False).load()
+
+
+# ChunkedArray class {{{1
+class ChunkedArray:
+    """
+    Chunked Array
+
+    A placeholder for an array in a compressed cache that reads its chunks on
+    demand.
+    """
+
+    def __init__(self, stream, info):
+        self.stream = stream
+        self.info = info
+
+    def __len__(self):
+        return self.info.shape[0]
+
+    def read(self, first=0, last=None):
+        """
+        Read
+
+        Returns the values held in chunks first through last, inclusive.
+        """
+        return _read(self.stream, self.info, first, last)
+
+
+# _cache_path() {{{1
+def _cache_path(path):
+    # returns the path to the cache given that of the PSF file or the cache
+    path = Path(path)
+    if path.suffix != '.cache':
+        path = path.with_suffix(path.suffix + '.cache')
+    return path
+
+
+# _ordinate() {{{1
+def _ordinate(signals, name):
+    # returns the values of a signal read lazily from a compressed cache, which
+    # are either a chunked array or, for small and compact signals, an array
+    try:
+        signal = signals[name]
+    except KeyError:
+        from .psf import UnknownSignal
+        raise UnknownSignal(name, choices=signals.keys())
+    ordinate = signal.__dict__.get('ordinate')
+    if ordinate is None:
+        # compact signal
+        runs = signal.compact
+        for attr in ['starts', 'values', 'abscissa']:
+            if isinstance(getattr(runs, attr), ChunkedArray):
+                setattr(runs, attr, getattr(runs, attr).read())
+        ordinate = runs.expand()
+    if isinstance(ordinate, ChunkedArray):
+        return ordinate
+    return np.asarray(ordinate)
+
+
+# _load_lazily() {{{1
+def _load_lazily(stream, directory, data, path):
+    # returns the sweep and signals with their arrays left in the cache
+    attributes = _Reader(data, stream, directory, lazy=True).load()
+    sweeps = attributes.get('sweeps')
+    if not sweeps:
+        raise Error('windows require swept data.', culprit=path)
+    return sweeps[-1].abscissa, attributes['signals']
+
+
+# open_lazily() {{{1
+@contextmanager
+def open_lazily(path):
+    """
+    Open Lazily
+
+    Returns a context manager that gives the attributes of a PSF object held in
+    a compressed cache without reading its arrays.  Large arrays are given as
+    chunked arrays (see :class:`ChunkedArray`), which may be read until the
+    context is left.
+
+    path (str or Path):
+        The path to the PSF file or its compressed cache.
+    """
+    stream, directory, data = _open(_cache_path(path))
+    with stream:
+        yield _Reader(data, stream, directory, lazy=True).load()
+
+
+# read_window() {{{1
+def read_window(path, start=None, stop=None, names=None):
+    """
+    Read Window
+
+    Reads the portion of the signals that lies within a window of the sweep
+    from a compressed cache, decompressing only the chunks that overlap the
+    window.
+
+    path (str or Path):
+        The path to the PSF file or its compressed cache.
+    start, stop (float):
+        The bounds of the window, either may be None.
+    names (list of str):
+        Names of the signals to read, all signals if None.
+
+    Returns the sweep values within the window and a dictionary of the
+    corresponding values of the signals.
+
+    Example::
+
+        >>> from psf_utils import PSF
+        >>> from psf_utils.cache import read_window
+        >>> psf = PSF('samples/pnoise.raw/pss.td.pss', compress_cache=True)
+        >>> time, values = read_window('samples/pnoise.raw/pss.td.pss', 0, 1e-7, ['top'])
+        >>> len(time), len(values['top'])
+        (21, 21)
+
+    """
+    path = _cache_path(path)
+    stream, directory, data = _open(path)
+    with stream:
+        abscissa, signals = _load_lazily(stream, directory, data, path)
+        if names is None:
+            names = list(signals)
+
+        if isinstance(abscissa, ChunkedArray):
+            # find the chunks that overlap the window from their first values
+            firsts = abscissa.info.firsts
+            first = 0
+            last = len(firsts) - 1
+            if start is not None:
+                first = max(np.searchsorted(firsts, start, side='right') - 1, 0)
+            if stop is not None:
+                last = max(np.searchsorted(firsts, stop, side='right') - 1, 0)
+            offset = first*abscissa.info.chunk
+            abscissa = abscissa.read(first, last)
+        else:
+            first, last, offset = 0, None, 0
+        lo = 0 if start is None else np.searchsorted(abscissa, start, side='left')
+        hi = len(abscissa) if stop is None else np.searchsorted(abscissa, stop, side='right')
+
+        values = {}
+        for name in names:
+            ordinate = _ordinate(signals, name)
+            if isinstance(ordinate, ChunkedArray):
+                ordinate = ordinate.read(first, last)
+            else:
+                ordinate = ordinate[offset:offset + len(abscissa)]
+            values[name] = ordinate[lo:hi]
+        return abscissa[lo:hi], values
+
+
+# iter_rows() {{{1
+def iter_rows(path, names=None, rows=None):
+    """
+    Iterate Rows
+
+    Reads the signals from a compressed cache a block of rows at a time, so
+    only one block need be held in memory.  Each block is read by
+    decompressing only the chunks that overlap it.
+
+    path (str or Path):
+        The path to the PSF file or its compressed cache.
+    names (list of str):
+        Names of the signals to read, all signals if None.
+    rows (int):
+        The number of rows in each block, the number of values in each chunk
+        of the cache if None.
+
+    Yields the sweep values of each block and a dictionary of the corresponding
+    values of the signals.
+    """
+    path = _cache_path(path)
+    stream, directory, data = _open(path)
+    with stream:
+        abscissa, signals = _load_lazily(stream, directory, data, path)
+        if names is None:
+            names = list(signals)
+        columns = [abscissa] + [_ordinate(signals, name) for name in names]
+        if not rows:
+            chunked = isinstance(abscissa, ChunkedArray)
+            rows = abscissa.info.chunk if chunked else DEFAULT_CHUNK
+        length = len(abscissa)
+        for start in range(0, length, rows):
+            stop = min(start + rows, length)
+            block = [_rows(column, start, stop) for column in columns]
+            yield block[0], dict(zip(names, block[1:]))
+
+
+def _rows(column, start, stop):
+    # returns rows start through stop of a column, reading only the chunks
+    # that contain them
+    if not isinstance(column, ChunkedArray):
+        return column[start:stop]
+    chunk = column.info.chunk
+    first = start // chunk
+    values = column.read(first, (stop - 1) // chunk)
+    offset = first*chunk
+    return values[start - offset:stop - offset]
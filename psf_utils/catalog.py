@@ -0,0 +1,425 @@
+"""
+Catalog
+
+Indexes the PSF files found in a directory tree, such as the raw directory of
+a Spectre run, recording the analysis held in each file along with its sweep
+and the names of its signals.  Only the header of a swept file is parsed, so
+building the catalog is much faster than loading the files.  The catalog is
+saved in the directory as .psf_catalog and when it is next built only the files
+that have changed since are scanned again.
+
+Example::
+
+    from psf_utils.catalog import Catalog
+
+    catalog = Catalog.build('results.raw')
+    for entry, names in catalog.find('out*'):
+        print(entry.path, entry.analysis, names)
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .cache import atomic_write
+from .convert import find_psf_files
+from .index import RowIndex, index_filepath, sweep_section, value_section
+from .parse import ParsePSF, ParseError
+from concurrent.futures import ProcessPoolExecutor
+from inform import Error, Info, log, os_error
+from pathlib import Path
+import fnmatch
+import json
+import os
+import pickle
+
+
+# Globals {{{1
+CATALOG_FILENAME = '.psf_catalog'
+CATALOG_VERSION = 1
+READ_CHUNK = 1 << 16    # bytes read at a time while looking for the values
+COUNT_CHUNK = 1 << 24   # bytes read at a time while counting rows
+_parser = None
+
+
+# Entry class {{{1
+class Entry(Info):
+    """
+    Entry
+
+    Describes a PSF file in the catalog.
+
+    path (str):
+        The path to the file relative to the directory of the catalog.
+    mtime (int):
+        The modification time of the file when scanned, in nanoseconds.
+    size (int):
+        The size of the file when scanned.
+    analysis (str):
+        The type of the analysis, such as tran, ac or noise.
+    name (str):
+        The name of the analysis.
+    sweep (str):
+        The name of the sweep variable, None if not swept.  With nested sweeps,
+        the name of the inner sweep.
+    outer (list of str):
+        The names of the outer sweeps of nested sweeps, outermost first.
+    units (str):
+        The units of the sweep variable.
+    rows (int):
+        The number of points in the sweep.
+    start (float):
+        The first value of the sweep variable.
+    stop (float):
+        The last value of the sweep variable.
+    signals (list of str):
+        The names of the signals.
+    error (str):
+        Why the file could not be scanned, in which case the attributes that
+        describe its contents are missing.
+    """
+
+
+# Utilities {{{1
+# _read_header() {{{2
+def _read_header(f):
+    # reads the file up to the start of its VALUE section, returning what was
+    # read and the offset of the section, or None if it has no values
+    data = b''
+    while True:
+        chunk = f.read(READ_CHUNK)
+        # the line that holds VALUE may straddle chunks
+        start = max(data.rfind(b'\n'), 0)
+        data += chunk
+        match = value_section.search(data, start)
+        if match:
+            return data, match.start()
+        if not chunk:
+            return data, None
+
+
+# _count_rows() {{{2
+def _count_rows(f, start, name):
+    # counts the rows in the VALUE section, each of which starts with the name
+    # of the sweep on a new line, by counting occurrences of it a block at a time
+    marker = b'\n"' + name.encode() + b'"'
+    f.seek(start)
+    count = 0
+    tail = b''
+    while True:
+        block = f.read(COUNT_CHUNK)
+        if not block:
+            return count
+        data = tail + block
+        count += data.count(marker)
+        # keep enough to find a marker that straddles blocks, but not enough
+        # to count one twice
+        tail = data[-(len(marker) - 1):]
+
+
+# _sweep_value() {{{2
+def _sweep_value(text):
+    # returns the value that follows the name of the sweep at the start of text
+    try:
+        return float(text.split(None, 2)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+# _first_row() {{{2
+def _first_row(f, start, name):
+    # returns the start of the text of the first row, the first line after the
+    # start of the VALUE section that starts with the name of the sweep
+    marker = b'\n"' + name.encode() + b'"'
+    f.seek(start)
+    data = f.read(READ_CHUNK)
+    index = data.find(marker)
+    if index < 0:
+        return ''
+    return data[index+1:index+257].decode(errors='replace')
+
+
+# _last_row() {{{2
+def _last_row(f, size, name):
+    # returns the text of the last row, found by searching back from the end of
+    # the file for the last line that starts with the name of the sweep
+    marker = b'\n"' + name.encode() + b'"'
+    span = READ_CHUNK
+    while True:
+        begin = max(size - span, 0)
+        f.seek(begin)
+        data = f.read(span)
+        index = data.rfind(marker)
+        if index >= 0:
+            return data[index+1:].decode(errors='replace')
+        if not begin:
+            return ''
+        span *= 4
+
+
+# scan() {{{1
+def scan(path):
+    """
+    Scan
+
+    Returns the description of a PSF file as a dictionary of the attributes of
+    an :class:`Entry`.  Only the header of a swept file is parsed, the values
+    themselves are merely counted; the whole of an unswept file is parsed.
+
+    path (str or Path):
+        Path to ASCII PSF file.
+    """
+    global _parser
+    if not _parser:
+        _parser = ParsePSF()
+    path = Path(path)
+    with open(path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        head, start = _read_header(f)
+        swept = start is not None and sweep_section.search(head, 0, start)
+        if swept:
+            content = head[:start] + b'END\n'
+        else:
+            f.seek(0)
+            content = f.read()
+        try:
+            meta, types, sweeps, traces, values = _parser.parse(
+                str(path), content.decode()
+            )
+        except ParseError as e:
+            raise Error(str(e), culprit=path)
+        except UnicodeError as e:
+            raise Error(e, culprit=path)
+
+        info = dict(
+            mtime = stat.st_mtime_ns,
+            size = stat.st_size,
+            analysis = meta.get('analysis type'),
+            name = meta.get('analysis name'),
+        )
+        signals = []
+        if swept:
+            sweep = sweeps[-1]
+            info.update(sweep=sweep.name, units=sweep.units)
+            if len(sweeps) > 1:
+                info['outer'] = [s.name for s in sweeps[:-1]]
+            try:
+                index = RowIndex.load(index_filepath(path), path)
+            except (OSError, ValueError, EOFError, pickle.UnpicklingError, Error):
+                # a missing or unreadable index, the rows are counted instead
+                index = None
+            if index:
+                info['rows'] = index.rows
+            else:
+                info['rows'] = _count_rows(f, start, sweep.name)
+            info['start'] = _sweep_value(_first_row(f, start, sweep.name))
+            info['stop'] = _sweep_value(_last_row(f, stat.st_size, sweep.name))
+
+            # the names are as given by PSF: the members of groups and the
+            # fields of structs joined to the name of the trace with a colon
+            traces, groups = traces
+            for trace in traces:
+                type = types.get(trace.type)
+                if trace.type == 'GROUP':
+                    signals.extend(groups[trace.name])
+                elif type and type.struct:
+                    signals.extend(f'{trace.name}:{n}' for n in type.struct.types)
+                else:
+                    signals.append(trace.name)
+        else:
+            # the fields of structs are joined to the name with a period
+            for name, value in values.items():
+                type = types.get(value.type)
+                if type and type.struct:
+                    signals.extend(f'{name}.{t.name}' for t in type.struct.types.values())
+                else:
+                    signals.append(name)
+    info['signals'] = signals
+    return info
+
+
+# _scan_job() {{{2
+def _scan_job(path):
+    # runs in a worker process, errors are returned rather than raised
+    try:
+        return scan(path)
+    except Error as e:
+        return dict(error=e.get_message())
+    except OSError as e:
+        return dict(error=os_error(e))
+
+
+# Catalog class {{{1
+class Catalog:
+    """
+    Catalog
+
+    The PSF files found in a directory tree.
+
+    directory (str or Path):
+        The root of the tree.
+    entries (dict):
+        Maps the path of each file relative to the directory to its
+        :class:`Entry`.
+    """
+
+    def __init__(self, directory, entries=None):
+        self.directory = Path(directory)
+        self.entries = entries or {}
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def __len__(self):
+        return len(self.entries)
+
+    # build() {{{2
+    @classmethod
+    def build(cls, directory, refresh=False, jobs=1, save=True):
+        """
+        Build Catalog
+
+        Returns the catalog of a directory tree.  The saved catalog is read
+        and only those files that were added or changed since it was saved are
+        scanned.
+
+        directory (str or Path):
+            The root of the tree.
+        refresh (bool):
+            Scan every file, ignoring the saved catalog.
+        jobs (int):
+            The number of files scanned in parallel.
+        save (bool):
+            Save the catalog in the directory for next time.
+        """
+        directory = Path(directory)
+        if not directory.is_dir():
+            raise Error('not a directory.', culprit=directory)
+        previous = {} if refresh else cls.load(directory).entries
+        entries = {}
+        pending = []
+        for path in find_psf_files(directory):
+            relative = path.relative_to(directory).as_posix()
+            entry = previous.get(relative)
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            if entry and (entry.mtime, entry.size) == (stat.st_mtime_ns, stat.st_size):
+                entries[relative] = entry
+            else:
+                entries[relative] = None
+                pending.append((path, stat))
+
+        if jobs > 1 and len(pending) > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(_scan_job, [p for p, s in pending]))
+        else:
+            results = [_scan_job(p) for p, s in pending]
+        for (path, stat), info in zip(pending, results):
+            # files that could not be scanned are not scanned again until they
+            # change
+            relative = path.relative_to(directory).as_posix()
+            info = dict(dict(mtime=stat.st_mtime_ns, size=stat.st_size), **info)
+            entries[relative] = Entry(path=relative, **info)
+
+        catalog = cls(directory, entries)
+        if save and (pending or entries.keys() != previous.keys()):
+            try:
+                catalog.save()
+            except OSError as e:
+                log(os_error(e))
+        return catalog
+
+    # load() {{{2
+    @classmethod
+    def load(cls, directory):
+        """
+        Load Catalog
+
+        Returns the catalog saved in a directory, which is empty if there is
+        none or it cannot be read.
+        """
+        path = Path(directory, CATALOG_FILENAME)
+        try:
+            data = json.loads(path.read_text())
+            if data.get('version') != CATALOG_VERSION:
+                return cls(directory)
+            entries = {e['path']: Entry(**e) for e in data['files']}
+            return cls(directory, entries)
+        except OSError:
+            return cls(directory)
+        except (ValueError, KeyError, TypeError) as e:
+            log(e, culprit=path)
+            return cls(directory)
+
+    # save() {{{2
+    def save(self):
+        """
+        Save Catalog
+
+        Saves the catalog in its directory.
+        """
+        files = [
+            {k: v for k, v in e.__dict__.items() if v is not None}
+            for e in self.entries.values()
+        ]
+        data = json.dumps(dict(version=CATALOG_VERSION, files=files))
+        with atomic_write(self.directory / CATALOG_FILENAME) as f:
+            f.write(data.encode())
+
+    # find() {{{2
+    def find(self, pattern, analysis=None):
+        """
+        Find
+
+        Returns the files that contain signals whose names match a pattern,
+        as a list of (entry, names) pairs.
+
+        pattern (str):
+            The name of a signal, which may contain glob characters.
+        analysis (str):
+            Only consider files that hold this type of analysis.
+        """
+        found = []
+        for entry in self.select(analysis):
+            names = fnmatch.filter(entry.signals or [], pattern)
+            if names:
+                found.append((entry, names))
+        return found
+
+    # select() {{{2
+    def select(self, analysis=None):
+        """
+        Select
+
+        Returns the entries of the files that hold a type of analysis, or that
+        of every file that could be scanned if analysis is None.
+        """
+        return [
+            e for e in self.entries.values()
+            if not e.error and (analysis is None or e.analysis == analysis)
+        ]
+
+    # path() {{{2
+    def path(self, entry):
+        """
+        Path
+
+        Returns the path to the file described by an entry.
+        """
+        return self.directory / entry.path
@@ -0,0 +1,164 @@
+"""
+Compact Signals
+
+Stores piecewise-constant signals, such as logic nodes that sit at the rails for
+long stretches, as a list of runs: the index at which each run starts and its
+value.  The full waveform is produced only when it is needed, and edge queries
+are answered directly from the runs.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from inform import Error
+import numpy as np
+
+
+# Globals {{{1
+# a signal is stored compactly only if it has fewer runs than this fraction of
+# its points
+MAX_RUN_FRACTION = 0.25
+edges = ['rise', 'fall', 'either']
+
+
+# Runs class {{{1
+class Runs:
+    """
+    Runs
+
+    A piecewise-constant signal given as a sequence of runs.
+
+    starts (array of int):
+        The index of the first point of each run, the first is always 0.
+    values (array):
+        The value of each run.
+    length (int):
+        The number of points in the signal.
+    abscissa (array):
+        The sweep, used to convert indices to sweep values.
+    """
+
+    def __init__(self, starts, values, length, abscissa):
+        self.starts = starts
+        self.values = values
+        self.length = length
+        self.abscissa = abscissa
+
+    def __len__(self):
+        return self.length
+
+    def expand(self):
+        """
+        Expand
+
+        Returns the signal as a full array.
+        """
+        counts = np.diff(np.append(self.starts, self.length))
+        return np.repeat(self.values, counts)
+
+    def value_at(self, index):
+        """
+        Value At
+
+        Returns the values at the given indices without expanding the signal.
+        """
+        run = np.searchsorted(self.starts, index, side='right') - 1
+        return self.values[run]
+
+    def _edges(self, level, edge):
+        if edge not in edges:
+            raise Error(
+                f'unknown edge: {edge}.', codicil=f"Choose from {', '.join(edges)}."
+            )
+        if level is None:
+            level = (self.values.min() + self.values.max())/2 if len(self.values) else 0
+        before = self.values[:-1] > level
+        after = self.values[1:] > level
+        if edge == 'rise':
+            found = after & ~before
+        elif edge == 'fall':
+            found = before & ~after
+        else:
+            found = before != after
+        return self.starts[1:][found]
+
+    def transitions(self, level=None, edge='either'):
+        """
+        Transitions
+
+        Returns the sweep values at which the signal passes through a level.
+        As the signal is piecewise constant, a transition occurs at the first
+        point of the run that lies on the other side of the level.
+
+        level (float):
+            The level, by default the midpoint of the extremes of the signal.
+        edge (str):
+            'rise', 'fall' or 'either'.
+        """
+        return self.abscissa[self._edges(level, edge)]
+
+    def count(self, level=None, edge='either'):
+        """
+        Count
+
+        Returns the number of transitions through a level.
+
+        level (float):
+            The level, by default the midpoint of the extremes of the signal.
+        edge (str):
+            'rise', 'fall' or 'either'.
+        """
+        return len(self._edges(level, edge))
+
+
+# compact() {{{1
+def compact(y, abscissa, tol=0, max_fraction=MAX_RUN_FRACTION):
+    """
+    Compact
+
+    Converts a signal to runs if that substantially reduces its size.
+
+    Consecutive points whose values fall in the same bin of width tol form a
+    run, and the run takes the value of its first point, so no point changes
+    by more than tol.  The bins are centered on multiples of tol, so a signal
+    that sits near zero or near a rail that is a multiple of tol stays in one
+    bin.  If tol is zero, points must be identical to form a run and the
+    conversion is lossless.  Values that are not numbers, such as strings,
+    must also be identical to form a run.
+
+    y (array):
+        The signal, must not be complex.
+    abscissa (array):
+        The sweep.
+    tol (float):
+        The largest allowed change in any value.
+    max_fraction (float):
+        The signal is converted only if the number of runs is less than this
+        fraction of the number of points.
+
+    Returns a Runs object, or None if the signal is not worth converting.
+    """
+    y = np.asarray(y)
+    if y.ndim != 1 or len(y) < 2 or np.iscomplexobj(y):
+        return None
+    key = np.round(y/tol) if tol and y.dtype.kind in 'biuf' else y
+    starts = np.flatnonzero(key[1:] != key[:-1]) + 1
+    if len(starts) + 1 >= max_fraction*len(y):
+        return None
+    starts = np.concatenate(([0], starts))
+    return Runs(starts, y[starts], len(y), abscissa)
@@ -0,0 +1,677 @@
+# Usage {{{1
+"""
+Convert PSF Files
+
+Converts ASCII PSF files to formats that are convenient for other tools.
+
+Usage:
+    convert-psf [options] [<path>...]
+
+Options:
+    -c, --refresh-cache               refresh the cache
+    -f <path>, --psf-file <path>      PSF file
+    -t <format>, --format <format>    npz, csv, hdf5, parquet or arrow
+                                      [default: npz]
+    -o <dir>, --output <dir>          directory that receives the converted files
+    -s <names>, --signals <names>     signals to convert, separated by commas
+    -d <dtype>, --dtype <dtype>       precision of the converted signals:
+                                      float64, float32 or float16
+    -j <N>, --jobs <N>                files converted in parallel [default: 1]
+    -V, --version                     show version number and exit
+
+Each path may be a PSF file or a directory, in which case all the PSF files
+found in the directory and its subdirectories are converted.  If no paths are
+given, the PSF file used previously is converted.
+
+The converted file is named after the PSF file with a suffix that indicates the
+format added (ex: tran.tran.npz).  It is placed beside the PSF file unless an
+output directory is given, in which case the structure of the given directory
+is reproduced within the output directory.
+
+Signals may contain glob characters (ex: -s 'out*,in*').  The sweep is always
+included and is never converted to a lower precision.
+
+A file with a compressed cache is converted from the cache a block of rows at a
+time, so the signals are never held in memory in full.  Otherwise the file is
+loaded and a compressed cache written, which later conversions use.
+
+In the column-oriented formats (csv, parquet and arrow) complex signals are
+given as two columns, whose names have .real and .imag appended.  The hdf5
+format requires h5py and the parquet and arrow formats require pyarrow.
+"""
+
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .cache import ChunkedArray, current, iter_rows, open_lazily, _ordinate, _rows
+from .psf import PSF
+from .show import expand_args, get_psf_filename
+from .storage import Storage, as_dtype, complex_types
+from . import __version__, __released__
+from concurrent.futures import ProcessPoolExecutor
+from docopt import docopt
+from inform import Error, display, fatal, full_stop, os_error
+from pathlib import Path
+import numpy as np
+import pickle
+import zipfile
+
+# Globals {{{1
+DEFAULT_CHUNK = 1 << 16
+formats = {
+    'npz': '.npz',
+    'csv': '.csv',
+    'hdf5': '.h5',
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+digits = {2: 5, 4: 9, 8: 17}  # significant digits needed to reproduce a float
+extras = {
+    'h5py': 'hdf5',
+    'pyarrow': 'arrow',
+    'pandas': 'pandas',
+    'xarray': 'xarray',
+}
+
+
+# Utilities {{{1
+# require() {{{2
+def require(module):
+    """
+    Require
+
+    Imports and returns an optional module, raising an Error that gives the
+    extra to install if it is not available.
+
+    module (str):
+        The name of the module, one of h5py, pyarrow, pandas or xarray.
+    """
+    try:
+        return __import__(module)
+    except ImportError:
+        raise Error(
+            f'{module} is not installed.',
+            codicil = f'Install it using: pip install psf_utils[{extras[module]}]'
+        )
+
+
+# is_psf_file() {{{2
+def is_psf_file(path):
+    """
+    Is PSF File
+
+    True if the path is an ASCII PSF file, which is recognized by its first
+    word being HEADER.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return f.read(6) == b'HEADER'
+    except OSError:
+        return False
+
+
+# _numeric() {{{2
+def _numeric(signals):
+    # the names of the signals that hold numbers
+    return [n for n, s in signals.items() if 'string' not in (s.type.kind or '')]
+
+
+# find_psf_files() {{{2
+def find_psf_files(directory):
+    """
+    Find PSF Files
+
+    Returns the ASCII PSF files found in a directory and its subdirectories.
+    """
+    return sorted(
+        p for p in Path(directory).rglob('*')
+        if p.is_file() and p.suffix not in ('.cache', '.index') and is_psf_file(p)
+    )
+
+
+# Columns class {{{1
+class Columns:
+    """
+    Columns
+
+    The signals to be converted, presented as columns that can be read a block
+    of rows at a time.  Values are converted to the requested precision one
+    block at a time, so no full-size copy is made.
+
+    psf (PSF):
+        The PSF data.
+    names (list of str):
+        Names of the signals, all numeric signals if None.
+    dtype (str or dtype):
+        The precision of the converted signals, unchanged if None.
+    """
+
+    def __init__(self, psf, names=None, dtype=None):
+        if names is None:
+            names = _numeric(psf.signals)
+        self.sweep = psf.get_sweep(-1)
+        self.names = names
+        self.signals = [psf.get_signal(n) for n in names]
+        self.dtype = None if dtype is None else as_dtype(dtype)
+        if self.sweep:
+            self.length = len(self.sweep.abscissa)
+        else:
+            self.length = 1
+
+    def values(self, signal):
+        # returns the values of a signal as an array
+        values = signal.ordinate
+        if not self.sweep:
+            values = np.array([values])
+        return values
+
+    def dtype_of(self, signal):
+        # returns the precision of the converted values of a signal
+        return self.convert(self.values(signal)[:1]).dtype
+
+    def each(self):
+        """
+        Each
+
+        Iterates through the signals one at a time.  Yields the name and the
+        converted values of each signal.
+        """
+        for name, signal in zip(self.names, self.signals):
+            yield name, self.convert(self.values(signal))
+
+    def convert(self, values):
+        # converts a block of values to the requested precision
+        values = np.asarray(values)
+        if self.dtype is None or values.dtype.kind not in 'fc':
+            return values
+        if values.dtype.kind == 'c':
+            return values.astype(complex_types[self.dtype], copy=False)
+        return values.astype(self.dtype, copy=False)
+
+    def blocks(self, chunk=DEFAULT_CHUNK):
+        """
+        Blocks
+
+        Iterates through the rows a block at a time.  Yields the sweep values
+        for the block (None if unswept) and a list of the values of each
+        signal.
+        """
+        for start in range(0, self.length, chunk):
+            stop = min(start + chunk, self.length)
+            x = self.sweep.abscissa[start:stop] if self.sweep else None
+            yield x, [self.convert(self.values(s)[start:stop]) for s in self.signals]
+
+    def flat_names(self):
+        """
+        Flat Names
+
+        Returns the column names with complex signals split into real and
+        imaginary parts, along with a flag for each signal that indicates
+        whether it is complex.
+        """
+        names = [self.sweep.name] if self.sweep else []
+        is_complex = []
+        for name, signal in zip(self.names, self.signals):
+            cplx = self.dtype_of(signal).kind == 'c'
+            is_complex.append(cplx)
+            names.extend([f'{name}.real', f'{name}.imag'] if cplx else [name])
+        return names, is_complex
+
+
+# CachedColumns class {{{1
+class CachedColumns(Columns):
+    """
+    Cached Columns
+
+    The signals to be converted, read from a compressed cache a block of rows
+    at a time (see :func:`psf_utils.cache.iter_rows`), so only the sweep and
+    one block of the signals are held in memory.  Use :func:`cached_columns`
+    to create.
+
+    path (Path):
+        The path to the compressed cache.
+    sweep (Sweep):
+        The sweep, with its values read in full.
+    signals (dict):
+        The signals held in the cache by name.
+    dtypes (dict):
+        The precision of the values of each signal by name.
+    names (list of str):
+        Names of the signals, all numeric signals if None.
+    dtype (str or dtype):
+        The precision of the converted signals, unchanged if None.
+    """
+
+    def __init__(self, path, sweep, signals, dtypes, names=None, dtype=None):
+        if names is None:
+            names = _numeric(signals)
+        self.path = path
+        self.sweep = sweep
+        self.names = names
+        self.signals = [signals[n] for n in names]
+        self.dtype = None if dtype is None else as_dtype(dtype)
+        self.length = len(sweep.abscissa)
+        # the name and precision of each signal by its id
+        self.described = {id(signals[n]): (n, dtypes[n]) for n in names}
+
+    def dtype_of(self, signal):
+        name, dtype = self.described[id(signal)]
+        return self.convert(np.empty(0, dtype)).dtype
+
+    def each(self):
+        # the cache is opened once and the signals read from it in turn
+        with open_lazily(self.path) as attributes:
+            signals = attributes['signals']
+            for name in self.names:
+                values = _rows(_ordinate(signals, name), 0, self.length)
+                yield name, self.convert(values)
+
+    def blocks(self, chunk=DEFAULT_CHUNK):
+        for x, values in iter_rows(self.path, self.names, chunk):
+            yield x, [self.convert(values[n]) for n in self.names]
+
+
+# cached_columns() {{{2
+def cached_columns(psf_file, names=None, dtype=None):
+    """
+    Cached Columns
+
+    Returns the signals of a PSF file as columns read from its compressed
+    cache (see :class:`CachedColumns`), or None if the file has no current
+    compressed cache or the cache does not hold a single sweep.
+
+    psf_file (str or Path):
+        The path of the PSF file.
+    names (list of str):
+        Names of the signals, may contain glob characters.  All numeric signals
+        if None.
+    dtype (str or dtype):
+        The precision of the converted signals, unchanged if None.
+    """
+    psf_file = Path(psf_file)
+    cache_file = current(psf_file)
+    if cache_file is None:
+        return None
+    try:
+        with open_lazily(cache_file) as attributes:
+            sweeps = attributes.get('sweeps')
+            if not sweeps or len(sweeps) > 1:
+                return None
+            if attributes.get('storage', Storage()) != Storage():
+                return None
+            sweep = sweeps[0]
+            if isinstance(sweep.abscissa, ChunkedArray):
+                sweep.abscissa = sweep.abscissa.read()
+            signals = attributes['signals']
+            dtypes = {}
+            for name, signal in signals.items():
+                values = signal.__dict__.get('ordinate')
+                if values is None:
+                    values = signal.compact.values
+                if isinstance(values, ChunkedArray):
+                    dtypes[name] = np.dtype(values.info.dtype)
+                else:
+                    dtypes[name] = np.asarray(values).dtype
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError, Error):
+        return None     # the PSF file is read instead
+    names = _expand(signals, names, psf_file)
+    return CachedColumns(cache_file, sweep, signals, dtypes, names, dtype)
+
+
+# Writers {{{1
+# Each writer is passed the path of the output file, the columns and the chunk
+# size.
+
+# _write_npz() {{{2
+def _write_npz(path, columns, chunk):
+    # each signal is written straight into the archive, one at a time
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        if columns.sweep:
+            with archive.open(f'{columns.sweep.name}.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, columns.sweep.abscissa)
+        for name, values in columns.each():
+            with archive.open(f'{name}.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(values))
+
+
+# _write_csv() {{{2
+def _write_csv(path, columns, chunk):
+    names, is_complex = columns.flat_names()
+    with open(path, 'w') as f:
+        f.write(','.join(f'"{n}"' for n in names) + '\n')
+        for x, values in columns.blocks(chunk):
+            block = [] if x is None else [x]
+            for v, cplx in zip(values, is_complex):
+                block.extend([v.real, v.imag] if cplx else [v])
+            # use enough digits to reproduce the values exactly
+            fmt = [
+                f'%.{digits[c.dtype.itemsize]}g' if c.dtype.kind == 'f' else '%d'
+                for c in block
+            ]
+            np.savetxt(f, np.column_stack(block), delimiter=',', fmt=fmt)
+
+
+# _write_hdf5() {{{2
+def _write_hdf5(path, columns, chunk):
+    h5py = require('h5py')
+    with h5py.File(path, 'w') as f:
+        datasets = []
+        if columns.sweep:
+            sweep = columns.sweep
+            f.create_dataset(sweep.name, data=sweep.abscissa)
+            f[sweep.name].attrs['units'] = sweep.units or ''
+        for name, signal in zip(columns.names, columns.signals):
+            dtype = columns.dtype_of(signal)
+            dataset = f.create_dataset(
+                name, shape=(columns.length,), dtype=dtype,
+                chunks = (min(chunk, columns.length),),
+            )
+            dataset.attrs['units'] = signal.units or ''
+            datasets.append(dataset)
+        start = 0
+        for x, values in columns.blocks(chunk):
+            stop = start + len(values[0]) if values else start
+            for dataset, v in zip(datasets, values):
+                dataset[start:stop] = v
+            start = stop
+
+
+# _arrow_batches() {{{2
+def _arrow_batches(columns, chunk):
+    pa = require('pyarrow')
+    names, is_complex = columns.flat_names()
+    for x, values in columns.blocks(chunk):
+        arrays = [] if x is None else [pa.array(x)]
+        for v, cplx in zip(values, is_complex):
+            arrays.extend([pa.array(v.real), pa.array(v.imag)] if cplx else [pa.array(v)])
+        yield pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+# _write_parquet() {{{2
+def _write_parquet(path, columns, chunk):
+    require('pyarrow')
+    import pyarrow.parquet as pq
+    writer = None
+    try:
+        for batch in _arrow_batches(columns, chunk):
+            if writer is None:
+                writer = pq.ParquetWriter(str(path), batch.schema)
+            writer.write_batch(batch)
+    finally:
+        if writer:
+            writer.close()
+
+
+# _write_arrow() {{{2
+def _write_arrow(path, columns, chunk):
+    pa = require('pyarrow')
+    writer = None
+    try:
+        for batch in _arrow_batches(columns, chunk):
+            if writer is None:
+                writer = pa.ipc.new_file(str(path), batch.schema)
+            writer.write_batch(batch)
+    finally:
+        if writer:
+            writer.close()
+
+
+writers = {
+    'npz': _write_npz,
+    'csv': _write_csv,
+    'hdf5': _write_hdf5,
+    'parquet': _write_parquet,
+    'arrow': _write_arrow,
+}
+
+
+# convert() {{{1
+def convert(psf, path, format=None, names=None, dtype=None, chunk=DEFAULT_CHUNK):
+    """
+    Convert
+
+    Writes signals to a file in another format.  Columnar formats are written a
+    block of rows at a time.
+
+    psf (PSF):
+        The PSF data.
+    path (str or Path):
+        The path of the output file.
+    format (str):
+        One of npz, csv, hdf5, parquet or arrow.  If not given, it is inferred
+        from the suffix of path.
+    names (list of str):
+        Names of the signals, all numeric signals if None.
+    dtype (str or dtype):
+        The precision of the converted signals, unchanged if None.  The sweep
+        keeps its precision.
+    chunk (int):
+        The number of rows written at once.
+
+    Example::
+
+        >>> import numpy as np
+        >>> from psf_utils import PSF
+        >>> from psf_utils.convert import convert
+        >>> psf = PSF('samples/pnoise.raw/pss.td.pss')
+        >>> convert(psf, 'pss.npz', names=['top'], dtype='float32')
+        >>> sorted(np.load('pss.npz').files)
+        ['time', 'top']
+
+    """
+    path = Path(path)
+    write = _writer(path, format)
+    _write(write, path, Columns(psf, names, dtype), chunk)
+
+
+# _write() {{{2
+def _write(write, path, columns, chunk, culprit=None):
+    # writes the columns, a file without signals is reported rather than
+    # written, as some formats cannot represent it
+    if not columns.names:
+        raise Error('no signals to convert.', culprit=culprit)
+    write(path, columns, max(int(chunk), 1))
+
+
+# _writer() {{{2
+def _writer(path, format):
+    # returns the writer for a format, which is inferred from the suffix of
+    # path if not given
+    if format is None:
+        for format, suffix in formats.items():
+            if path.suffix == suffix:
+                break
+        else:
+            raise Error('cannot infer format from suffix.', culprit=path)
+    if format not in writers:
+        raise Error(
+            f'unknown format: {format}.', codicil=f"Choose from {', '.join(formats)}."
+        )
+    return writers[format]
+
+
+# _expand() {{{2
+def _expand(signals, names, psf_file):
+    # expands the glob characters in the names of the signals
+    if names:
+        names = expand_args(signals.keys(), names, allow_diff=False)
+        if not names:
+            raise Error('no matching signals.', culprit=psf_file)
+    return names
+
+
+# convert_file() {{{1
+def convert_file(
+    psf_file, output=None, format='npz', names=None, dtype=None, use_cache=True,
+    chunk=DEFAULT_CHUNK,
+):
+    """
+    Convert File
+
+    Reads a PSF file and writes its signals in another format.  If the file
+    has a current compressed cache, the signals are streamed from the cache a
+    block of rows at a time rather than loaded in full.  Otherwise the file is
+    loaded and a compressed cache written, so later conversions stream.
+
+    psf_file (str or Path):
+        The path of the PSF file.
+    output (str or Path):
+        The path of the output file.  By default the suffix of the format is
+        added to the path of the PSF file.
+    format (str):
+        One of npz, csv, hdf5, parquet or arrow.
+    names (list of str):
+        Names of the signals, may contain glob characters.  All numeric signals
+        are converted if None.
+    dtype (str or dtype):
+        The precision of the converted signals, unchanged if None.
+    use_cache (bool):
+        Use the cache if available.
+    chunk (int):
+        The number of rows written at once.
+
+    Returns the path of the output file.
+    """
+    psf_file = Path(psf_file)
+    if output is None:
+        output = psf_file.with_name(psf_file.name + formats[format])
+    output = Path(output)
+    write = _writer(output, format)
+    columns = cached_columns(psf_file, names, dtype) if use_cache else None
+    if columns is None:
+        psf = PSF(psf_file, sep=':', use_cache=use_cache, compress_cache=True)
+        columns = Columns(psf, _expand(psf.signals, names, psf_file), dtype)
+    _write(write, output, columns, chunk, psf_file)
+    return output
+
+
+# _convert_job() {{{2
+def _convert_job(args):
+    # runs in a worker process, errors are returned rather than raised
+    try:
+        return convert_file(*args), None
+    except Error as e:
+        return None, e.get_message()
+    except OSError as e:
+        return None, os_error(e)
+    except Exception as e:
+        # any other failure is confined to its file
+        return None, full_stop(f'unexpected error: {e.__class__.__name__}: {e}')
+
+
+# convert_files() {{{1
+def convert_files(
+    paths, output_dir=None, format='npz', names=None, dtype=None, use_cache=True,
+    jobs=1,
+):
+    """
+    Convert Files
+
+    Converts a collection of PSF files, optionally in parallel.
+
+    paths (list of str or Path):
+        PSF files or directories that contain PSF files.
+    output_dir (str or Path):
+        The directory that receives the converted files.  By default each is
+        placed beside its PSF file.  Otherwise the location of a PSF file
+        relative to the given directory is reproduced in output_dir.
+    format (str):
+        One of npz, csv, hdf5, parquet or arrow.
+    names (list of str):
+        Names of the signals, may contain glob characters.
+    dtype (str or dtype):
+        The precision of the converted signals, unchanged if None.
+    use_cache (bool):
+        Use the cache if available.
+    jobs (int):
+        The number of files converted in parallel.
+
+    Returns a list of (PSF file, output file, error message) tuples, where
+    either the output file or the error message is None.
+    """
+    if format not in formats:
+        raise Error(
+            f'unknown format: {format}.', codicil=f"Choose from {', '.join(formats)}."
+        )
+    if dtype is not None:
+        as_dtype(dtype)
+    tasks = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            found = [(f, f.relative_to(path)) for f in find_psf_files(path)]
+        else:
+            found = [(path, Path(path.name))]
+        for psf_file, relative in found:
+            output = None
+            if output_dir:
+                output = Path(output_dir) / relative
+                output = output.with_name(output.name + formats[format])
+                output.parent.mkdir(parents=True, exist_ok=True)
+            tasks.append((psf_file, output, format, names, dtype, use_cache))
+
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(_convert_job, tasks))
+    else:
+        results = [_convert_job(t) for t in tasks]
+    return [(t[0], out, err) for t, (out, err) in zip(tasks, results)]
+
+
+# convert_signals() {{{1
+def convert_signals():
+    try:
+        # process command line {{{2
+        cmdline = docopt(__doc__, version=f"{__version__} ({__released__})")
+        paths = cmdline['<path>']
+        if cmdline['--psf-file'] or not paths:
+            paths = [get_psf_filename(cmdline['--psf-file'])] + paths
+        signals = cmdline['--signals']
+        names = [s.strip() for s in signals.split(',')] if signals else None
+        use_cache = not cmdline['--refresh-cache']
+
+        # Convert {{{2
+        results = convert_files(
+            paths,
+            output_dir = cmdline['--output'],
+            format = cmdline['--format'],
+            names = names,
+            dtype = cmdline['--dtype'],
+            use_cache = use_cache,
+            jobs = int(cmdline['--jobs']),
+        )
+        if not results:
+            raise Error('no PSF files found.', culprit=paths)
+
+        # Report {{{2
+        failures = 0
+        for psf_file, output, error in results:
+            if error:
+                display(f'{psf_file}: {error}')
+                failures += 1
+            else:
+                display(f'{psf_file} → {output}')
+        if failures:
+            raise Error(f'{failures} of {len(results)} conversions failed.')
+    except ValueError as e:
+        fatal(full_stop(e))
+    except Error as e:
+        e.terminate()
+    except OSError as e:
+        fatal(os_error(e))
@@ -0,0 +1,318 @@
+# Usage {{{1
+"""
+Compare Results
+
+Compares the signals in a PSF file against those in a golden PSF file and lists
+the signals that differ by more than the tolerance.
+
+Usage:
+    diff-psf [options] <golden> [<signal>...]
+
+Options:
+    -c, --refresh-cache           refresh the cache
+    -f <path>, --psf-file <path>  PSF file
+    -a <tol>, --atol <tol>        absolute tolerance [default: 1n]
+    -r <tol>, --rtol <tol>        relative tolerance [default: 1m]
+    -n <N>, --worst <N>           number of offenders to show [default: 10]
+    -x, --exit-early              stop once a difference is found
+    -V, --version                 show version number and exit
+
+The PSF file need only be given if it differs from the one used previously.
+
+A point is in tolerance if |value − expected| ≤ atol + rtol |expected|.  If the
+sweeps of the two files differ, the signals are interpolated onto the sweep of
+the golden file.  Points of the golden sweep that are not covered by the other
+file are considered out of tolerance.  For each offending signal the point that
+is most out of tolerance is reported.
+
+The exit status is 0 if there are no differences and 1 otherwise.  A signal
+that is present in the golden file but missing from the other is a difference.
+
+A signal may contain glob characters. For examples, out* compares all signals
+that start with out.  If no signals are given, all signals are compared.
+"""
+
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .psf import PSF, Quantity
+from .resample import Interpolator
+from .show import expand_args, get_psf_filename
+from . import __version__, __released__
+from docopt import docopt
+from inform import (
+    Error, Info, display, fatal, full_stop, os_error, plural, terminate, warn
+)
+import numpy as np
+
+# Globals {{{1
+print_prec = 4
+DEFAULT_BLOCK = 64
+
+
+# Utilities {{{1
+class Difference(Info):
+    pass
+
+
+# comparable() {{{2
+def comparable(psf):
+    """
+    Comparable
+
+    Returns the names of the signals in a PSF file that hold numbers.
+    """
+    return [
+        n for n, s in psf.signals.items()
+        if 'string' not in (s.type.kind or '')
+    ]
+
+
+# _aligner() {{{2
+def _aligner(psf, golden):
+    # returns a function that maps a list of signals from psf onto the sweep of
+    # golden, along with that sweep and a mask of the points of that sweep that
+    # lie outside the sweep of psf (None if there are none)
+    sweep = psf.get_sweep(-1)
+    golden_sweep = golden.get_sweep(-1)
+    if bool(sweep) != bool(golden_sweep):
+        raise Error('cannot compare swept and unswept results.')
+    if not sweep:
+        return lambda rows: np.array([np.asarray(r) for r in rows]), None, None
+    if sweep.units != golden_sweep.units:
+        warn(f'sweep units differ ({sweep.units} != {golden_sweep.units}).')
+    x = sweep.abscissa
+    gx = golden_sweep.abscissa
+    if len(x) == len(gx) and np.array_equal(x, gx):
+        return lambda rows: np.stack(rows), golden_sweep, None
+    interpolator = Interpolator(x, gx, fill=np.nan)
+    return interpolator, golden_sweep, interpolator.outside
+
+
+# compare() {{{1
+def compare(
+    psf, golden, names=None, atol=1e-9, rtol=1e-3, worst=None,
+    early_exit=False, block=DEFAULT_BLOCK
+):
+    """
+    Compare
+
+    Compares signals against those of a golden run.  The signals are aligned to
+    the golden sweep, interpolating if needed, and compared a block of signals
+    at a time using whole-array operations.
+
+    psf (PSF):
+        The PSF data to check.
+    golden (PSF):
+        The PSF data that holds the expected values.
+    names (list of str):
+        Names of the signals to compare.  By default all numeric signals in the
+        golden file are compared.
+    atol (float):
+        The absolute tolerance.
+    rtol (float):
+        The relative tolerance, applied to the magnitude of the expected value.
+    worst (int):
+        If given, only this many of the worst offenders are returned.
+    early_exit (bool):
+        If True, the comparison stops after the first block of signals that
+        contains a difference.  Use this when only a pass/fail result is
+        needed.
+    block (int):
+        The number of signals compared at once.
+
+    Returns an Info object with the following attributes:
+
+    differences (list of Difference):
+        The signals that are out of tolerance, sorted from worst to best.  Each
+        has the attributes name, index (of the worst point), location (the
+        sweep value at the worst point, None if unswept), value, expected,
+        error (the absolute difference), ratio (the error divided by the
+        tolerance, always greater than one) and covered (False if the worst
+        point lies outside the sweep of psf, in which case value is NaN).
+    missing (list of str):
+        Signals in the golden file that are missing from psf.
+    compared (int):
+        The number of signals compared.
+    passed (bool):
+        True if there are no differences and no missing signals.
+
+    Example::
+
+        >>> from psf_utils import PSF
+        >>> from psf_utils.diff import compare
+        >>> psf = PSF('samples/pnoise.raw/pss.td.pss')
+        >>> compare(psf, psf).passed
+        True
+
+    """
+    if names is None:
+        names = comparable(golden)
+    missing = [n for n in names if n not in psf.signals]
+    names = [n for n in names if n in psf.signals]
+    for n in names:
+        golden.get_signal(n)   # raises UnknownSignal if not in golden
+    align, sweep, outside = _aligner(psf, golden)
+
+    differences = []
+    compared = 0
+    block = max(int(block), 1)
+    for start in range(0, len(names), block):
+        chunk = names[start:start + block]
+        ordinates = [psf.get_signal(n).ordinate for n in chunk]
+        golden_ordinates = [np.asarray(golden.get_signal(n).ordinate) for n in chunk]
+        # stacking a block converts every signal to complex if any is complex,
+        # the values of real signals are reported as real
+        is_complex = [
+            np.iscomplexobj(o) or np.iscomplexobj(g)
+            for o, g in zip(ordinates, golden_ordinates)
+        ]
+        values = align(ordinates)
+        expected = np.stack(golden_ordinates)
+        # equal values match, as do NaNs, even though their difference is NaN
+        # and so are equal infinities
+        with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+            match = (values == expected) | (np.isnan(values) & np.isnan(expected))
+            error = np.absolute(values - expected)
+            tolerance = atol + rtol*np.absolute(expected)
+            ratio = np.where(match, 0, error/tolerance)
+        ratio[np.isnan(ratio)] = np.inf
+        ratio = ratio.reshape(len(chunk), -1)
+        index = np.argmax(ratio, axis=1)
+        rows = np.arange(len(chunk))
+        worst_ratio = ratio[rows, index]
+        compared += len(chunk)
+
+        error = error.reshape(len(chunk), -1)
+        values = values.reshape(len(chunk), -1)
+        expected = expected.reshape(len(chunk), -1)
+        for i in np.flatnonzero(worst_ratio > 1):
+            j = index[i]
+            value, golden_value = values[i, j], expected[i, j]
+            if not is_complex[i]:
+                value, golden_value = value.real, golden_value.real
+            differences.append(Difference(
+                name = chunk[i],
+                index = j if sweep else None,
+                location = sweep.abscissa[j] if sweep else None,
+                value = value,
+                expected = golden_value,
+                error = error[i, j],
+                ratio = worst_ratio[i],
+                covered = outside is None or not outside[j],
+                units = golden.get_signal(chunk[i]).units,
+            ))
+        if early_exit and (differences or missing):
+            break
+
+    differences.sort(key=lambda d: -d.ratio)
+    if worst is not None:
+        differences = differences[:worst]
+    return Info(
+        differences = differences,
+        missing = missing,
+        compared = compared,
+        passed = not differences and not missing,
+    )
+
+
+# compare_files() {{{1
+def compare_files(psf_file, golden_file, names=None, use_cache=True, **kwargs):
+    """
+    Compare Files
+
+    Reads two PSF files and compares them.
+
+    psf_file (str or path):
+        The path to the PSF file to check.
+    golden_file (str or path):
+        The path to the golden PSF file.
+    names (list of str):
+        Names of the signals to compare, may contain glob characters.
+    use_cache (bool):
+        Use the cache if available.
+    kwargs:
+        Passed to :func:`compare`.
+    """
+    psf = PSF(psf_file, sep=':', use_cache=use_cache)
+    golden = PSF(golden_file, sep=':', use_cache=use_cache)
+    if names:
+        names = expand_args(comparable(golden), names, allow_diff=False)
+        if not names:
+            raise Error('no matches.', culprit=golden_file)
+    return compare(psf, golden, names, **kwargs)
+
+
+# diff_signals() {{{1
+def diff_signals():
+    try:
+        # process command line {{{2
+        cmdline = docopt(__doc__, version=f"{__version__} ({__released__})")
+        psf_file = get_psf_filename(cmdline['--psf-file'])
+        golden_file = cmdline['<golden>']
+        args = cmdline['<signal>']
+        use_cache = not cmdline['--refresh-cache']
+        atol = Quantity(cmdline['--atol'])
+        rtol = Quantity(cmdline['--rtol'])
+        worst = int(cmdline['--worst'])
+
+        # Compare {{{2
+        psf = PSF(psf_file, sep=':', use_cache=use_cache)
+        golden = PSF(golden_file, sep=':', use_cache=use_cache)
+        names = expand_args(comparable(golden), args, allow_diff=False) if args else None
+        if args and not names:
+            raise Error(f'{plural(args):no match/es}.', culprit=args)
+        result = compare(
+            psf, golden, names, atol, rtol, worst,
+            early_exit = cmdline['--exit-early']
+        )
+
+        # Print results {{{2
+        sweep = golden.get_sweep(-1)
+        with Quantity.prefs(map_sf=Quantity.map_sf_to_greek, prec=print_prec):
+            if result.missing:
+                display(f"missing: {', '.join(result.missing)}")
+            if result.differences:
+                width = max(len(d.name) for d in result.differences)
+            for d in result.differences:
+                units = psf.units_to_unicode(d.units)
+                # complex values are given as magnitudes, others with their sign
+                value, expected = (
+                    Quantity(np.absolute(v) if np.iscomplexobj(v) else v, units)
+                    for v in (d.value, d.expected)
+                )
+                where = ''
+                if sweep:
+                    where = f' at {Quantity(d.location, sweep.units)}'
+                if not d.covered:
+                    display(f'    {d.name:<{width}}  not covered{where}')
+                else:
+                    display(
+                        f'    {d.name:<{width}}  {value} vs {expected}{where}',
+                        f'({d.ratio:.3g}× tolerance)'
+                    )
+            if result.passed:
+                display(f'no differences in {plural(result.compared):# signal/s}.')
+        terminate(0 if result.passed else 1)
+    except ValueError as e:
+        fatal(full_stop(e))
+    except Error as e:
+        e.terminate()
+    except OSError as e:
+        fatal(os_error(e))
@@ -0,0 +1,383 @@
+"""
+Signal Expressions
+
+Compiles expressions such as (out_p-out_n)/2, V(vdd)*I(VDD:p), db(out/in) and
+deriv(v) into a plan that is evaluated with whole-array NumPy operations.
+Identical subexpressions are evaluated once, and only the signals that are
+referenced are accessed.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from inform import Error, warn
+from functools import lru_cache
+import numpy as np
+import re
+
+
+# Globals {{{1
+operators = '+ - * / ^ ( ) ,'.split()
+token_pattern = re.compile(r'''
+    \s*(?:
+        (?P<number>(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?)(?=[\s+\-*/^(),]|$)
+      | (?P<op>\*\*|[+\-*/^(),])
+      | (?P<name>[^\s+\-*/^(),]+)
+    )
+''', re.X)
+
+
+# Functions {{{1
+# Each function is given as (minimum arguments, maximum arguments, evaluator,
+# units), where the evaluator is passed the abscissa followed by the argument
+# values and units is a function that is passed the sweep units followed by
+# the argument units.
+def _deriv(x, y):
+    return np.gradient(y, x)
+
+
+def _integ(x, y):
+    dx = np.diff(x)
+    result = np.empty(len(y), dtype=np.result_type(y, float))
+    result[0] = 0
+    np.cumsum((y[1:] + y[:-1])*dx/2, out=result[1:])
+    return result
+
+
+def _db(x, y):
+    with np.errstate(divide='ignore'):
+        return 20*np.log10(np.absolute(y))
+
+
+def _same(xu, u, *args):
+    return u
+
+
+functions = {
+    'V':     (1, 2, lambda x, a, b=0: a - b,                   _same),
+    'I':     (1, 1, lambda x, a: a,                            _same),
+    'db':    (1, 1, _db,                                       lambda xu, u: 'dB'),
+    'mag':   (1, 1, lambda x, a: np.absolute(a),               _same),
+    'abs':   (1, 1, lambda x, a: np.absolute(a),               _same),
+    'ph':    (1, 1, lambda x, a: np.angle(a, deg=True),        lambda xu, u: '°'),
+    'real':  (1, 1, lambda x, a: np.real(a),                   _same),
+    'imag':  (1, 1, lambda x, a: np.imag(a),                   _same),
+    'conj':  (1, 1, lambda x, a: np.conj(a),                   _same),
+    'sqrt':  (1, 1, lambda x, a: np.sqrt(a),                   lambda xu, u: f'sqrt({u})' if u else ''),
+    'exp':   (1, 1, lambda x, a: np.exp(a),                    lambda xu, u: ''),
+    'ln':    (1, 1, lambda x, a: np.log(a),                    lambda xu, u: ''),
+    'log10': (1, 1, lambda x, a: np.log10(a),                  lambda xu, u: ''),
+    'deriv': (1, 1, _deriv,                                    lambda xu, u: _combine(u, '/', xu)),
+    'integ': (1, 1, _integ,                                    lambda xu, u: _combine(u, '*', xu)),
+    'min':   (1, 1, lambda x, a: np.min(a),                    _same),
+    'max':   (1, 1, lambda x, a: np.max(a),                    _same),
+    'mean':  (1, 1, lambda x, a: np.mean(a),                   _same),
+}
+needs_sweep = {'deriv', 'integ'}
+
+binary_operators = {
+    '+': np.add,
+    '-': np.subtract,
+    '*': np.multiply,
+    '/': np.true_divide,
+    '^': np.power,
+}
+
+
+# Utilities {{{1
+# is_expression() {{{2
+def is_expression(text):
+    """
+    Is Expression
+
+    Returns True if text should be treated as an expression rather than as a
+    signal name or glob pattern.  That is the case if it contains an operator
+    other than *, which is reserved for globbing unless some other operator or
+    a parenthesis is also present.
+    """
+    return any(c in text for c in '+-/^(),')
+
+
+# _combine() {{{2
+def _combine(a, op, b):
+    if a and b:
+        return f'{a}{op}{b}'
+    if op == '/' and b:
+        return f'1/{b}'
+    return a or b or ''
+
+
+# Parser {{{1
+# The parser converts the text into a tree of tuples:
+#     ('signal', name)
+#     ('const', value)
+#     ('neg', operand)
+#     (op, left, right)          op is one of + - * / ^
+#     ('call', name, args...)
+# Being tuples, identical subtrees compare and hash equal, which is what allows
+# common subexpressions to be recognized.
+
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = token_pattern.match(text, pos)
+            if not match or match.end() == pos:
+                self.error('unexpected character', pos)
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'op' and value == '**':
+                value = '^'
+            self.tokens.append((kind, value, match.start(kind)))
+            pos = match.end()
+        self.tokens.append(('end', None, len(text)))
+        self.index = 0
+
+    def error(self, msg, pos):
+        raise Error(
+            f'{msg}.',
+            culprit = self.text,
+            codicil = f'{self.text}\n{" "*pos}^'
+        )
+
+    def peek(self):
+        return self.tokens[self.index]
+
+    def next(self):
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def expect(self, value):
+        kind, tok, pos = self.next()
+        if tok != value or kind != 'op':
+            self.error(f"expected '{value}'", pos)
+
+    def parse(self):
+        tree = self.expr()
+        kind, value, pos = self.peek()
+        if kind != 'end':
+            self.error('unexpected text', pos)
+        return tree
+
+    def expr(self):
+        tree = self.term()
+        while self.peek()[1] in ('+', '-') and self.peek()[0] == 'op':
+            op = self.next()[1]
+            tree = (op, tree, self.term())
+        return tree
+
+    def term(self):
+        tree = self.unary()
+        while self.peek()[1] in ('*', '/') and self.peek()[0] == 'op':
+            op = self.next()[1]
+            tree = (op, tree, self.unary())
+        return tree
+
+    def unary(self):
+        kind, value, pos = self.peek()
+        if kind == 'op' and value in ('+', '-'):
+            self.next()
+            operand = self.unary()
+            return ('neg', operand) if value == '-' else operand
+        return self.power()
+
+    def power(self):
+        tree = self.atom()
+        if self.peek()[1] == '^' and self.peek()[0] == 'op':
+            self.next()
+            tree = ('^', tree, self.unary())
+        return tree
+
+    def atom(self):
+        kind, value, pos = self.next()
+        if kind == 'number':
+            return ('const', float(value))
+        if kind == 'name':
+            following = self.peek()
+            if following[0] == 'op' and following[1] == '(':
+                if value not in functions:
+                    self.error(f'unknown function: {value}', pos)
+                self.next()
+                args = [self.expr()]
+                while self.peek()[1] == ',' and self.peek()[0] == 'op':
+                    self.next()
+                    args.append(self.expr())
+                self.expect(')')
+                min_args, max_args = functions[value][:2]
+                if not min_args <= len(args) <= max_args:
+                    self.error(f'wrong number of arguments to {value}', pos)
+                return ('call', value) + tuple(args)
+            return ('signal', value)
+        if kind == 'op' and value == '(':
+            tree = self.expr()
+            self.expect(')')
+            return tree
+        if kind == 'end':
+            self.error('premature end of expression', pos)
+        self.error(f"unexpected '{value}'", pos)
+
+
+# Plan {{{1
+class Plan:
+    """
+    Evaluation Plan
+
+    A list of steps, each of which computes one distinct subexpression from
+    the results of earlier steps.  Several expressions may be compiled into
+    one plan, in which case subexpressions are shared between them.
+
+    exprs (list of str):
+        The expressions.
+
+    Once created, the following attributes are available:
+
+    steps (list):
+        The steps, each of the form (operation, operands).
+    outputs (list of int):
+        The step that produces the value of each expression.
+    signals (list of str):
+        The names of the signals referenced.
+    """
+
+    def __init__(self, exprs):
+        self.exprs = list(exprs)
+        self.steps = []
+        self.signals = []
+        self._slots = {}
+        self.outputs = [self._add(_Parser(e).parse()) for e in self.exprs]
+
+    def _add(self, tree):
+        # add the steps that compute tree, reusing those already present
+        if tree in self._slots:
+            return self._slots[tree]
+        kind = tree[0]
+        if kind == 'signal':
+            step = ('signal', tree[1])
+            if tree[1] not in self.signals:
+                self.signals.append(tree[1])
+        elif kind == 'const':
+            step = ('const', tree[1])
+        elif kind == 'call':
+            step = ('call', tree[1], tuple(self._add(a) for a in tree[2:]))
+        elif kind == 'neg':
+            step = ('neg', self._add(tree[1]))
+        else:
+            step = (kind, self._add(tree[1]), self._add(tree[2]))
+        self.steps.append(step)
+        slot = len(self.steps) - 1
+        self._slots[tree] = slot
+        return slot
+
+    def evaluate(self, psf):
+        """
+        Evaluate
+
+        Returns a list that contains a (value, units) pair for each expression.
+
+        psf (PSF):
+            The PSF data that provides the signals.
+        """
+        sweep = psf.get_sweep(-1)
+        x = sweep.abscissa if sweep else None
+        x_units = sweep.units if sweep else ''
+        values = []
+        units = []
+        for step in self.steps:
+            kind = step[0]
+            if kind == 'signal':
+                signal = psf.get_signal(step[1])
+                value = signal.ordinate
+                unit = '' if signal.units == 'Unitless' else (signal.units or '')
+            elif kind == 'const':
+                value = step[1]
+                unit = ''
+            elif kind == 'neg':
+                value = np.negative(values[step[1]])
+                unit = units[step[1]]
+            elif kind == 'call':
+                name, args = step[1], step[2]
+                if name in needs_sweep and x is None:
+                    raise Error(f'{name}() requires swept data.')
+                evaluator, unit_func = functions[name][2:]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    value = evaluator(x, *(values[a] for a in args))
+                unit = unit_func(x_units, *(units[a] for a in args))
+            else:
+                a, b = step[1], step[2]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    value = binary_operators[kind](values[a], values[b])
+                if kind in '+-':
+                    if units[a] and units[b] and units[a] != units[b]:
+                        warn(f'incompatible units ({units[a]} != {units[b]}).')
+                    unit = units[a] or units[b]
+                elif kind == '^':
+                    unit = ''
+                else:
+                    unit = _combine(units[a], kind, units[b])
+            values.append(value)
+            units.append(unit)
+        return [(values[i], units[i]) for i in self.outputs]
+
+
+# compile() {{{1
+@lru_cache(maxsize=256)
+def _compile(exprs):
+    return Plan(exprs)
+
+
+def compile(*exprs):
+    """
+    Compile
+
+    Returns the evaluation plan for one or more expressions.  Plans are cached,
+    so compiling the same expressions again is inexpensive.
+
+    exprs (str):
+        The expressions.
+
+    Example::
+
+        >>> from psf_utils.expr import compile
+        >>> plan = compile('(out_p-out_n)/2', 'db(out_p-out_n)')
+        >>> plan.signals
+        ['out_p', 'out_n']
+        >>> len(plan.steps)
+        6
+
+    """
+    return _compile(exprs)
+
+
+# evaluate() {{{1
+def evaluate(psf, *exprs):
+    """
+    Evaluate
+
+    Evaluates one or more expressions and returns a (value, units) pair for
+    each.
+
+    psf (PSF):
+        The PSF data that provides the signals.
+    exprs (str):
+        The expressions.
+    """
+    return compile(*exprs).evaluate(psf)
@@ -0,0 +1,491 @@
+"""
+Fast Reader
+
+Reads the VALUE section of a PSF file without the general parser.
+
+In a swept file, every row of the VALUE section, which holds the values of all
+signals at one point of the sweep, has the same layout.  The layout is found
+from the first row, then each value is gathered into a column across all rows
+using strided slices of the list of tokens, and the columns are converted to
+arrays in bulk.  Unswept files, such as DC operating points, hold only one row,
+which is read directly from its tokens.
+
+With nested sweeps the rows are given in blocks, each preceded by the values
+of the outer sweeps; these values are set aside and the remaining rows are read
+as usual.
+
+Properties given on individual values are redundant and are discarded, as is
+a partial last row, as occurs when a simulation is interrupted.  If the section
+does not have the expected form, :class:`Fallback` is raised, which gives the
+reason and the location of the problem, and the general parser is used
+instead.
+"""
+
+# License {{{1
+# Copyright (C) 2016-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+# Imports {{{1
+import numpy as np
+import re
+
+
+# Globals {{{1
+string = r'"(?:[^\\\n"]|\\.)*"'
+token_re = re.compile(rf'{string}|[()]|[^\s()"]+')
+prop_re = re.compile(
+    rf'PROP\(\s*(?:{string}\s+(?:{string}|[^\s()"]+)\s*)*\)'
+)
+integer_re = re.compile(r'-?[0-9]+\Z')
+SPLIT_CHUNK = 1 << 23   # characters split at a time when reporting progress
+CONVERT_CHUNK = 1 << 18  # values converted at a time
+
+
+# Fallback exception {{{1
+class Fallback(Exception):
+    """
+    Fallback
+
+    Raised when the fast reader cannot read a VALUE section.
+
+    reason (str):
+        Why the section could not be read.
+    line (int):
+        The line of the problem counted from the start of the section, where
+        the line that contains VALUE is line 0, or None if not known.
+    """
+
+    def __init__(self, reason, line=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.line = line
+
+
+# Utilities {{{1
+# is_quoted() {{{2
+def is_quoted(token):
+    return len(token) > 1 and token[0] == '"' and token[-1] == '"'
+
+
+# unquote() {{{2
+def unquote(token):
+    # the general parser simply drops the backslashes, so do the same here
+    return token[1:-1].replace('\\', '')
+
+
+# strip_props() {{{2
+def strip_props(section):
+    """
+    Strip Props
+
+    Removes properties from the values, keeping the line breaks so the
+    locations of any problems can still be reported.
+    """
+    if 'PROP(' not in section:
+        return section
+    return prop_re.sub(lambda m: '\n'*m.group().count('\n') or ' ', section)
+
+
+# tokenize() {{{2
+def tokenize(section, exact=False, report=None):
+    """
+    Tokenize
+
+    Splits the section into names, values and parentheses.  The quick form
+    pads the parentheses with spaces and splits on white space, which is only
+    correct if no quoted string contains white space or parentheses.  If
+    report is given, the section is split a piece at a time, calling report
+    with the fraction done after each piece.  Tokens never span lines, so the
+    pieces end at line breaks.
+    """
+    def split(text):
+        if exact:
+            return token_re.findall(text)
+        if '(' in text:
+            text = text.replace('(', ' ( ').replace(')', ' ) ')
+        return text.split()
+
+    if not report:
+        return split(section)
+    tokens = []
+    start = 0
+    while start < len(section):
+        stop = section.find('\n', start + SPLIT_CHUNK)
+        if stop < 0:
+            stop = len(section)
+        tokens += split(section[start:stop])
+        start = stop
+        report(start/len(section))
+    return tokens
+
+
+# _number() {{{2
+def _number(token):
+    # converts a token as does the general parser
+    if integer_re.match(token):
+        return int(token)
+    return float(token)
+
+
+# _line() {{{2
+def _line(section, tokens, index):
+    # returns the line of a token in the section, used only when reporting
+    # a problem, so speed is not a concern
+    try:
+        target = tokens[index]
+    except IndexError:
+        return section.count('\n')
+    count = tokens[:index].count(target)
+    pattern = re.compile(rf'(?<![^\s()]){re.escape(target)}(?![^\s()])')
+    for i, match in enumerate(pattern.finditer(section)):
+        if i == count:
+            return section.count('\n', 0, match.start())
+    return None
+
+
+# Swept values {{{1
+# _layout() {{{2
+def _layout(row, where):
+    # Returns the layout of a row, a list of (position, nodes) pairs, one for
+    # each trace, where position is the index of its name in the row.  A node
+    # is either the index of a value in the row or a list of nodes for
+    # a composite value.  A trace has several nodes if it is a group.  where
+    # converts the index of a token to its line in the section.
+    def node(i):
+        token = row[i]
+        if token == '(':
+            members = []
+            i += 1
+            while row[i] != ')':
+                member, i = node(i)
+                members.append(member)
+            if not members:
+                raise Fallback('empty composite value', where(i))
+            return members, i + 1
+        if token == ')':
+            raise Fallback('unbalanced parentheses', where(i))
+        return i, i + 1
+
+    layout = []
+    i = 0
+    try:
+        while i < len(row):
+            position = i
+            if not is_quoted(row[i]):
+                raise Fallback(f'expected a name, found {row[i]}', where(i))
+            first, i = node(i + 1)
+            nodes = [first]
+            # further values that are not preceded by a name belong to a group
+            while i < len(row) and not is_quoted(row[i]):
+                each, i = node(i)
+                nodes.append(each)
+            layout.append((position, nodes))
+    except IndexError:
+        raise Fallback('incomplete row', where(len(row)))
+    return layout
+
+
+# read_swept() {{{2
+def read_swept(section, storage=None, report=None):
+    """
+    Read Swept
+
+    Reads the VALUE section of a swept PSF file.
+
+    section (str):
+        The text of the section, between VALUE and END.
+    storage (Storage):
+        The precision in which to store the values of signals; the parts of
+        composite values are given in the precision of their complex type.
+    report (callable):
+        Called with the fraction of the section read as each value is
+        converted.
+
+    Returns a dictionary that maps each trace name to a list of items, one per
+    value given for the trace in a row.  An item is an array that holds the
+    value across all rows, or a list of items for a composite value.  Also
+    returns the number of rows and whether a partial last row was dropped.
+    """
+    def stage(start, stop):
+        # maps the progress of a stage onto its share of the whole
+        if report:
+            return lambda fraction: report(start + fraction*(stop - start))
+
+    section = strip_props(section)
+    try:
+        tokens = tokenize(section, report=stage(0, 0.25))
+        return _read_swept(section, tokens, storage, stage(0.25, 1))
+    except Fallback:
+        # a quoted string may contain spaces or parentheses, split exactly
+        tokens = tokenize(section, exact=True, report=stage(0, 0.25))
+        return _read_swept(section, tokens, storage, stage(0.25, 1))
+
+
+def _read_swept(section, tokens, storage, report):
+    if not tokens:
+        raise Fallback('value section is empty', 0)
+    sweep = tokens[0]
+    if not is_quoted(sweep):
+        raise Fallback(f'expected a name, found {sweep}', _line(section, tokens, 0))
+    try:
+        cycle = tokens.index(sweep, 1)
+    except ValueError:
+        cycle = len(tokens)   # a single row
+    rows, leftover = divmod(len(tokens), cycle)
+    if leftover:
+        if tokens[rows*cycle] != sweep:
+            raise Fallback(
+                'rows differ in length', _line(section, tokens, rows*cycle)
+            )
+        # a partial last row, as left by an interrupted simulation
+        del tokens[rows*cycle:]
+    row = tokens[:cycle]
+    layout = _layout(row, lambda i: _line(section, tokens, i))
+
+    def mismatch(column, index, expected):
+        bad = next(r for r, t in enumerate(column) if t != expected)
+        return Fallback(
+            f'row {bad + 1} differs from the first',
+            _line(section, tokens, bad*cycle + index)
+        )
+
+    # confirm that every row has the same names and structure as the first
+    # if each row consists of name-value pairs, all names are checked at once
+    pairs = cycle == 2*len(layout)
+    if not pairs or tokens[::2] != row[::2]*rows:
+        for index, token in enumerate(row):
+            if token in ('(', ')'):
+                column = tokens[index::cycle]
+                if column.count(token) != rows:
+                    raise mismatch(column, index, token)
+        for position, nodes in layout:
+            column = tokens[position::cycle]
+            if column.count(row[position]) != rows:
+                raise mismatch(column, position, row[position])
+
+    default = storage is None or storage.is_default()
+
+    def convert(node, dtype=float):
+        if isinstance(node, list):
+            return [convert(n, dtype) for n in node]
+        column = tokens[node::cycle]
+        if is_quoted(row[node]):
+            return np.array([unquote(t) for t in column])
+        try:
+            return np.array(column, dtype=dtype)
+        except ValueError:
+            bad = next(r for r, t in enumerate(column) if not _is_number(t))
+            raise Fallback(
+                f'unexpected value: {column[bad]}',
+                _line(section, tokens, bad*cycle + node)
+            )
+
+    values = {}
+    if default and pairs and not any(is_quoted(t) for t in row[1::2]):
+        # all values can be converted into a single array with one column per
+        # trace; this is done in blocks to allow progress to be reported, which
+        # costs nothing as numpy converts strings one at a time regardless
+        try:
+            numbers = tokens[1::2]
+            data = np.empty(len(numbers))
+            for start in range(0, len(numbers), CONVERT_CHUNK):
+                stop = start + CONVERT_CHUNK
+                data[start:stop] = np.array(numbers[start:stop], dtype=float)
+                if report:
+                    report(min(stop/len(numbers), 1))
+            del numbers
+            data = data.reshape(rows, len(layout))
+            for index, (position, nodes) in enumerate(layout):
+                values[unquote(row[position])] = [data[:, index]]
+            return values, rows, bool(leftover)
+        except ValueError:
+            pass
+    for count, (position, nodes) in enumerate(layout):
+        if report:
+            report(count/len(layout))
+        name = unquote(row[position])
+        dtype = float
+        if not default and position:
+            # signals other than the sweep may be stored in less precision,
+            # convert them directly to avoid a full size copy
+            if len(nodes) > 1:
+                # a group, the names of its members are not known here
+                dtype = storage.composite_dtype()
+            elif isinstance(nodes[0], list):
+                dtype = storage.composite_dtype(name)
+            else:
+                dtype = storage.real_dtype(name)
+        values[name] = [convert(n, dtype) for n in nodes]
+    return values, rows, bool(leftover)
+
+
+# read_nested() {{{2
+def read_nested(section, outer, storage=None, report=None):
+    """
+    Read Nested
+
+    Reads the VALUE section of a PSF file with nested sweeps, in which the rows
+    of the inner sweep are given in blocks, each preceded by the values of the
+    outer sweeps that change at the start of the block.
+
+    section (str):
+        The text of the section, between VALUE and END.
+    outer (list of str):
+        The names of the outer sweeps.
+    storage (Storage):
+        The precision in which to store the values of scalar signals.
+    report (callable):
+        Called with the fraction of the section read as each value is
+        converted.
+
+    Returns the values of the inner sweep and the traces as does
+    :func:`read_swept`, to which are added the values of the outer sweeps,
+    each an array that holds the values in the order given.  Also returns the
+    number of rows, whether a partial last row was dropped, and a dictionary
+    that maps the name of each outer sweep to an array that holds the row of
+    the inner sweep at which each of its values was given.
+    """
+    def stage(start, stop):
+        if report:
+            return lambda fraction: report(start + fraction*(stop - start))
+
+    section = strip_props(section)
+    try:
+        tokens = tokenize(section, report=stage(0, 0.25))
+        return _read_nested(section, tokens, outer, storage, stage(0.25, 1))
+    except Fallback:
+        tokens = tokenize(section, exact=True, report=stage(0, 0.25))
+        return _read_nested(section, tokens, outer, storage, stage(0.25, 1))
+
+
+def _read_nested(section, tokens, outer, storage, report):
+    where = lambda i: _line(section, tokens, i)
+
+    # find the values of the outer sweeps, each given as a name-value pair
+    positions = []
+    for name in outer:
+        quoted = f'"{name}"'
+        i = -1
+        while True:
+            try:
+                i = tokens.index(quoted, i + 1)
+            except ValueError:
+                break
+            positions.append(i)
+    if not positions:
+        raise Fallback('values of the outer sweeps not found', 0)
+    positions.sort()
+
+    # remove them, leaving the rows of the inner sweep
+    inner = []
+    found = {name: ([], []) for name in outer}
+    start = 0
+    for i in positions:
+        try:
+            value = _number(tokens[i + 1])
+        except (IndexError, ValueError):
+            raise Fallback('expected a number for the outer sweep', where(i + 1))
+        inner += tokens[start:i]
+        values, rows = found[unquote(tokens[i])]
+        values.append(value)
+        rows.append(len(inner))
+        start = i + 2
+    inner += tokens[start:]
+    if not inner:
+        raise Fallback('no values for the inner sweep', where(positions[-1]))
+    try:
+        cycle = inner.index(inner[0], 1)
+    except ValueError:
+        cycle = len(inner)
+
+    items, count, partial = _read_swept(section, inner, storage, report)
+    starts = {}
+    for name, (values, rows) in found.items():
+        rows = np.array(rows)
+        if np.any(rows % cycle):
+            raise Fallback(f'value of {name} given within a row')
+        items[name] = [np.array(values, dtype=float)]
+        starts[name] = np.minimum(rows // cycle, count)
+    return items, count, partial, starts
+
+
+def _is_number(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+# Unswept values {{{1
+# read_unswept() {{{2
+def read_unswept(section):
+    """
+    Read Unswept
+
+    Reads the VALUE section of an unswept PSF file, such as a DC operating
+    point, in which each value is given once along with its type.
+
+    Returns a list of (name, type, value) tuples, where the value takes the
+    same form as produced by the general parser: either a string or a list of
+    numbers, where composite numbers are tuples.
+    """
+    section = strip_props(section)
+    tokens = tokenize(section, exact=True)
+    n = len(tokens)
+
+    def number(i):
+        token = tokens[i]
+        if token == '(':
+            members = []
+            i += 1
+            while tokens[i] != ')':
+                member, i = number(i)
+                members.append(member)
+            return tuple(members), i + 1
+        try:
+            return _number(token), i + 1
+        except ValueError:
+            raise Fallback(f'unexpected value: {token}', _line(section, tokens, i))
+
+    records = []
+    i = 0
+    try:
+        while i < n:
+            name = tokens[i]
+            if not is_quoted(name):
+                raise Fallback(
+                    f'expected a name, found {name}', _line(section, tokens, i)
+                )
+            i += 1
+            type = None
+            if is_quoted(tokens[i]):
+                type = unquote(tokens[i])
+                i += 1
+                if i < n and is_quoted(tokens[i]):
+                    records.append((unquote(name), type, unquote(tokens[i])))
+                    i += 1
+                    continue
+            numbers = []
+            while i < n and not is_quoted(tokens[i]):
+                each, i = number(i)
+                numbers.append(each)
+            if not numbers:
+                raise Fallback('missing value', _line(section, tokens, i - 1))
+            records.append((unquote(name), type, numbers))
+    except IndexError:
+        raise Fallback('incomplete value', section.count('\n'))
+    return records
@@ -0,0 +1,265 @@
+"""
+Data Frames
+
+Adapters that present PSF data as pandas data frames and xarray datasets.
+Where possible the frames and datasets are views of the arrays already held by
+the PSF object rather than copies.  pandas and xarray are optional; they must
+be installed to use the corresponding adapters.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .convert import require
+from inform import Error
+import numpy as np
+
+
+# Utilities {{{1
+# _names() {{{2
+def _names(psf, names):
+    if names is None:
+        return [
+            n for n, s in psf.signals.items()
+            if 'string' not in (s.type.kind or '')
+        ]
+    return list(names)
+
+
+# _owner() {{{2
+def _owner(array):
+    # returns the array that owns the memory of a view
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+# as_block() {{{2
+def as_block(arrays):
+    """
+    As Block
+
+    Returns a 2D view with one column per array if the arrays are equally
+    spaced views into the memory of the same array, as are the signals produced
+    by the fast reader or the bits of a bus.  Otherwise returns None.  The
+    arrays must be given in the order in which they lie in memory.
+
+    arrays (list of arrays):
+        The 1D arrays.
+    """
+    if not arrays:
+        return None
+    first = arrays[0]
+    if len(arrays) == 1:
+        return first[:, None]
+    owner = _owner(first)
+    for a in arrays:
+        if (
+            a.ndim != 1 or a.dtype != first.dtype or a.shape != first.shape
+            or a.strides != first.strides or _owner(a) is not owner
+        ):
+            return None
+    addresses = [a.__array_interface__['data'][0] for a in arrays]
+    steps = set(np.diff(addresses).tolist())
+    if len(steps) != 1:
+        return None
+    step = steps.pop()
+    if step <= 0:
+        return None
+    # each element of the block is an element of one of the arrays, so the
+    # block only touches memory that is already in use
+    return np.lib.stride_tricks.as_strided(
+        first, shape=(len(first), len(arrays)),
+        strides=(first.strides[0], step), writeable=False,
+    )
+
+
+# _ordered() {{{2
+def _ordered(psf, names):
+    # returns the names and ordinates sorted by their location in memory
+    ordinates = [np.asarray(psf.get_signal(n).ordinate) for n in names]
+    order = sorted(
+        range(len(names)), key=lambda i: ordinates[i].__array_interface__['data'][0]
+    )
+    return [names[i] for i in order], [ordinates[i] for i in order]
+
+
+# to_pandas() {{{1
+def to_pandas(psf, names=None):
+    """
+    To Pandas
+
+    Returns the signals as a pandas DataFrame indexed by the sweep.  If the
+    signals lie in a single block of memory, as is the case for files read by
+    the fast reader, the data frame is a view of that block.  Unswept data is
+    returned as a Series indexed by signal name.
+
+    psf (PSF):
+        The PSF data.
+    names (list of str):
+        Names of the signals, all numeric signals if None.
+    """
+    pd = require('pandas')
+    names = _names(psf, names)
+    sweep = psf.get_sweep(-1)
+    if not sweep:
+        return pd.Series([psf.get_signal(n).ordinate for n in names], index=names)
+    index = pd.Index(sweep.abscissa, name=sweep.name, copy=False)
+    ordered, ordinates = _ordered(psf, names)
+    block = as_block(ordinates)
+    if block is not None:
+        frame = pd.DataFrame(block, index=index, columns=ordered, copy=False)
+        return frame[names] if ordered != names else frame
+    return pd.DataFrame(dict(zip(ordered, ordinates)), index=index, copy=False)[names]
+
+
+# to_xarray() {{{1
+def to_xarray(psf, names=None):
+    """
+    To Xarray
+
+    Returns the signals as an xarray Dataset whose coordinate is the sweep.
+    Each variable wraps the ordinate of its signal without copying and carries
+    its units as an attribute.  With nested sweeps, each variable has one
+    dimension per sweep (see :meth:`psf_utils.PSF.get_array`).
+
+    psf (PSF):
+        The PSF data.
+    names (list of str):
+        Names of the signals, all numeric signals if None.
+    """
+    xr = require('xarray')
+    names = _names(psf, names)
+    if len(psf.sweeps or []) > 1:
+        return _nested_to_xarray(xr, psf, names)
+    sweep = psf.get_sweep(-1)
+    dims = (sweep.name,) if sweep else ()
+    variables = {}
+    for name in names:
+        signal = psf.get_signal(name)
+        variables[name] = xr.Variable(
+            dims, np.asarray(signal.ordinate), attrs={'units': signal.units or ''}
+        )
+    coords = {}
+    if sweep:
+        coords[sweep.name] = xr.Variable(
+            dims, sweep.abscissa, attrs={'units': sweep.units or ''}
+        )
+    return xr.Dataset(variables, coords=coords, attrs=dict(psf.meta or {}))
+
+
+def _nested_to_xarray(xr, psf, names):
+    variables = {}
+    coords = {}
+    for name in names:
+        array = psf.get_array(name)
+        variables[name] = xr.Variable(
+            array.dims, array.ordinate, attrs={'units': array.units or ''}
+        )
+        for axis in array.axes:
+            attrs = {'units': axis.units or ''}
+            if np.ndim(axis.values) == 1:
+                coords[axis.name] = xr.Variable((axis.name,), axis.values, attrs=attrs)
+            else:
+                # an inner sweep that differs between blocks cannot be an
+                # index, so it is given under another name
+                coords[f'{axis.name}_values'] = xr.Variable(
+                    array.dims, axis.values, attrs=attrs
+                )
+    return xr.Dataset(variables, coords=coords, attrs=dict(psf.meta or {}))
+
+
+# stack_runs() {{{1
+def stack_runs(psfs, names=None):
+    """
+    Stack Runs
+
+    Gathers the signals of several runs that share a sweep, such as the runs of
+    a Monte Carlo analysis, into 2D arrays with one row per run.  The signals of
+    each run are then replaced by views of the rows, so the data is not
+    duplicated.
+
+    psfs (list of PSF):
+        The runs.
+    names (list of str):
+        Names of the signals, all numeric signals of the first run if None.
+
+    Returns the common sweep values and a dictionary that maps each name to its
+    2D array.
+    """
+    if not psfs:
+        raise Error('no runs to stack.')
+    sweeps = [p.get_sweep(-1) for p in psfs]
+    if not all(sweeps):
+        raise Error('stacking requires swept data.')
+    abscissa = sweeps[0].abscissa
+    for sweep in sweeps[1:]:
+        if not np.array_equal(sweep.abscissa, abscissa):
+            raise Error(
+                'runs have different sweeps.',
+                codicil = 'Use psf.resample() to place them on a common grid.'
+            )
+    names = _names(psfs[0], names)
+    stacked = {}
+    for name in names:
+        signals = [p.get_signal(name) for p in psfs]
+        dtype = np.result_type(*[s.ordinate for s in signals])
+        block = np.empty((len(psfs), len(abscissa)), dtype=dtype)
+        for row, signal in zip(block, signals):
+            row[:] = signal.ordinate
+        for row, signal in zip(block, signals):
+            signal.ordinate = row
+        stacked[name] = block
+    for sweep in sweeps[1:]:
+        sweep.abscissa = abscissa
+    return abscissa, stacked
+
+
+# runs_to_xarray() {{{1
+def runs_to_xarray(psfs, names=None, runs=None):
+    """
+    Runs to Xarray
+
+    Returns an xarray Dataset in which each signal has a run dimension in
+    addition to the sweep.  The runs are stacked using :func:`stack_runs`, so
+    the data is held once and shared between the dataset and the PSF objects.
+
+    psfs (list of PSF):
+        The runs.
+    names (list of str):
+        Names of the signals, all numeric signals of the first run if None.
+    runs (list):
+        Labels for the runs, 0, 1, 2, ... if None.
+    """
+    xr = require('xarray')
+    abscissa, stacked = stack_runs(psfs, names)
+    sweep = psfs[0].get_sweep(-1)
+    dims = ('run', sweep.name)
+    variables = {
+        name: xr.Variable(
+            dims, block, attrs={'units': psfs[0].get_signal(name).units or ''}
+        )
+        for name, block in stacked.items()
+    }
+    coords = {
+        'run': np.arange(len(psfs)) if runs is None else list(runs),
+        sweep.name: xr.Variable(
+            (sweep.name,), abscissa, attrs={'units': sweep.units or ''}
+        ),
+    }
+    return xr.Dataset(variables, coords=coords)
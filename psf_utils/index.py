@@ -0,0 +1,287 @@
+"""
+Row Index for ASCII PSF Files
+
+Records the byte offset of every k-th row of the VALUE section, along with the
+value of the abscissa at that row, so that the file can be entered at an
+arbitrary row without first parsing all the rows that precede it.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .cache import atomic_write
+from inform import Error, log, os_error
+from pathlib import Path
+import numpy as np
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import re
+
+
+# Globals {{{1
+DEFAULT_STRIDE = 1024
+INDEX_VERSION = 1
+sweep_section = re.compile(rb'^SWEEP\s*$', re.M)
+value_section = re.compile(rb'^VALUE\s*$', re.M)
+end_section = re.compile(rb'^END\s*$', re.M)
+first_name = re.compile(rb'\s*("([^\\\n"]|(\\.))*")')
+
+
+# Utilities {{{1
+def index_filepath(psf_filepath):
+    """
+    Index File Path
+
+    Returns the path to the index file that accompanies the given PSF file.  It
+    is placed beside the cache file.
+    """
+    psf_filepath = Path(psf_filepath)
+    return psf_filepath.with_suffix(psf_filepath.suffix + '.index')
+
+
+# RowIndex class {{{1
+class RowIndex:
+    """
+    Row Index
+
+    Holds the byte offset of every k-th row of the VALUE section of a swept
+    ASCII PSF file.  A row starts with the value of the sweep variable, and the
+    value of the sweep variable at each indexed row is also retained, which
+    allows a range of the abscissa to be mapped to a range of bytes.
+
+    stride (int):
+        The number of rows between indexed rows.
+    offsets (array of int):
+        Byte offsets of the indexed rows, measured from the start of the file.
+    abscissa (array of float):
+        The value of the sweep variable at each indexed row.
+    rows (int):
+        The total number of rows in the VALUE section.
+    end (int):
+        The byte offset of the END that terminates the VALUE section.
+    """
+
+    def __init__(self, stride, offsets, abscissa, rows, end, mtime=None, size=None):
+        self.stride = stride
+        self.offsets = offsets
+        self.abscissa = abscissa
+        self.rows = rows
+        self.end = end
+        self.mtime = mtime
+        self.size = size
+
+    # build() {{{2
+    @classmethod
+    def build(cls, data, stride=DEFAULT_STRIDE):
+        """
+        Build Index
+
+        data (bytes):
+            Contents of the PSF file.
+        stride (int):
+            The number of rows between indexed rows.
+
+        Returns None if the file does not contain a swept VALUE section.
+        """
+        if not sweep_section.search(data):
+            return None
+        match = value_section.search(data)
+        if not match:
+            return None
+        start = match.end()
+        match = end_section.search(data, start)
+        end = match.start() if match else len(data)
+
+        # the first name found in the VALUE section is the sweep name; every
+        # row starts with it
+        match = first_name.match(data, start)
+        if not match:
+            return None
+        prefix = match.group(1) + b' '
+        start = match.start(1)
+
+        # locate the line starts and keep those that start a row
+        buf = np.frombuffer(data, dtype=np.uint8, count=end)
+        bol = np.flatnonzero(buf[start:end] == ord('\n')) + start + 1
+        bol = np.concatenate(([start], bol))
+        bol = bol[bol + len(prefix) <= end]
+        is_row = np.ones(len(bol), dtype=bool)
+        for i, c in enumerate(prefix):
+            is_row &= buf[bol + i] == c
+        row_starts = bol[is_row]
+
+        # keep every k-th row and convert the sweep value at each
+        offsets = row_starts[::stride].astype(np.int64)
+        abscissa = np.empty(len(offsets))
+        for i, offset in enumerate(offsets):
+            value_start = offset + len(prefix)
+            value_end = data.find(b'\n', value_start, end)
+            if value_end < 0:
+                value_end = end
+            token = data[value_start:value_end].split()
+            try:
+                abscissa[i] = float(token[0])
+            except (IndexError, ValueError):
+                abscissa[i] = np.nan
+        return cls(stride, offsets, abscissa, len(row_starts), end)
+
+    # save() {{{2
+    def save(self, path, psf_filepath=None):
+        """
+        Save Index
+
+        path (str or Path):
+            Path to the index file.
+        psf_filepath (str or Path):
+            Path to the corresponding PSF file.  If given, its modification time
+            and size are recorded so that a stale index can be recognized.
+        """
+        if psf_filepath:
+            stat = Path(psf_filepath).stat()
+            self.mtime = stat.st_mtime
+            self.size = stat.st_size
+        with atomic_write(path) as f:
+            pickle.dump(
+                (INDEX_VERSION, self.__dict__), f, pickle.HIGHEST_PROTOCOL
+            )
+
+    # load() {{{2
+    @classmethod
+    def load(cls, path, psf_filepath=None):
+        """
+        Load Index
+
+        path (str or Path):
+            Path to the index file.
+        psf_filepath (str or Path):
+            Path to the corresponding PSF file.  If given, None is returned if
+            the index is stale.
+        """
+        with open(path, 'rb') as f:
+            version, attributes = pickle.load(f)
+        if version != INDEX_VERSION:
+            return None
+        index = cls.__new__(cls)
+        index.__dict__ = attributes
+        if psf_filepath:
+            stat = Path(psf_filepath).stat()
+            if (stat.st_mtime, stat.st_size) != (index.mtime, index.size):
+                return None
+        return index
+
+    # locate_row() {{{2
+    def locate_row(self, row):
+        """
+        Locate Row
+
+        Returns the number and byte offset of the indexed row that is closest
+        to, but not after, the given row.  Parsing may start at the returned
+        offset and will reach the desired row after skipping the difference.
+
+        row (int):
+            The desired row.  Negative values count from the end.
+        """
+        if row < 0:
+            row += self.rows
+        if not 0 <= row < self.rows:
+            raise IndexError(row)
+        k = row // self.stride
+        return k * self.stride, int(self.offsets[k])
+
+    # locate() {{{2
+    def locate(self, x):
+        """
+        Locate Abscissa
+
+        Returns the number and byte offset of the last indexed row whose sweep
+        value does not exceed x.  Assumes the sweep is ascending.
+
+        x (float):
+            The desired value of the sweep variable.
+        """
+        k = max(int(np.searchsorted(self.abscissa, x, side='right')) - 1, 0)
+        return k * self.stride, int(self.offsets[k])
+
+    # window() {{{2
+    def window(self, start=None, stop=None):
+        """
+        Window
+
+        Returns the first row number along with the byte offsets that bracket
+        the rows needed to cover the given range of the sweep variable.  The
+        range is widened to the nearest indexed rows, so the returned rows are
+        a superset of those requested.
+
+        start (float):
+            Lower bound of the sweep range, if None the first row is used.
+        stop (float):
+            Upper bound of the sweep range, if None the last row is used.
+        """
+        if start is None:
+            first_row, begin = 0, int(self.offsets[0])
+        else:
+            first_row, begin = self.locate(start)
+        end = self.end
+        if stop is not None:
+            k = int(np.searchsorted(self.abscissa, stop, side='right'))
+            if k < len(self.offsets):
+                end = int(self.offsets[k])
+        return first_row, begin, end
+
+
+# get_row_index() {{{1
+def get_row_index(filename, stride=DEFAULT_STRIDE, update=True):
+    """
+    Get Row Index
+
+    Returns the row index for a PSF file.  The saved index is used if it is
+    current, otherwise the index is built from the PSF file and, if *update* is
+    true, saved for next time.  Returns None if the file has no swept VALUE
+    section.
+
+    filename (str or Path):
+        Path to ASCII PSF file.
+    stride (int):
+        The number of rows between indexed rows, used only if the index must be
+        built.
+    update (bool):
+        Save a newly built index.
+    """
+    psf_filepath = Path(filename)
+    path = index_filepath(psf_filepath)
+    try:
+        index = RowIndex.load(path, psf_filepath)
+        if index:
+            return index
+    except OSError:
+        pass
+    except Exception as e:
+        log(e)
+
+    try:
+        index = RowIndex.build(psf_filepath.read_bytes(), stride)
+    except OSError as e:
+        raise Error(os_error(e))
+    if index and update:
+        try:
+            index.save(path, psf_filepath)
+        except OSError as e:
+            log(os_error(e))
+    return index
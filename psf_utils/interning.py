@@ -0,0 +1,387 @@
+"""
+Interning
+
+Shares identical data between PSF objects, so that a session that opens many
+files from the same run uses memory in proportion to the distinct data rather
+than to the number of files.  Interning is requested with the *intern* argument
+of :class:`psf_utils.PSF`.
+
+Sweeps are identified by a hash of their values.  The first PSF object to load
+a particular sweep registers its array and later objects whose sweeps have the
+same values use that array instead of their own.  Shared arrays are made
+read-only, as a change to one would otherwise appear in every object that
+shares it.  An array is dropped from the registry once no PSF object uses it.
+Headers and types remain private to each PSF object, so they may be modified
+freely, but the strings they hold are shared.
+
+Caches are likewise deduplicated.  Large sweeps are written once to a store,
+the .psf_sweeps directory beside the PSF files, and the caches of the files
+refer to them by hash.  When a cache is read, a sweep that is already held by
+another PSF object is not read again.  This applies to the pickled cache; the
+compressed cache stores sweeps efficiently by itself (see
+:mod:`psf_utils.cache`).  Sweeps that are no longer used by any cache are
+removed from the store when a cache in the directory is written.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .cache import MIN_SIZE, atomic_write
+from contextlib import contextmanager
+from pathlib import Path
+import hashlib
+import json
+import numpy as np
+import os
+import pickle
+import sys
+import threading
+import time
+import weakref
+
+
+# Globals {{{1
+STORE_DIRNAME = '.psf_sweeps'
+REFERENCES_FILENAME = 'references'
+LOCK_FILENAME = 'lock'
+GRACE = 60          # age in seconds before an unused sweep may be removed
+_arrays = weakref.WeakValueDictionary()     # shared arrays by digest
+_keys = {}          # digests of the shared arrays by id
+_lock = threading.Lock()
+_store_lock = threading.Lock()  # serializes updates of the references
+
+
+# Utilities {{{1
+# digest() {{{2
+def digest(array):
+    """
+    Digest
+
+    Returns a hash of the type, shape and values of an array.
+    """
+    hash = hashlib.blake2b(digest_size=16)
+    hash.update(f'{array.dtype.str} {array.shape}'.encode())
+    hash.update(np.ascontiguousarray(array).data)
+    return hash.hexdigest()
+
+
+# share_array() {{{2
+def share_array(array, key=None):
+    """
+    Share Array
+
+    Returns the registered array with the same values, registering this one
+    if there is none.  A registered array is read-only.
+
+    array (array):
+        The array.
+    key (str):
+        The digest of the array, computed if not given.
+    """
+    if not isinstance(array, np.ndarray) or array.dtype.kind not in 'fciu':
+        return array
+    with _lock:
+        known = _keys.get(id(array))
+    if known and _arrays.get(known) is array:
+        return array    # already shared
+    key = key or digest(array)
+    with _lock:
+        shared = _arrays.get(key)
+        if shared is None:
+            array.flags.writeable = False
+            _arrays[key] = shared = array
+            _keys[id(array)] = key
+            weakref.finalize(array, _forget, id(array))
+    return shared
+
+
+def _forget(ident):
+    with _lock:
+        _keys.pop(ident, None)
+
+
+# _intern() {{{2
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+# share_header() {{{2
+def share_header(meta):
+    """
+    Share Header
+
+    Replaces the keys and values of a header with shared copies of the same
+    strings.  The header itself is modified in place, so it remains private to
+    its PSF object.
+    """
+    if meta:
+        items = [(_intern(k), _intern(v)) for k, v in meta.items()]
+        meta.clear()
+        meta.update(items)
+    return meta
+
+
+# share_type() {{{2
+def share_type(type, done=None):
+    """
+    Share Type
+
+    Replaces the string attributes of a type, and of the members of a struct
+    type, with shared copies of the same strings.  The type is modified in
+    place.
+    """
+    done = set() if done is None else done
+    if id(type) in done or not hasattr(type, '__dict__'):
+        return type     # as with groups, given as a name
+    done.add(id(type))
+    attributes = type.__dict__
+    for name, value in attributes.items():
+        attributes[name] = _intern(value)
+    struct = attributes.get('struct')
+    if struct and getattr(struct, 'types', None):
+        for member in struct.types.values():
+            share_type(member, done)
+    return type
+
+
+# share_psf() {{{2
+def share_psf(psf):
+    """
+    Share PSF
+
+    Replaces the sweeps of a PSF object with shared equivalents and shares the
+    strings of its header and types.
+    """
+    share_header(psf.meta)
+    done = set()
+    for type in (psf.types or {}).values():
+        share_type(type, done)
+
+    arrays = {}     # shared versions of sweeps by id
+    for sweep in psf.sweeps or []:
+        abscissa = sweep.abscissa
+        if isinstance(abscissa, np.ndarray):
+            sweep.abscissa = arrays[id(abscissa)] = share_array(abscissa)
+
+    for signal in psf.signals.values():
+        runs = signal.__dict__.get('compact')
+        if runs is not None and id(runs.abscissa) in arrays:
+            runs.abscissa = arrays[id(runs.abscissa)]
+
+
+# Sweep store {{{1
+# _Pickler class {{{2
+class _Pickler(pickle.Pickler):
+    # diverts large sweeps into the store
+    def __init__(self, stream, store, sweeps):
+        super().__init__(stream, pickle.HIGHEST_PROTOCOL)
+        self.store = store
+        self.sweeps = {id(s): s for s in sweeps}
+        self.keys = {}
+
+    def persistent_id(self, obj):
+        if id(obj) not in self.sweeps:
+            return None
+        key = self.keys.get(id(obj))
+        if key is None:
+            key = self.keys[id(obj)] = self.store.put(obj)
+        return ('sweep', key)
+
+
+# _Unpickler class {{{2
+class _Unpickler(pickle.Unpickler):
+    # retrieves sweeps from the store, or from memory if already loaded
+    def __init__(self, stream, store, share):
+        super().__init__(stream)
+        self.store = store
+        self.share = share
+
+    def persistent_load(self, pid):
+        kind, key = pid
+        if kind != 'sweep':
+            raise pickle.UnpicklingError(f'unknown persistent id: {kind}.')
+        return self.store.get(key, self.share)
+
+
+# SweepStore class {{{2
+class SweepStore:
+    """
+    Sweep Store
+
+    A directory that holds the sweeps shared by the caches of the PSF files in
+    a directory, each in a NumPy file named after its digest.  The store also
+    records the sweeps used by each cache so that those no longer used can be
+    removed.
+
+    directory (str or Path):
+        The directory that holds the PSF files.
+    """
+
+    def __init__(self, directory):
+        self.path = Path(directory) / STORE_DIRNAME
+
+    def put(self, array):
+        """
+        Put
+
+        Adds an array to the store if not already present and returns its
+        digest.
+        """
+        key = digest(array)
+        path = self.path / f'{key}.npy'
+        try:
+            # an existing file is touched so it is not pruned before the cache
+            # that uses it is recorded
+            os.utime(path)
+        except FileNotFoundError:
+            self.path.mkdir(exist_ok=True)
+            with atomic_write(path) as f:
+                np.save(f, array, allow_pickle=False)
+        return key
+
+    def get(self, key, share=True):
+        """
+        Get
+
+        Returns the array with the given digest.
+
+        key (str):
+            The digest of the array.
+        share (bool):
+            If True, the array is shared (see :func:`share_array`) and is only
+            read from the store if it is not already in memory.  Otherwise a
+            private, writable copy is read.
+        """
+        if share:
+            with _lock:
+                shared = _arrays.get(key)
+            if shared is not None:
+                return shared
+        array = np.load(self.path / f'{key}.npy', allow_pickle=False)
+        return share_array(array, key) if share else array
+
+    def dump(self, attributes, stream):
+        """
+        Dump
+
+        Pickles the attributes of a PSF object to a stream, placing its large
+        sweeps in the store, and returns the digests of those sweeps.  Pass
+        them to :meth:`record` once the cache is complete.
+        """
+        sweeps = [
+            s.abscissa for s in attributes.get('sweeps') or []
+            if isinstance(s.abscissa, np.ndarray) and s.abscissa.size >= MIN_SIZE
+        ]
+        pickler = _Pickler(stream, self, sweeps)
+        pickler.dump(attributes)
+        return list(pickler.keys.values())
+
+    def load(self, stream, share=True):
+        """
+        Load
+
+        Unpickles the attributes of a PSF object from a stream written by
+        :meth:`dump`, or by :func:`pickle.dump`.
+
+        stream (file):
+            The stream.
+        share (bool):
+            Whether the sweeps read from the store are shared (see
+            :meth:`get`).
+        """
+        return _Unpickler(stream, self, share).load()
+
+    def record(self, cache, keys):
+        """
+        Record
+
+        Records the sweeps used by a cache, replacing those it used before, and
+        removes the sweeps no longer used by any cache (see :meth:`prune`).
+
+        cache (str):
+            The name of the cache file, which is in the directory of the store.
+        keys (list of str):
+            The digests of the sweeps used by the cache, empty if it uses none.
+        """
+        if not keys and not self.path.exists():
+            return
+        with self._locked():
+            references = self._read_references()
+            if keys:
+                references[cache] = sorted(set(keys))
+            else:
+                references.pop(cache, None)
+            self._prune(references)
+
+    def prune(self):
+        """
+        Prune
+
+        Removes the sweeps that are not used by any cache, either because the
+        cache was rewritten without them or because it was removed.  Sweeps
+        added within the last *GRACE* seconds are kept, as the cache that uses
+        them may still be in the process of being written.
+        """
+        if self.path.exists():
+            with self._locked():
+                self._prune(self._read_references())
+
+    @contextmanager
+    def _locked(self):
+        # serializes updates of the references by the threads of this process
+        # and, where file locks are available, by other processes, so that
+        # none are lost when several caches in the directory are written
+        with _store_lock:
+            try:
+                import fcntl
+                lock = open(self.path / LOCK_FILENAME, 'a')
+            except (ImportError, OSError):
+                yield
+                return
+            with lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                yield   # the lock is released when the file is closed
+
+    def _read_references(self):
+        try:
+            return json.loads((self.path / REFERENCES_FILENAME).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _prune(self, references):
+        directory = self.path.parent
+        references = {
+            cache: keys for cache, keys in references.items()
+            if (directory / cache).exists()
+        }
+        used = set(k for keys in references.values() for k in keys)
+        now = time.time()
+        try:
+            for path in self.path.glob('*.npy'):
+                if path.stem not in used and now - path.stat().st_mtime >= GRACE:
+                    path.unlink()
+            if references:
+                with atomic_write(self.path / REFERENCES_FILENAME) as f:
+                    f.write(json.dumps(references).encode())
+            else:
+                try:
+                    (self.path / REFERENCES_FILENAME).unlink()
+                except FileNotFoundError:
+                    pass
+        except OSError:
+            pass    # pruning is left to the next cache written
@@ -9,7 +9,11 @@ Usage:
 Options:
     -c, --refresh-cache           refresh the cache
     -f <path>, --psf-file <path>  the path of the ASCII PSF file
+    -C <dir>, --catalog <dir>     list the PSF files in a directory tree
+    -j <N>, --jobs <N>            files scanned in parallel [default: 1]
     -l, --long                    include signal meta data
+    --profile                     report the time taken to load the data
+    --progress                    show the progress of loading the data
     -V, --version                 show version number and exit
 
 The PSF file need only be given if it differs from the one used previously.
@@ -17,6 +21,15 @@ The PSF file need only be given if it differs from the one used previously.
 Reading large ASCII data files is slow, so list-psf reads the PSF file once,
 then pickles the data and writes it to disk. On subsequent runs the pickled data
 is used if the pickle file is newer that the corresponding PSF file.
+If psf-server is running, list-psf gets the data from it instead.
+Type Ctrl-C to abandon a load; the cache is only replaced once it has been
+written in full.
+
+With --catalog, the PSF files found in a directory and its subdirectories are
+listed along with their analyses and sweeps, or if signals are given, the files
+that contain those signals.  Only the headers of the files are read.  The
+catalog is saved in the directory as .psf_catalog and afterwards only files
+that have changed are scanned again, unless --refresh-cache is given.
 """
 
 # License {{{1
@@ -37,11 +50,13 @@ is used if the pickle file is newer that the corresponding PSF file.
 
 
 # Imports {{{1
-from .show import expand_args, get_psf_filename
-from .psf import PSF
+from .show import expand_args, fetch, get_psf_filename
+from .progress import ProgressBar
+from .catalog import Catalog
+from .psf import PSF, Quantity
 from . import __version__, __released__
 from docopt import docopt
-from inform import Error, columns, display, plural, warn
+from inform import Error, columns, display, done, plural, warn
 import warnings
 
 # Globals {{{1
@@ -59,6 +74,45 @@ kinds = {
 }
 
 
+# list_catalog() {{{1
+def list_catalog(directory, args, refresh, jobs):
+    catalog = Catalog.build(directory, refresh=refresh, jobs=jobs)
+    if not catalog:
+        raise Error('no PSF files found.', culprit=directory)
+    entries = sorted(catalog, key=lambda e: e.path)
+
+    if args:
+        # list the files that contain the signals
+        found = False
+        for entry in entries:
+            names = expand_args(entry.signals or [], args, allow_diff=False)
+            if names:
+                found = True
+                display(f'{entry.path} ({entry.analysis}):')
+                display(columns(names))
+        if not found:
+            raise Error(f'{plural(args):no match/es}.', culprit=args)
+        return
+
+    # list the files along with their analyses
+    width = max(len(e.path) for e in entries)
+    for entry in entries:
+        if entry.error:
+            summary = 'error: ' + entry.error.split('\n')[0]
+        else:
+            parts = [entry.analysis or 'unknown']
+            if entry.sweep:
+                with Quantity.prefs(prec=3):
+                    start = Quantity(entry.start, entry.units)
+                    stop = Quantity(entry.stop, entry.units)
+                    parts.append(
+                        f'{entry.sweep} = {start} to {stop} ({entry.rows} points)'
+                    )
+            parts.append(f'{plural(entry.signals):# signal/s}')
+            summary = ', '.join(parts)
+        display(f'{entry.path:<{width}}  {summary}')
+
+
 # list_signals() {{{1
 def list_signals():
     # Read command line {{{2
@@ -66,13 +120,32 @@ def list_signals():
     args = cmdline['<signal>']
     if not args:
         args = ['*']
-    psf_file = get_psf_filename(cmdline['--psf-file'])
     show_meta = cmdline['--long']
     use_cache = not cmdline['--refresh-cache']
 
+    # List files {{{2
+    if cmdline['--catalog']:
+        try:
+            list_catalog(
+                cmdline['--catalog'], cmdline['<signal>'], not use_cache,
+                int(cmdline['--jobs']),
+            )
+        except Error as e:
+            e.terminate()
+        except KeyboardInterrupt:
+            done()
+        return
+    psf_file = get_psf_filename(cmdline['--psf-file'])
+
     # List signals {{{2
     try:
-        psf = PSF(psf_file, sep=':', use_cache=use_cache)
+        psf = fetch(psf_file, sep=':', use_cache=use_cache)
+        if psf is None:
+            # the server is not running, so load the data here
+            with ProgressBar(enabled=cmdline['--progress']) as progress:
+                psf = PSF(psf_file, sep=':', use_cache=use_cache, progress=progress)
+        if cmdline['--profile']:
+            display(psf.load_stats.summary())
 
         if show_meta:
             nw = uw = kw = 0  # name width, units width, kind width
@@ -112,3 +185,5 @@ def list_signals():
             display(columns(signals))
     except Error as e:
         e.terminate()
+    except KeyboardInterrupt:
+        done()
@@ -0,0 +1,1004 @@
+# Usage {{{1
+"""
+Measure Signals
+
+Apply a waveform measurement to one or more signals and print the results as a
+table.
+
+Usage:
+    measure-psf [options] <measurement> [<signal>...]
+
+Options:
+    -c, --refresh-cache           refresh the cache
+    -f <path>, --psf-file <path>  PSF file
+    -l <val>, --level <val>       threshold level (default is the midpoint)
+    -e <edge>, --edge <edge>      edge: rise, fall or either [default: rise]
+    -n <num>, --occurrence <num>  which crossing to use [default: 1]
+    -r <sig>, --reference <sig>   reference signal for delay
+    --low <frac>                  low threshold for rise/fall time [default: 0.1]
+    --high <frac>                 high threshold for rise/fall time [default: 0.9]
+    --tol <frac>                  settling tolerance [default: 0.01]
+    -b <lo:hi>, --band <lo:hi>    frequency band for integrated noise
+    --drop <dB>                   drop in magnitude for bandwidth [default: 3]
+    --ref-phase <deg>             reference phase for margins [default: -180]
+    -V, --version                 show version number and exit
+
+The PSF file need only be given if it differs from the one used previously.
+
+The available measurements are:
+    cross       time of the n-th crossing of the threshold level
+    delay       time from the crossing of the reference to that of the signal
+    rise_time   time to transition from the low to the high threshold
+    fall_time   time to transition from the high to the low threshold
+    overshoot   peak excursion beyond the final value, as a percentage of swing
+    settling    time at which the signal last enters the tolerance band
+    period      average time between crossings of the threshold level
+    frequency   reciprocal of period
+    duty_cycle  fraction of each period that the signal is high, in percent
+
+    ugf               frequency where the magnitude falls through 0 dB
+    phase_margin      phase at the unity-gain frequency less the reference phase
+    phase_crossover   frequency where the phase falls through the reference phase
+    gain_margin       magnitude, in dB, below 0 dB at the phase crossover
+    bandwidth         frequency where the magnitude falls by the drop
+    integrated_noise  RMS noise over the band
+
+The low and high thresholds and the settling tolerance are given as fractions of
+the swing from the initial to the final value.
+
+The frequency-domain measurements interpolate in log frequency if the PSF file
+recommends a logarithmic axis.  Phase margin and gain margin are computed from
+the unwrapped phase.  Use a reference phase of -180 if the signal is the loop
+gain Aβ and 0 if it includes the inversion of negative feedback, as does the
+loop gain from the STB analysis.  If no signals are given for a frequency-domain
+measurement, all complex signals are measured.
+
+The band is given as two numbers separated by a colon, either may be omitted and
+SI scale factors are allowed (ex: 1k:10M).
+
+A signal may contain glob characters. For examples, out* measures all signals
+that start with out.
+"""
+
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .psf import PSF, Quantity
+from .show import expand_args, get_psf_filename
+from . import __version__, __released__
+from docopt import docopt
+from inform import Error, display, fatal, full_stop, os_error, plural
+import numpy as np
+
+# Globals {{{1
+print_prec = 4
+
+
+# Utilities {{{1
+# All measurements accept a single waveform, given as a 1D array, or a batch of
+# waveforms, given as a 2D array with one waveform per row, that share the same
+# abscissa.  The result is a scalar for a single waveform and a 1D array with
+# one value per row for a batch.  If a measurement cannot be made on a
+# waveform, the result for that waveform is NaN.
+
+# _prepare() {{{2
+def _prepare(x, y):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y)
+    if np.iscomplexobj(y):
+        y = np.absolute(y)
+    single = y.ndim == 1
+    y = np.atleast_2d(y).astype(float, copy=False)
+    if y.shape[-1] != len(x):
+        raise Error(
+            f'abscissa and ordinate lengths differ ({len(x)} != {y.shape[-1]}).'
+        )
+    return x, y, single
+
+
+# _per_row() {{{2
+def _per_row(value, rows):
+    # broadcast a scalar or per-row argument to a column
+    value = np.asarray(value, dtype=float)
+    return np.broadcast_to(value.reshape(-1, 1) if value.ndim else value, (rows, 1))
+
+
+# _finish() {{{2
+def _finish(result, single):
+    return result[0] if single else result
+
+
+# _endpoints() {{{2
+def _endpoints(y, initial, final):
+    if initial is None:
+        initial = y[:, :1]
+    else:
+        initial = _per_row(initial, len(y))
+    if final is None:
+        final = y[:, -1:]
+    else:
+        final = _per_row(final, len(y))
+    return initial, final
+
+
+# _transitions() {{{2
+def _transitions(y, level, edge):
+    # boolean mask of the intervals where the waveform crosses the level
+    above = y >= level
+    if edge == 'rise':
+        return ~above[:, :-1] & above[:, 1:]
+    if edge == 'fall':
+        return above[:, :-1] & ~above[:, 1:]
+    if edge == 'either':
+        return above[:, :-1] != above[:, 1:]
+    raise Error(f'unknown edge: {edge}.', codicil='Choose from rise, fall or either.')
+
+
+# _interpolate() {{{2
+def _interpolate(x, y, level, rows, cols):
+    # abscissa where the waveform reaches level between cols and cols+1
+    y0 = y[rows, cols]
+    y1 = y[rows, cols + 1]
+    x0 = x[cols]
+    x1 = x[cols + 1]
+    lvl = np.broadcast_to(level, (len(y), 1))[rows, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(y1 != y0, (lvl - y0) / (y1 - y0), 0)
+    return x0 + frac * (x1 - x0)
+
+
+# _nth_crossing() {{{2
+def _nth_crossing(x, y, level, edge, occurrence):
+    mask = _transitions(y, level, edge)
+    if occurrence == 0 or not mask.shape[1]:
+        return np.full(len(y), np.nan)
+    if occurrence > 0:
+        count = np.cumsum(mask, axis=1)
+    else:
+        # count back from the end
+        count = np.cumsum(mask[:, ::-1], axis=1)[:, ::-1]
+    hits = mask & (count == abs(occurrence))
+    found = hits.any(axis=1)
+    rows = np.arange(len(y))
+    cols = np.argmax(hits, axis=1)
+    result = _interpolate(x, y, level, rows, cols)
+    result[~found] = np.nan
+    return result
+
+
+# _all_crossings() {{{2
+def _all_crossings(x, y, level, edge):
+    # returns the row numbers and the abscissa of every crossing
+    rows, cols = np.nonzero(_transitions(y, level, edge))
+    return rows, _interpolate(x, y, level, rows, cols)
+
+
+# _default_level() {{{2
+def _default_level(y, level):
+    if level is None:
+        return (np.nanmax(y, axis=1, keepdims=True) + np.nanmin(y, axis=1, keepdims=True))/2
+    return _per_row(level, len(y))
+
+
+# Measurements {{{1
+# cross() {{{2
+def cross(x, y, level=None, edge='rise', occurrence=1):
+    """
+    Cross
+
+    Returns the abscissa of a crossing of a threshold level, found by linear
+    interpolation between the points that straddle the crossing.
+
+    x (array):
+        The abscissa.
+    y (array):
+        The waveform, or a 2D array of waveforms, one per row.
+    level (float or array):
+        The threshold level, either a scalar or one value per waveform.  The
+        default is midway between the extremes of each waveform.
+    edge (str):
+        Which transitions to consider: 'rise', 'fall' or 'either'.
+    occurrence (int):
+        Which crossing to return.  1 is the first, 2 the second, and so on.
+        Negative values count back from the end, so -1 is the last.
+    """
+    x, y, single = _prepare(x, y)
+    level = _default_level(y, level)
+    return _finish(_nth_crossing(x, y, level, edge, occurrence), single)
+
+
+# delay() {{{2
+def delay(x, y, ref, level=None, ref_level=None, edge='rise', ref_edge=None, occurrence=1):
+    """
+    Delay
+
+    Returns the difference between the crossing of a waveform and the crossing
+    of a reference waveform.
+
+    x (array):
+        The abscissa.
+    y (array):
+        The waveform, or a 2D array of waveforms, one per row.
+    ref (array):
+        The reference waveform, either a single waveform shared by all rows of
+        y or one per row.
+    level, ref_level (float or array):
+        The threshold levels for y and ref. The default is midway between the
+        extremes of each waveform.
+    edge, ref_edge (str):
+        Which transitions to consider: 'rise', 'fall' or 'either'.  ref_edge
+        defaults to edge.
+    occurrence (int):
+        Which crossing of each waveform to use.
+    """
+    x, y, single = _prepare(x, y)
+    x, ref, _ = _prepare(x, ref)
+    ref_crossing = _nth_crossing(
+        x, ref, _default_level(ref, ref_level), ref_edge or edge, occurrence
+    )
+    crossing = _nth_crossing(x, y, _default_level(y, level), edge, occurrence)
+    return _finish(crossing - ref_crossing, single)
+
+
+# rise_time() {{{2
+def rise_time(x, y, low=0.1, high=0.9, initial=None, final=None):
+    """
+    Rise Time
+
+    Returns the time taken to transition from the low threshold to the high
+    threshold.  The thresholds are given as fractions of the swing from the
+    initial to the final value.  The first rising crossing of the low threshold
+    and the first rising crossing of the high threshold that follows it are
+    used.
+
+    x (array):
+        The abscissa.
+    y (array):
+        The waveform, or a 2D array of waveforms, one per row.
+    low, high (float):
+        The thresholds as fractions of the swing.
+    initial, final (float or array):
+        The values before and after the transition. The defaults are the first
+        and last values of each waveform.
+    """
+    return _transition_time(x, y, low, high, initial, final, 'rise')
+
+
+# fall_time() {{{2
+def fall_time(x, y, low=0.1, high=0.9, initial=None, final=None):
+    """
+    Fall Time
+
+    Returns the time taken to transition from the high threshold to the low
+    threshold.  The thresholds are given as fractions of the swing from the
+    final to the initial value.
+
+    Arguments are the same as for :func:`rise_time`.
+    """
+    return _transition_time(x, y, low, high, initial, final, 'fall')
+
+
+def _transition_time(x, y, low, high, initial, final, edge):
+    x, y, single = _prepare(x, y)
+    initial, final = _endpoints(y, initial, final)
+    if edge == 'rise':
+        bottom, top = initial, final
+    else:
+        bottom, top = final, initial
+    swing = top - bottom
+    start_level = bottom + low*swing
+    stop_level = bottom + high*swing
+    if edge == 'fall':
+        start_level, stop_level = stop_level, start_level
+    start = _nth_crossing(x, y, start_level, edge, 1)
+
+    # find the first crossing of the second threshold after the first
+    mask = _transitions(y, stop_level, edge)
+    mask &= x[None, 1:] > start[:, None]
+    rows = np.arange(len(y))
+    cols = np.argmax(mask, axis=1)
+    stop = _interpolate(x, y, stop_level, rows, cols)
+    stop[~mask.any(axis=1)] = np.nan
+    return _finish(stop - start, single)
+
+
+# overshoot() {{{2
+def overshoot(x, y, initial=None, final=None):
+    """
+    Overshoot
+
+    Returns the largest excursion beyond the final value, in the direction of
+    the transition, as a percentage of the swing from the initial to the final
+    value.
+
+    x (array):
+        The abscissa.
+    y (array):
+        The waveform, or a 2D array of waveforms, one per row.
+    initial, final (float or array):
+        The values before and after the transition. The defaults are the first
+        and last values of each waveform.
+    """
+    x, y, single = _prepare(x, y)
+    initial, final = _endpoints(y, initial, final)
+    swing = final - initial
+    direction = np.sign(swing)
+    peak = np.nanmax(direction*(y - final), axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = 100*np.maximum(peak, 0)/np.absolute(swing)
+    return _finish(result[:, 0], single)
+
+
+# settling_time() {{{2
+def settling_time(x, y, tol=0.01, initial=None, final=None):
+    """
+    Settling Time
+
+    Returns the abscissa at which the waveform last enters, and thereafter
+    remains within, a band about the final value.  Returns the first point if
+    the waveform never leaves the band.
+
+    x (array):
+        The abscissa.
+    y (array):
+        The waveform, or a 2D array of waveforms, one per row.
+    tol (float):
+        Half-width of the band as a fraction of the swing.
+    initial, final (float or array):
+        The values before and after the transition. The defaults are the first
+        and last values of each waveform.
+    """
+    x, y, single = _prepare(x, y)
+    initial, final = _endpoints(y, initial, final)
+    band = tol*np.absolute(final - initial)
+    error = np.absolute(y - final)
+    outside = error > band
+
+    # last point outside the band; the waveform enters the band between it and
+    # the next point
+    last = outside.shape[1] - 1 - np.argmax(outside[:, ::-1], axis=1)
+    never = ~outside.any(axis=1)
+    last = np.minimum(last, len(x) - 2)
+    rows = np.arange(len(y))
+    result = _interpolate(x, error, band, rows, last)
+    result[never] = x[0]
+    result[outside[:, -1]] = np.nan
+    return _finish(result, single)
+
+
+# period() {{{2
+def period(x, y, level=None, edge='rise'):
+    """
+    Period
+
+    Returns the average period, computed from the time between the first and
+    last crossings of the threshold level and the number of crossings.
+
+    x (array):
+        The abscissa.
+    y (array):
+        The waveform, or a 2D array of waveforms, one per row.
+    level (float or array):
+        The threshold level.  The default is midway between the extremes of
+        each waveform.
+    edge (str):
+        Which transitions to consider: 'rise' or 'fall'.
+    """
+    x, y, single = _prepare(x, y)
+    level = _default_level(y, level)
+    first = _nth_crossing(x, y, level, edge, 1)
+    last = _nth_crossing(x, y, level, edge, -1)
+    count = _transitions(y, level, edge).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.where(count > 1, (last - first)/(count - 1), np.nan)
+    return _finish(result, single)
+
+
+# frequency() {{{2
+def frequency(x, y, level=None, edge='rise'):
+    """
+    Frequency
+
+    Returns the reciprocal of the average period.
+
+    Arguments are the same as for :func:`period`.
+    """
+    return 1/period(x, y, level, edge)
+
+
+# duty_cycle() {{{2
+def duty_cycle(x, y, level=None):
+    """
+    Duty Cycle
+
+    Returns the percentage of time the waveform spends above the threshold
+    level, measured over the whole periods between the first and last rising
+    crossings.
+
+    x (array):
+        The abscissa.
+    y (array):
+        The waveform, or a 2D array of waveforms, one per row.
+    level (float or array):
+        The threshold level.  The default is midway between the extremes of
+        each waveform.
+    """
+    x, y, single = _prepare(x, y)
+    level = _default_level(y, level)
+    rows = len(y)
+    first = _nth_crossing(x, y, level, 'rise', 1)
+    last = _nth_crossing(x, y, level, 'rise', -1)
+
+    # crossings alternate between rising and falling, so the time spent high
+    # within the window is the sum of the falling crossings less the sum of
+    # the rising crossings, excluding the final rising crossing
+    r_rows, r_x = _all_crossings(x, y, level, 'rise')
+    f_rows, f_x = _all_crossings(x, y, level, 'fall')
+    in_window = (f_x > first[f_rows]) & (f_x < last[f_rows])
+    high = np.bincount(f_rows[in_window], f_x[in_window], minlength=rows)
+    in_window = r_x < last[r_rows]
+    high -= np.bincount(r_rows[in_window], r_x[in_window], minlength=rows)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = 100*high/(last - first)
+    result[~(last > first)] = np.nan
+    return _finish(result, single)
+
+
+# Frequency-domain measurements {{{1
+# These accept complex transfer functions, such as the loop gain from an AC or
+# STB analysis, or real noise densities.  When log_x is true, crossings are
+# found by interpolating linearly in the logarithm of the frequency, which
+# is appropriate for sweeps with logarithmically spaced points.
+
+# _prepare_freq() {{{2
+def _prepare_freq(f, h):
+    f = np.asarray(f, dtype=float)
+    h = np.asarray(h)
+    single = h.ndim == 1
+    h = np.atleast_2d(h)
+    if h.shape[-1] != len(f):
+        raise Error(
+            f'abscissa and ordinate lengths differ ({len(f)} != {h.shape[-1]}).'
+        )
+    return f, h, single
+
+
+# _to_axis() {{{2
+def _to_axis(f, log_x):
+    if log_x:
+        with np.errstate(divide='ignore'):
+            return np.log10(f)
+    return f
+
+
+# _from_axis() {{{2
+def _from_axis(x, log_x):
+    return 10**x if log_x else x
+
+
+# _db() {{{2
+def _db(h):
+    with np.errstate(divide='ignore'):
+        return 20*np.log10(np.absolute(h))
+
+
+# _phase() {{{2
+def _phase(h):
+    # unwrapped phase in degrees
+    return np.degrees(np.unwrap(np.angle(h), axis=-1))
+
+
+# _value_at() {{{2
+def _value_at(x, y, at):
+    # interpolate each row of y at the corresponding abscissa in at
+    valid = ~np.isnan(at)
+    cols = np.searchsorted(x, np.where(valid, at, x[0]), side='right') - 1
+    cols = np.clip(cols, 0, len(x) - 2)
+    rows = np.arange(len(y))
+    x0 = x[cols]
+    x1 = x[cols + 1]
+    y0 = y[rows, cols]
+    y1 = y[rows, cols + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = np.where(x1 != x0, (at - x0)/(x1 - x0), 0)
+    result = y0 + frac*(y1 - y0)
+    result[~valid] = np.nan
+    return result
+
+
+# unity_gain_frequency() {{{2
+def unity_gain_frequency(f, h, log_x=False):
+    """
+    Unity-Gain Frequency
+
+    Returns the frequency at which the magnitude of a transfer function first
+    falls through one (0 dB).
+
+    f (array):
+        The frequencies.
+    h (array):
+        The transfer function, or a 2D array of transfer functions, one per
+        row.
+    log_x (bool):
+        Interpolate in the logarithm of the frequency.
+    """
+    f, h, single = _prepare_freq(f, h)
+    x = _to_axis(f, log_x)
+    crossing = _nth_crossing(x, _db(h), np.zeros((len(h), 1)), 'fall', 1)
+    return _finish(_from_axis(crossing, log_x), single)
+
+
+# phase_margin() {{{2
+def phase_margin(f, h, log_x=False, ref=-180):
+    """
+    Phase Margin
+
+    Returns the difference between the phase of the loop gain at the unity-gain
+    frequency and the reference phase, in degrees.  The phase is unwrapped
+    before being interpolated.
+
+    f (array):
+        The frequencies.
+    h (array):
+        The loop gain, or a 2D array of loop gains, one per row.
+    log_x (bool):
+        Interpolate in the logarithm of the frequency.
+    ref (float):
+        The reference phase in degrees.  Use the default of -180 if the loop
+        gain is Aβ, whose phase starts near 0.  Use 0 if the loop gain includes
+        the inversion of negative feedback, as does the loop gain produced by
+        the Spectre STB analysis, whose phase starts near 180.
+    """
+    f, h, single = _prepare_freq(f, h)
+    x = _to_axis(f, log_x)
+    crossing = _nth_crossing(x, _db(h), np.zeros((len(h), 1)), 'fall', 1)
+    return _finish(_value_at(x, _phase(h), crossing) - ref, single)
+
+
+# phase_crossover_frequency() {{{2
+def phase_crossover_frequency(f, h, log_x=False, ref=-180):
+    """
+    Phase Crossover Frequency
+
+    Returns the first frequency at which the unwrapped phase of the loop gain
+    falls through the reference phase.
+
+    Arguments are the same as for :func:`phase_margin`.
+    """
+    f, h, single = _prepare_freq(f, h)
+    x = _to_axis(f, log_x)
+    crossing = _nth_crossing(x, _phase(h), np.full((len(h), 1), ref), 'fall', 1)
+    return _finish(_from_axis(crossing, log_x), single)
+
+
+# gain_margin() {{{2
+def gain_margin(f, h, log_x=False, ref=-180):
+    """
+    Gain Margin
+
+    Returns the amount by which the magnitude of the loop gain is less than one
+    at the phase crossover frequency, in dB.
+
+    Arguments are the same as for :func:`phase_margin`.
+    """
+    f, h, single = _prepare_freq(f, h)
+    x = _to_axis(f, log_x)
+    crossing = _nth_crossing(x, _phase(h), np.full((len(h), 1), ref), 'fall', 1)
+    return _finish(-_value_at(x, _db(h), crossing), single)
+
+
+# bandwidth() {{{2
+def bandwidth(f, h, log_x=False, drop=3, ref=None):
+    """
+    Bandwidth
+
+    Returns the first frequency at which the magnitude of a transfer function
+    falls a given amount below its reference value.
+
+    f (array):
+        The frequencies.
+    h (array):
+        The transfer function, or a 2D array of transfer functions, one per
+        row.
+    log_x (bool):
+        Interpolate in the logarithm of the frequency.
+    drop (float):
+        The drop in dB, 3 by default.
+    ref (float or array):
+        The reference magnitude (not in dB).  By default the magnitude at the
+        first frequency is used.
+    """
+    f, h, single = _prepare_freq(f, h)
+    x = _to_axis(f, log_x)
+    mag = _db(h)
+    if ref is None:
+        level = mag[:, :1] - drop
+    else:
+        level = _db(_per_row(ref, len(h))) - drop
+    crossing = _nth_crossing(x, mag, level, 'fall', 1)
+    return _finish(_from_axis(crossing, log_x), single)
+
+
+# band_weights() {{{2
+def band_weights(x, lo=None, hi=None):
+    """
+    Band Weights
+
+    Returns the weights that, when applied to the values at the points of x,
+    give the trapezoidal-rule integral over the band from lo to hi.  Values at
+    the band edges are found by linear interpolation, which is folded into the
+    weights of the neighboring points.  Thus the integrals of any number of
+    waveforms that share x can be computed with a single matrix product.
+
+    x (array):
+        The abscissa, which must be ascending.
+    lo, hi (float):
+        The band edges.  If not given, the first and last points are used.
+    """
+    x = np.asarray(x, dtype=float)
+    weights = np.zeros(len(x))
+    lo = x[0] if lo is None else max(lo, x[0])
+    hi = x[-1] if hi is None else min(hi, x[-1])
+    if hi <= lo or len(x) < 2:
+        return weights
+
+    # the points of integration: the band edges and the interior points
+    first = int(np.searchsorted(x, lo, side='right'))
+    last = int(np.searchsorted(x, hi, side='left'))
+    xs = np.concatenate(([lo], x[first:last], [hi]))
+    dx = np.diff(xs)
+    point_weights = np.zeros(len(xs))
+    point_weights[:-1] += dx/2
+    point_weights[1:] += dx/2
+
+    # interior points map directly, edges are shared by their neighbors
+    weights[first:last] += point_weights[1:-1]
+    for edge, weight in [(lo, point_weights[0]), (hi, point_weights[-1])]:
+        col = min(max(int(np.searchsorted(x, edge, side='right')) - 1, 0), len(x) - 2)
+        frac = (edge - x[col])/(x[col + 1] - x[col])
+        weights[col] += weight*(1 - frac)
+        weights[col + 1] += weight*frac
+    return weights
+
+
+# integrate() {{{2
+def integrate(x, y, lo=None, hi=None):
+    """
+    Integrate
+
+    Integrates each row of y over the band from lo to hi using the trapezoidal
+    rule.  Values at the band edges are found by linear interpolation.
+
+    x (array):
+        The abscissa, which must be ascending.
+    y (array):
+        The integrand, or a 2D array of integrands, one per row.
+    lo, hi (float):
+        The band edges.  If not given, the first and last points are used.
+    """
+    return np.asarray(y) @ band_weights(x, lo, hi)
+
+
+# integrated_noise() {{{2
+def integrated_noise(f, s, lo=None, hi=None, density='power'):
+    """
+    Integrated Noise
+
+    Returns the RMS noise over a band, the square root of the integral of the
+    noise power spectral density.
+
+    f (array):
+        The frequencies.
+    s (array):
+        The noise density, or a 2D array of noise densities, one per row.
+    lo, hi (float):
+        The band edges.  If not given, the whole sweep is used.
+    density (str):
+        'power' if s is a power density (V²/Hz), 'amplitude' if s is an
+        amplitude density (V/√Hz).
+    """
+    s = np.absolute(s)
+    if density == 'amplitude':
+        s = s**2
+    elif density != 'power':
+        raise Error(
+            f'unknown density: {density}.', codicil='Choose from power or amplitude.'
+        )
+    return np.sqrt(integrate(f, s, lo, hi))
+
+
+# Batch interface {{{1
+measurements = dict(
+    cross = cross,
+    delay = delay,
+    rise_time = rise_time,
+    fall_time = fall_time,
+    overshoot = overshoot,
+    settling = settling_time,
+    period = period,
+    frequency = frequency,
+    duty_cycle = duty_cycle,
+    ugf = unity_gain_frequency,
+    phase_margin = phase_margin,
+    phase_crossover = phase_crossover_frequency,
+    gain_margin = gain_margin,
+    bandwidth = bandwidth,
+    integrated_noise = integrated_noise,
+)
+percentages = {'overshoot', 'duty_cycle'}
+frequency_domain = {
+    'ugf', 'phase_margin', 'phase_crossover', 'gain_margin', 'bandwidth',
+}
+
+
+# stack() {{{2
+def stack(psf, names, magnitude=False):
+    """
+    Stack
+
+    Returns the ordinates of the named signals as a 2D array, one signal per
+    row.
+
+    psf (PSF):
+        The PSF data.
+    names (list of str):
+        Names of the signals.
+    magnitude (bool):
+        If True, complex signals are replaced by their magnitudes, so that
+        real signals stacked with them are not converted to complex and keep
+        their sign.
+    """
+    ordinates = [psf.get_signal(name).ordinate for name in names]
+    if magnitude:
+        ordinates = [np.absolute(o) if np.iscomplexobj(o) else o for o in ordinates]
+    return np.stack(ordinates)
+
+
+# is_amplitude_density() {{{2
+def is_amplitude_density(units):
+    """
+    Is Amplitude Density
+
+    Returns True if the units are those of an amplitude spectral density, such
+    as V/sqrt(Hz).
+    """
+    return bool(units) and 'sqrt' in units
+
+
+# default_names() {{{2
+def default_names(psf, measurement):
+    """
+    Default Names
+
+    Returns the names of the signals a measurement applies to when none are
+    given: the complex signals for the frequency-domain measurements and all
+    swept signals otherwise.
+    """
+    names = []
+    for signal in psf.all_signals():
+        kind = signal.type.kind or ''
+        if measurement in frequency_domain and 'complex' not in kind:
+            continue
+        if 'string' in kind:
+            continue
+        names.append(signal.name)
+    return names
+
+
+# measure() {{{2
+def measure(psf, names, measurement, **kwargs):
+    """
+    Measure
+
+    Applies a measurement to a collection of signals in one vectorized pass and
+    returns a dictionary that maps the signal names to the results.
+
+    psf (PSF):
+        The PSF data.
+    names (list of str):
+        Names of the signals to measure.  If None, the measurement is applied to
+        all applicable signals (see :func:`default_names`).
+    measurement (str):
+        The name of the measurement (see *measurements*).
+    kwargs:
+        Passed to the measurement.  For delay, ref may be given as a signal
+        name.  For the frequency-domain measurements, log_x defaults to the
+        grid recommended by the PSF file.  For integrated_noise, signals whose
+        units are those of an amplitude density are squared before being
+        integrated.
+
+    Example::
+
+        >>> from psf_utils import PSF
+        >>> from psf_utils.measure import measure
+        >>> psf = PSF('samples/pnoise.raw/pss.td.pss')
+        >>> results = measure(psf, ['topref', 'topva'], 'cross', level=0, edge='fall')
+        >>> print(f"{results['topref']:.4g}")
+        3.817e-06
+
+    """
+    try:
+        func = measurements[measurement]
+    except KeyError:
+        raise Error(
+            f'unknown measurement: {measurement}.',
+            codicil = f"Choose from {', '.join(measurements)}."
+        )
+    if names is None:
+        names = default_names(psf, measurement)
+    if not names:
+        return {}
+    sweep = psf.get_sweep(-1)
+    if measurement in frequency_domain:
+        kwargs.setdefault('log_x', psf.log_x(sweep))
+    if isinstance(kwargs.get('ref'), str):
+        kwargs['ref'] = psf.get_signal(kwargs['ref']).ordinate
+    # the frequency-domain measurements need the phase of complex signals, the
+    # others the magnitude
+    values = stack(psf, names, magnitude=measurement not in frequency_domain)
+    if measurement == 'integrated_noise' and 'density' not in kwargs:
+        values = np.absolute(values)
+        for i, name in enumerate(names):
+            if is_amplitude_density(psf.get_signal(name).units):
+                values[i] **= 2
+        kwargs['density'] = 'power'
+    results = func(sweep.abscissa, values, **kwargs)
+    return dict(zip(names, results))
+
+
+# measure_files() {{{2
+def measure_files(psfs, names, measurement, **kwargs):
+    """
+    Measure Files
+
+    Applies a measurement to the same signals in several PSF files, such as the
+    results from a collection of corners, and returns the results as a 2D
+    array with one row per file and one column per signal.  The signals in
+    each file are measured in a single vectorized pass.  Any signal missing
+    from a file is given a value of NaN.
+
+    psfs (list of PSF or path):
+        The PSF data, or the paths to the PSF files.
+    names (list of str):
+        Names of the signals to measure.  If None, the applicable signals of
+        the first file are used.
+    measurement (str):
+        The name of the measurement (see *measurements*).
+    kwargs:
+        Passed to :func:`measure`.
+
+    Returns the signal names and the array of results.
+    """
+    psfs = [psf if isinstance(psf, PSF) else PSF(psf) for psf in psfs]
+    if names is None:
+        names = default_names(psfs[0], measurement) if psfs else []
+    table = np.full((len(psfs), len(names)), np.nan)
+    for i, psf in enumerate(psfs):
+        present = [n for n in names if n in psf.signals]
+        results = measure(psf, present, measurement, **kwargs)
+        for j, name in enumerate(names):
+            if name in results:
+                table[i, j] = results[name]
+    return names, table
+
+
+# parse_band() {{{2
+def parse_band(band):
+    """
+    Parse Band
+
+    Converts a band given as a string of the form lo:hi, where either bound may
+    be omitted, into a pair of numbers.  SI scale factors are allowed.
+    """
+    try:
+        lo, hi = band.split(':')
+        lo = float(Quantity(lo)) if lo else None
+        hi = float(Quantity(hi)) if hi else None
+        return lo, hi
+    except ValueError:
+        raise Error('expected lo:hi.', culprit=band)
+
+
+# result_units() {{{2
+def result_units(psf, name, measurement):
+    """
+    Result Units
+
+    Returns the units of a measurement of a signal, in Unicode.
+    """
+    if measurement in percentages:
+        units = '%'
+    elif measurement == 'frequency':
+        units = 'Hz' if psf.get_sweep(-1).units == 's' else ''
+    elif measurement == 'phase_margin':
+        units = '°'
+    elif measurement == 'gain_margin':
+        units = 'dB'
+    elif measurement == 'integrated_noise':
+        units = psf.get_signal(name).units or ''
+        for density in ['/sqrt(Hz)', '^2/Hz', '/Hz']:
+            if units.endswith(density):
+                units = units[:-len(density)]
+                break
+    else:
+        units = psf.get_sweep(-1).units
+    return psf.units_to_unicode(units)
+
+
+# measure_signals() {{{1
+def measure_signals():
+    try:
+        # process command line {{{2
+        cmdline = docopt(__doc__, version=f"{__version__} ({__released__})")
+        psf_file = get_psf_filename(cmdline['--psf-file'])
+        args = cmdline['<signal>']
+        measurement = cmdline['<measurement>']
+        use_cache = not cmdline['--refresh-cache']
+        level = cmdline['--level']
+        edge = cmdline['--edge']
+
+        kwargs = {}
+        if measurement in ['cross', 'delay', 'period', 'frequency', 'duty_cycle']:
+            if level is not None:
+                kwargs['level'] = Quantity(level)
+        if measurement in ['cross', 'delay', 'period', 'frequency']:
+            kwargs['edge'] = edge
+        if measurement in ['cross', 'delay']:
+            kwargs['occurrence'] = int(cmdline['--occurrence'])
+        if measurement in ['rise_time', 'fall_time']:
+            kwargs['low'] = float(cmdline['--low'])
+            kwargs['high'] = float(cmdline['--high'])
+        if measurement == 'settling':
+            kwargs['tol'] = float(cmdline['--tol'])
+        if measurement == 'delay':
+            if not cmdline['--reference']:
+                raise Error('reference signal is required.', culprit=measurement)
+            kwargs['ref'] = cmdline['--reference']
+        if measurement in ['phase_margin', 'phase_crossover', 'gain_margin']:
+            kwargs['ref'] = float(cmdline['--ref-phase'])
+        if measurement == 'bandwidth':
+            kwargs['drop'] = float(cmdline['--drop'])
+        if measurement == 'integrated_noise' and cmdline['--band']:
+            kwargs['lo'], kwargs['hi'] = parse_band(cmdline['--band'])
+
+        # Open PSF file {{{2
+        psf = PSF(psf_file, sep=':', use_cache=use_cache)
+        sweep = psf.get_sweep(-1)
+        if not sweep:
+            raise Error('measurements require swept data.', culprit=psf_file)
+        if args:
+            names = expand_args(psf.signals.keys(), args, allow_diff=False)
+        else:
+            names = default_names(psf, measurement)
+        if not names:
+            raise Error(f'{plural(args):no match/es}.', culprit=args)
+
+        # Measure and print results {{{2
+        results = measure(psf, names, measurement, **kwargs)
+        width = max(len(n) for n in names)
+        with Quantity.prefs(map_sf=Quantity.map_sf_to_greek, prec=print_prec):
+            for name, value in results.items():
+                units = result_units(psf, name, measurement)
+                display(f'{name:>{width+4}} = {Quantity(value, units)}')
+    except ValueError as e:
+        fatal(full_stop(e))
+    except Error as e:
+        e.terminate()
+    except OSError as e:
+        fatal(os_error(e))
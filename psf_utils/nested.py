@@ -0,0 +1,541 @@
+"""
+Nested Sweeps
+
+Presents the signals of a PSF file with nested sweeps, such as a transient
+analysis repeated over temperature and supply voltage, as N-dimensional arrays
+with one named axis per sweep.
+
+In such a file the rows of the inner sweep are given in blocks, one for each
+combination of the values of the outer sweeps, and PSF objects hold the
+signals as they are given, one value per row.  :meth:`psf_utils.PSF.get_array`
+reshapes a signal into an array whose last axis is the inner sweep and whose
+remaining axes are the outer sweeps, outermost first.  The array is a view of
+the signal where possible, so no data is copied::
+
+    from psf_utils import PSF
+
+    psf = PSF('corners.raw/tran.tran')
+    out = psf.get_array('out')          # temp × vdd × time
+    hot = out.sel(temp=125)             # vdd × time
+    worst = out.max('temp', 'vdd')      # time
+
+If the inner sweep has a different number of points in each block, as is usual
+for transient analyses, give a grid onto which the blocks are resampled.
+
+The signals at particular values of the outer sweeps can also be read from a
+compressed cache without reading the others (see :func:`read_slice`).
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .resample import Interpolator
+from inform import Error, Info
+import numpy as np
+
+
+# Axis class {{{1
+class Axis(Info):
+    """
+    Axis
+
+    An axis of a swept array.
+
+    name (str):
+        The name of the sweep.
+    units (str):
+        The units of the sweep.
+    values (array):
+        The values of the sweep along the axis.  If the inner sweep differs
+        from block to block, its values are given by an array with the same
+        shape as the swept array.
+    """
+
+
+# Blocks class {{{1
+class Blocks:
+    """
+    Blocks
+
+    The arrangement of the rows of a file with nested sweeps into blocks, one
+    for each combination of the values of the outer sweeps.  The blocks must
+    form a grid: every combination is present, with the last outer sweep
+    varying fastest.
+
+    axes (list of Axis):
+        The outer sweeps, outermost first, each with its distinct values.
+    starts (array of int):
+        The first row of each block.
+    lengths (array of int):
+        The number of rows in each block.
+    """
+
+    def __init__(self, axes, starts, lengths):
+        self.axes = axes
+        self.starts = starts
+        self.lengths = lengths
+        self.shape = tuple(len(a.values) for a in axes)
+
+    # from_sweeps() {{{2
+    @classmethod
+    def from_sweeps(cls, sweeps, rows):
+        """
+        From Sweeps
+
+        Returns the blocks given the sweeps of a PSF file, outermost first, and
+        the number of rows.
+
+        Raises Error if the blocks do not form a grid.
+        """
+        outer = sweeps[:-1]
+        if not outer:
+            return cls([], np.zeros(1, dtype=int), np.array([rows]))
+
+        # a block starts wherever a value is given for any of the outer sweeps,
+        # which then holds until another value is given for that sweep
+        starts = np.unique(np.concatenate([s.starts for s in outer]))
+        starts = starts[starts < rows] if rows else starts[:1]
+        axes = []
+        columns = []
+        for sweep in outer:
+            given = np.asarray(sweep.abscissa, dtype=float)
+            which = np.searchsorted(sweep.starts, starts, side='right') - 1
+            if len(which) and which[0] < 0:
+                raise Error(f'no value given for {sweep.name} in first block.')
+            column = given[which]
+            first = np.unique(column, return_index=True)[1]
+            axes.append(Axis(
+                name=sweep.name, units=sweep.units, values=column[np.sort(first)]
+            ))
+            columns.append(column)
+
+        blocks = cls(axes, starts, np.diff(np.append(starts, rows)))
+        expected = np.indices(blocks.shape).reshape(len(axes), -1)
+        if expected.shape[1] != len(starts):
+            raise Error(
+                'the values of the outer sweeps do not form a grid.',
+                codicil = f'Found {len(starts)} blocks, expected {len(expected[0])}.'
+            )
+        for axis, column, index in zip(axes, columns, expected):
+            if not np.array_equal(column, axis.values[index]):
+                raise Error(
+                    'the values of the outer sweeps do not form a grid.',
+                    culprit = axis.name
+                )
+        return blocks
+
+    # select() {{{2
+    def select(self, selection):
+        """
+        Select
+
+        Returns the blocks that correspond to particular values of the outer
+        sweeps, along with the index of each selected block within this
+        arrangement.
+
+        selection (dict):
+            Maps the names of outer sweeps to a value or a list of values.
+            A sweep given a single value is dropped from the result.
+        """
+        indices = []
+        axes = []
+        names = [a.name for a in self.axes]
+        for name in selection:
+            if name not in names:
+                raise Error(f'unknown outer sweep: {name}.', choices=names)
+        for axis in self.axes:
+            if axis.name not in selection:
+                indices.append(np.arange(len(axis.values)))
+                axes.append(axis)
+                continue
+            wanted = selection[axis.name]
+            index = _locate(axis, np.atleast_1d(wanted))
+            indices.append(index)
+            if np.ndim(wanted):
+                axes.append(Axis(
+                    name=axis.name, units=axis.units, values=axis.values[index]
+                ))
+        chosen = np.ravel_multi_index(
+            np.meshgrid(*indices, indexing='ij'), self.shape
+        ).ravel() if self.axes else np.zeros(1, dtype=int)
+        lengths = self.lengths[chosen]
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        return Blocks(axes, starts, lengths), chosen
+
+
+# _locate() {{{2
+def _locate(axis, values):
+    # returns the index of each of the values within the values of an axis
+    index = []
+    for value in values:
+        found = np.flatnonzero(np.isclose(axis.values, value, rtol=1e-9, atol=0))
+        if not len(found):
+            raise Error(
+                f'{value} not found.',
+                culprit = axis.name,
+                codicil = f"Choose from {', '.join(str(v) for v in axis.values)}."
+            )
+        index.append(found[0])
+    return np.array(index, dtype=int)
+
+
+# SweptArray class {{{1
+class SweptArray(Info):
+    """
+    Swept Array
+
+    The values of a signal over nested sweeps, held in an N-dimensional array
+    with one axis per sweep.
+
+    The following attributes are available:
+
+    name (str):
+        The name of the signal.
+    ordinate (array):
+        The values of the signal.
+    units (str):
+        The units of the signal.
+    axes (list of Axis):
+        The sweep that corresponds to each axis of ordinate, outermost first.
+    inner (str):
+        The name of the inner sweep, whose axis is last if present.
+    """
+
+    @property
+    def dims(self):
+        """
+        The names of the axes.
+        """
+        return tuple(a.name for a in self.axes)
+
+    @property
+    def shape(self):
+        """
+        The shape of the array.
+        """
+        return self.ordinate.shape
+
+    def axis(self, name):
+        """
+        Axis
+
+        Returns the index of the named axis.
+        """
+        try:
+            return self.dims.index(name)
+        except ValueError:
+            raise Error(f'unknown axis: {name}.', choices=self.dims)
+
+    def sel(self, selection=None, **values):
+        """
+        Select by Value
+
+        Returns the array at particular values of the outer sweeps, which is a
+        view of this array unless lists of values are given for more than one
+        sweep.
+
+        selection (dict):
+            Maps the names of sweeps to values; used for names that are not
+            valid keyword arguments.
+        values:
+            The value or list of values of each sweep to select.  A sweep given
+            a single value is dropped from the result.
+        """
+        values = dict(selection or {}, **values)
+        if self.inner in values:
+            raise Error(
+                'cannot select by value of the inner sweep.',
+                culprit = self.inner,
+                codicil = 'Use isel() instead.'
+            )
+        indices = {}
+        for name, value in values.items():
+            index = _locate(self.axes[self.axis(name)], np.atleast_1d(value))
+            indices[name] = index if np.ndim(value) else index[0]
+        return self.isel(indices)
+
+    def isel(self, selection=None, **indices):
+        """
+        Select by Index
+
+        Returns the array at particular indices, which is a view of this array
+        unless lists of indices are given for more than one sweep.
+
+        selection (dict):
+            Maps the names of sweeps to indices; used for names that are not
+            valid keyword arguments.
+        indices:
+            An index, slice or list of indices for each sweep.  A sweep given
+            a single index is dropped from the result.
+        """
+        indices = dict(selection or {}, **indices)
+        key = [slice(None)]*len(self.axes)
+        for name, index in indices.items():
+            key[self.axis(name)] = index
+        axes = []
+        for i, (axis, index) in enumerate(zip(self.axes, key)):
+            if np.ndim(index) == 0 and not isinstance(index, slice):
+                continue
+            values = axis.values
+            if np.ndim(values) > 1:
+                # an inner sweep that differs between blocks
+                values = _take(values, key)
+            elif values is not None:
+                values = _take(values, [index])
+            axes.append(Axis(name=axis.name, units=axis.units, values=values))
+        return self._new(_take(self.ordinate, key), axes)
+
+    def reduce(self, function, *dims):
+        """
+        Reduce
+
+        Applies a reduction, such as np.mean, across one or more axes at once.
+
+        function (callable):
+            A function that takes an array and an axis argument, which is given
+            a tuple of axes.
+        dims (str):
+            The names of the axes to reduce, all of the outer sweeps if none
+            are given.
+        """
+        if not dims:
+            dims = [d for d in self.dims if d != self.inner]
+        indices = tuple(sorted(self.axis(d) for d in dims))
+        axes = [a for i, a in enumerate(self.axes) if i not in indices]
+        for axis in axes:
+            if np.ndim(axis.values) > 1:
+                raise Error(
+                    'the inner sweep differs between blocks.',
+                    culprit = self.name,
+                    codicil = 'Specify a grid to place the blocks on a common sweep.'
+                )
+        return self._new(function(self.ordinate, axis=indices), axes)
+
+    def mean(self, *dims):
+        """
+        Mean
+
+        Returns the mean across the named axes, all of the outer sweeps if
+        none are given.
+        """
+        return self.reduce(np.mean, *dims)
+
+    def std(self, *dims):
+        """
+        Standard Deviation
+
+        Returns the standard deviation across the named axes, all of the outer
+        sweeps if none are given.
+        """
+        return self.reduce(np.std, *dims)
+
+    def min(self, *dims):
+        """
+        Minimum
+
+        Returns the minimum across the named axes, all of the outer sweeps if
+        none are given.
+        """
+        return self.reduce(np.min, *dims)
+
+    def max(self, *dims):
+        """
+        Maximum
+
+        Returns the maximum across the named axes, all of the outer sweeps if
+        none are given.
+        """
+        return self.reduce(np.max, *dims)
+
+    def _new(self, ordinate, axes):
+        return SweptArray(
+            name=self.name, ordinate=ordinate, units=self.units, axes=axes,
+            inner=self.inner
+        )
+
+
+# _take() {{{2
+def _take(array, key):
+    # indexes an array with an index, slice or list of indices for each of its
+    # leading axes; unlike numpy, lists given for several axes select their
+    # outer product rather than being paired
+    key = list(key)
+    lists = [i for i, k in enumerate(key) if np.ndim(k) > 0]
+    if len(lists) > 1:
+        for i in lists:
+            array = np.take(array, key[i], axis=i)
+            key[i] = slice(None)
+    return array[tuple(key)]
+
+
+# Utilities {{{1
+# _shape_array() {{{2
+def _shape_array(name, units, ordinate, abscissa, inner, blocks, grid, kind):
+    # arranges the values of a signal given one per row into an array with one
+    # axis per sweep
+    shape = blocks.shape
+    lengths = blocks.lengths
+    if grid is not None:
+        grid = np.asarray(grid, dtype=float)
+        out = None
+        for i, (start, length) in enumerate(zip(blocks.starts, lengths)):
+            if not length:
+                raise Error('empty block.', culprit=name)
+            stop = start + length
+            values = Interpolator(abscissa[start:stop], grid, kind)(ordinate[start:stop])
+            if out is None:
+                out = np.empty((len(lengths), len(grid)), dtype=values.dtype)
+            out[i] = values
+        ordinate = out.reshape(shape + (len(grid),))
+        values = grid
+    elif len(set(lengths.tolist())) != 1:
+        raise Error(
+            'the number of points in the inner sweep differs between blocks.',
+            culprit = name,
+            codicil = 'Specify a grid onto which the blocks are resampled.'
+        )
+    else:
+        # the blocks are contiguous and in order, so the array is a view of
+        # the signal
+        count = lengths[0]
+        first = blocks.starts[0]
+        stop = first + count*len(lengths)
+        ordinate = np.asarray(ordinate)[first:stop].reshape(shape + (count,))
+        values = abscissa[first:stop].reshape(-1, count)
+        if (values == values[0]).all():
+            values = values[0]
+        else:
+            values = values.reshape(shape + (count,))
+    axes = blocks.axes + [Axis(name=inner.name, units=inner.units, values=values)]
+    return SweptArray(
+        name=name, ordinate=ordinate, units=units, axes=axes, inner=inner.name
+    )
+
+
+# get_blocks() {{{1
+def get_blocks(psf):
+    """
+    Get Blocks
+
+    Returns the arrangement of the rows of a PSF object into blocks (see
+    :class:`Blocks`).  Raises Error if the data is not swept.
+    """
+    blocks = psf.__dict__.get('_blocks')
+    if blocks is None:
+        sweep = psf.get_sweep(-1)
+        if not sweep:
+            raise Error('swept arrays require swept data.')
+        blocks = psf._blocks = Blocks.from_sweeps(psf.sweeps, len(sweep.abscissa))
+    return blocks
+
+
+# get_array() {{{1
+def get_array(psf, name, grid=None, kind='linear'):
+    """
+    Get Array
+
+    Returns the values of a signal as a :class:`SweptArray` with one axis per
+    sweep, the inner sweep last.  Unless a grid is given, the array is a view of
+    the signal.
+
+    psf (PSF):
+        The PSF data.
+    name (str):
+        The name of the signal.
+    grid (array):
+        The values of the inner sweep onto which each block is resampled,
+        needed if the blocks differ in length.
+    kind (str):
+        The interpolation used when resampling, 'linear' or 'hold'.
+    """
+    blocks = get_blocks(psf)
+    signal = psf.get_signal(name)
+    sweep = psf.get_sweep(-1)
+    return _shape_array(
+        name, signal.units, signal.ordinate, sweep.abscissa, sweep, blocks,
+        grid, kind
+    )
+
+
+# read_slice() {{{1
+def read_slice(path, names=None, selection=None, grid=None, kind='linear', **values):
+    """
+    Read Slice
+
+    Reads the signals at particular values of the outer sweeps from a
+    compressed cache, decompressing only the chunks that hold the rows of the
+    corresponding blocks.
+
+    path (str or Path):
+        The path to the PSF file or its compressed cache.
+    names (list of str):
+        Names of the signals to read, all signals if None.
+    selection (dict):
+        Maps the names of outer sweeps to values; used for names that are not
+        valid keyword arguments.
+    grid (array):
+        The values of the inner sweep onto which each block is resampled,
+        needed if the selected blocks differ in length.
+    kind (str):
+        The interpolation used when resampling, 'linear' or 'hold'.
+    values:
+        The value or list of values of each outer sweep to read.  A sweep
+        given a single value is dropped from the result.
+
+    Returns a dictionary that maps each name to a :class:`SweptArray`.
+
+    Example::
+
+        >>> from psf_utils.nested import read_slice
+        >>> arrays = read_slice('corners.raw/tran.tran', ['out'], temp=125)
+
+    """
+    from .cache import ChunkedArray, _Reader, _cache_path, _open, _ordinate, _rows
+    path = _cache_path(path)
+    stream, directory, data = _open(path)
+    with stream:
+        attributes = _Reader(data, stream, directory, lazy=True).load()
+        sweeps = attributes.get('sweeps')
+        if not sweeps:
+            raise Error('swept arrays require swept data.', culprit=path)
+        for sweep in sweeps[:-1]:
+            if isinstance(sweep.abscissa, ChunkedArray):
+                sweep.abscissa = sweep.abscissa.read()
+        inner = sweeps[-1]
+        signals = attributes['signals']
+        blocks = Blocks.from_sweeps(sweeps, len(inner.abscissa))
+        selected, chosen = blocks.select(dict(selection or {}, **values))
+        if names is None:
+            names = list(signals)
+
+        def read(column):
+            parts = [
+                _rows(column, start, start + length) for start, length in
+                zip(blocks.starts[chosen], blocks.lengths[chosen])
+            ]
+            return np.concatenate(parts) if parts else np.empty(0)
+
+        abscissa = read(inner.abscissa)
+        arrays = {}
+        for name in names:
+            ordinate = read(_ordinate(signals, name))
+            arrays[name] = _shape_array(
+                name, signals[name].units, ordinate, abscissa, inner, selected,
+                grid, kind
+            )
+        return arrays
@@ -0,0 +1,350 @@
+# Usage {{{1
+"""
+Rank Noise Contributors
+
+Integrates the noise contributions in a noise or pnoise PSF file over a band of
+frequencies and lists the largest contributors.
+
+Usage:
+    noise-psf [options] [<contributor>...]
+
+Options:
+    -c, --refresh-cache           refresh the cache
+    -f <path>, --psf-file <path>  PSF file
+    -b <lo:hi>, --band <lo:hi>    frequency band [default: :]
+    -t <N>, --top <N>             show only the N largest contributors
+    --by <grouping>               aggregate by instance, type or contributor
+                                  [default: instance]
+    -V, --version                 show version number and exit
+
+The PSF file need only be given if it differs from the one used previously.
+
+The band is given as two numbers separated by a colon, either may be omitted and
+SI scale factors are allowed (ex: 1k:10M).  By default the whole sweep is used.
+
+Each contribution is named instance:type, such as R1:thermal.  When aggregating
+by instance, the total noise of each instance is reported.  When aggregating by
+type, a type is summed over all instances.  When aggregating by contributor,
+every contribution is reported individually.  For each the RMS noise over the
+band is given along with the percentage of the total noise power.
+
+A contributor may contain glob characters. For examples, M* restricts the
+ranking to contributions from instances whose names start with M.
+"""
+
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .cache import ChunkedArray, current, open_lazily, read_window
+from .psf import PSF, Quantity
+from .measure import band_weights, parse_band
+from .show import get_psf_filename
+from . import __version__, __released__
+from docopt import docopt
+from inform import Error, Info, display, fatal, full_stop, os_error, plural
+import fnmatch
+import numpy as np
+
+# Globals {{{1
+print_prec = 4
+groupings = ['instance', 'type', 'contributor']
+
+
+# Utilities {{{1
+class Contribution(Info):
+    pass
+
+
+# contributors() {{{2
+def contributors(psf, patterns=None, sep=':'):
+    """
+    Contributors
+
+    Returns the names of the noise contributions in a noise PSF file, split
+    into instance and type.  Signals that are not of the form instance:type,
+    such as the output noise, are excluded.
+
+    psf (PSF):
+        The PSF data.
+    patterns (list of str):
+        If given, only contributions whose name, or whose instance name, match
+        one of these glob patterns are returned.
+    sep (str):
+        The string that separates the instance name from the type.
+
+    Returns a list of (name, instance, type) tuples.
+    """
+    return _contributors(psf.signals, patterns, sep)
+
+
+def _contributors(signals, patterns, sep):
+    found = []
+    for name, signal in signals.items():
+        instance, _, kind = name.rpartition(sep)
+        if not instance or 'complex' in (signal.type.kind or ''):
+            continue
+        if patterns and not any(
+            fnmatch.fnmatchcase(name, p) or fnmatch.fnmatchcase(instance, p)
+            for p in patterns
+        ):
+            continue
+        found.append((name, instance, kind))
+    return found
+
+
+# _describe() {{{2
+def _describe(psf):
+    # returns the signals and sweep values of a PSF object, or those held in
+    # the compressed cache of a PSF file, whose signals are not read
+    if isinstance(psf, PSF):
+        sweep = psf.get_sweep(-1)
+        return psf.signals, sweep.abscissa if sweep else None
+    with open_lazily(psf) as attributes:
+        sweeps = attributes.get('sweeps')
+        abscissa = sweeps[-1].abscissa if sweeps else None
+        if isinstance(abscissa, ChunkedArray):
+            abscissa = abscissa.read()
+        return attributes['signals'], abscissa
+
+
+# _block() {{{2
+def _block(ordinate):
+    # returns the 2D array of values that the fast reader places a signal in,
+    # along with the column that holds the signal, or None if it has none
+    base = ordinate.base
+    if not isinstance(base, np.ndarray) or base.ndim != 1 or ordinate.ndim != 1:
+        return None
+    if ordinate.dtype != base.dtype or not base.flags.c_contiguous:
+        return None
+    width, extra = divmod(ordinate.strides[0], base.itemsize)
+    if extra or width < 1 or base.size != width*len(ordinate):
+        return None
+    offset = (
+        ordinate.__array_interface__['data'][0] - base.__array_interface__['data'][0]
+    )
+    column, extra = divmod(offset, base.itemsize)
+    if extra or not 0 <= column < width:
+        return None
+    return base.reshape(-1, width), column
+
+
+# integrate_contributions() {{{2
+def integrate_contributions(psf, names, band=(None, None)):
+    """
+    Integrate Contributions
+
+    Integrates the noise power spectral density of each of the named signals
+    over the band.  The band-limited trapezoidal rule is reduced to a single
+    weight vector that is applied to the values of the signals where they are
+    held, without copying them.  Signals that the fast reader placed in one
+    block of values are integrated by a single matrix product with the block,
+    and signals held in a compressed cache are read only over the band (see
+    :func:`psf_utils.cache.read_window`).
+
+    psf (PSF or path):
+        The PSF data, or the path to a PSF file that has a compressed cache.
+    names (list of str):
+        Names of the noise power densities.
+    band (tuple of float):
+        The low and high frequencies of the band, either may be None.
+
+    Returns an array containing the noise power of each signal.
+    """
+    powers = np.zeros(len(names))
+    if not names:
+        return powers
+    abscissa = _describe(psf)[1]
+    weights = band_weights(abscissa, *band)
+    used = np.flatnonzero(weights)
+    if not len(used):
+        return powers
+    lo, hi = used[0], used[-1] + 1
+    weights = weights[lo:hi]
+
+    if not isinstance(psf, PSF):
+        # only the chunks that overlap the band are read
+        abscissa, values = read_window(psf, abscissa[lo], abscissa[hi - 1], names)
+        if len(abscissa) != len(weights):
+            raise Error('sweep is not sorted.', culprit=psf)
+        for i, name in enumerate(names):
+            powers[i] = values[name] @ weights
+        return powers
+
+    blocks = {}     # the block, its columns and the positions of its signals
+    for i, name in enumerate(names):
+        ordinate = np.asarray(psf.get_signal(name).ordinate)
+        found = _block(ordinate)
+        if found:
+            block, column = found
+            entry = blocks.setdefault(id(block.base), (block, [], []))
+            entry[1].append(column)
+            entry[2].append(i)
+        else:
+            powers[i] = ordinate[lo:hi] @ weights
+    for block, columns, positions in blocks.values():
+        powers[positions] = (weights @ block[lo:hi])[columns]
+    return powers
+
+
+# rank() {{{2
+def rank(psf, band=(None, None), by='instance', top=None, patterns=None, sep=':'):
+    """
+    Rank Noise Contributors
+
+    Integrates all noise contributions over a band, aggregates them and returns
+    them sorted from largest to smallest.
+
+    psf (PSF or path):
+        The PSF data from a noise or pnoise analysis, or the path to such a PSF
+        file that has a compressed cache, in which case the contributions are
+        integrated directly from the cache.
+    band (tuple of float):
+        The low and high frequencies of the band, either may be None.
+    by (str):
+        How to aggregate the contributions:
+
+        'instance':
+            the total of each instance, taken from its total member if it
+            has one, otherwise by summing its members.
+        'type':
+            the sum of each noise type over all instances, total members
+            are excluded.
+        'contributor':
+            each contribution individually, total members are excluded.
+
+    top (int):
+        If given, only the this many of the largest contributors are returned.
+    patterns (list of str):
+        If given, only contributions whose name or instance name match one of
+        these glob patterns are considered.
+    sep (str):
+        The string that separates the instance name from the type.
+
+    Returns a list of Contribution objects, each of which has the attributes
+    name, power (the integrated noise power), rms (its square root) and
+    fraction (the fraction of the total noise power of the ranked
+    contributors).
+
+    Example::
+
+        >>> from psf_utils import PSF
+        >>> from psf_utils.noise import rank
+        >>> psf = PSF('samples/pnoise.raw/noiref.noise')
+        >>> for c in rank(psf, band=(1e3, 1e6)):
+        ...     print(f'{c.name:<8} {c.rms:.3e} {100*c.fraction:.1f}%')
+        RESref   2.631e-05 100.0%
+        RESva    0.000e+00 0.0%
+        Rref     0.000e+00 0.0%
+        Rva      0.000e+00 0.0%
+
+    """
+    if by not in groupings:
+        raise Error(
+            f'unknown grouping: {by}.', codicil=f"Choose from {', '.join(groupings)}."
+        )
+    signals = _describe(psf)[0]
+    found = _contributors(signals, patterns, sep)
+    if by == 'instance':
+        has_total = {i for n, i, k in found if k == 'total'}
+        found = [
+            (n, i, k) for n, i, k in found
+            if (k == 'total') == (i in has_total)
+        ]
+        keys = [i for n, i, k in found]
+    else:
+        found = [(n, i, k) for n, i, k in found if k != 'total']
+        keys = [k if by == 'type' else n for n, i, k in found]
+
+    # integrate and aggregate
+    powers = integrate_contributions(psf, [n for n, i, k in found], band)
+    unique, groups = np.unique(np.array(keys, dtype=object), return_inverse=True)
+    totals = np.bincount(groups.ravel(), powers, minlength=len(unique))
+    order = np.argsort(-totals, kind='stable')
+    if top is not None:
+        order = order[:top]
+    grand_total = totals.sum()
+    units = {}
+    for n, i, k in found:
+        key = i if by == 'instance' else k if by == 'type' else n
+        units.setdefault(key, signals[n].units)
+    return [
+        Contribution(
+            name = unique[j],
+            power = totals[j],
+            rms = np.sqrt(totals[j]),
+            fraction = totals[j]/grand_total if grand_total else 0,
+            units = units[unique[j]],
+        )
+        for j in order
+    ]
+
+
+# rms_units() {{{2
+def rms_units(units):
+    """
+    RMS Units
+
+    Returns the units of the RMS noise given the units of the noise power
+    spectral density (ex: V^2/Hz -> V).
+    """
+    units = units or ''
+    for density in ['^2/Hz', '/Hz']:
+        if units.endswith(density):
+            return units[:-len(density)]
+    return units
+
+
+# rank_noise() {{{1
+def rank_noise():
+    try:
+        # process command line {{{2
+        cmdline = docopt(__doc__, version=f"{__version__} ({__released__})")
+        psf_file = get_psf_filename(cmdline['--psf-file'])
+        patterns = cmdline['<contributor>']
+        use_cache = not cmdline['--refresh-cache']
+        band = parse_band(cmdline['--band'])
+        by = cmdline['--by']
+        top = cmdline['--top']
+        top = int(top) if top else None
+
+        # Open PSF file {{{2
+        # the contributions are integrated from a compressed cache directly
+        psf = current(psf_file) if use_cache else None
+        if not psf:
+            psf = PSF(psf_file, sep=':', use_cache=use_cache)
+        if _describe(psf)[1] is None:
+            raise Error('noise ranking requires swept data.', culprit=psf_file)
+
+        # Rank and print results {{{2
+        ranked = rank(psf, band, by, top, patterns)
+        if not ranked:
+            if patterns:
+                raise Error(f'{plural(patterns):no match/es}.', culprit=patterns)
+            raise Error('no noise contributions found.', culprit=psf_file)
+        width = max(len(c.name) for c in ranked)
+        with Quantity.prefs(map_sf=Quantity.map_sf_to_greek, prec=print_prec):
+            for c in ranked:
+                rms = Quantity(c.rms, PSF.units_to_unicode(rms_units(c.units)))
+                display(f'    {c.name:<{width}}  {rms:<12}  {100*c.fraction:5.1f}%')
+    except ValueError as e:
+        fatal(full_stop(e))
+    except Error as e:
+        e.terminate()
+    except OSError as e:
+        fatal(os_error(e))
@@ -22,8 +22,10 @@ Parse ASCII PSF Files
 # Imports {{{1
 import ply.lex
 import ply.yacc
+from . import fast
 from inform import Info, is_str, is_mapping
-import numpy as np
+import re
+import time
 
 
 # Globals {{{1
@@ -187,102 +189,85 @@ t_QUOTED_STRING = r'"([^\\\n"]|(\\.))*"'
     # character, which allows \" and \\.
 
 # Special handling for VALUE to enable fast reading
-def t_VALUE(t):
-    r'VALUE'
-    # Try to fast read the entire section
-    # Look ahead for END
-    lexdata = t.lexer.lexdata
-    lexpos = t.lexer.lexpos
-
-    # First, check if there are GROUP traces in the TRACE section
-    # TRACE section comes before VALUE
-    trace_start = lexdata.rfind('TRACE', 0, lexpos)
-    if trace_start != -1:
-        trace_section = lexdata[trace_start:lexpos]
-        if 'GROUP' in trace_section:
-            # GROUP traces have different VALUES format, can't fast parse
-            t.type = 'VALUE'
-            return t
-
-    end_idx = lexdata.find('END', lexpos)
-
-    if end_idx != -1:
-        # Check if the content between VALUE and END is "simple"
-        # i.e. no composite values (parentheses)
-
-        section_content = lexdata[lexpos:end_idx]
-
-        # Heuristic: if '(' is present, fallback to slow parsing
-        # This handles complex/composite values
-        if '(' in section_content:
-             t.type = 'VALUE'
-             return t
-
-        # Try fast parsing with numpy
-        try:
-            tokens_list = section_content.split()
-            if not tokens_list:
-                t.type = 'VALUE'
-                return t
-
-            # Identify signals
-            # "name" value "name" value ...
-            # Find cycle length
-            if len(tokens_list) < 2:
-                 t.type = 'VALUE'
-                 return t
-
-            first_name = tokens_list[0]
-            cycle_len = 0
-            for i in range(2, len(tokens_list), 2):
-                if tokens_list[i] == first_name:
-                    cycle_len = i // 2
-                    break
-
-            if cycle_len == 0:
-                 t.type = 'VALUE'
-                 return t
-
-            names = [tok.strip('"') for tok in tokens_list[0:cycle_len*2:2]]
-
-            total_tokens = len(tokens_list)
-            num_rows = total_tokens // (2 * cycle_len)
-
-            if num_rows == 0:
-                t.type = 'VALUE'
-                return t
-
-            # Truncate to full cycles
-            tokens_list = tokens_list[:num_rows * 2 * cycle_len]
-
-            # Convert to numpy array
-            # This is the critical speedup
-            values = np.array(tokens_list[1::2], dtype=float)
-            data = values.reshape((num_rows, cycle_len))
-
-            # Success!
-            # Return FAST_VALUES token
-            t.type = 'FAST_VALUES'
-            t.value = (names, data)
-
-            # Update lexer position to skip the consumed content
-            # We consumed up to end_idx.
-            # But we didn't consume 'END'.
-            # So lexpos should be end_idx.
-            t.lexer.lexpos = end_idx
-
-            return t
-
-        except Exception:
-            # Fallback on any error
-            t.type = 'VALUE'
-            return t
+class FastPath(Info):
+    # describes whether the VALUE section was read by the fast reader, and if
+    # not, why not and where the problem was found
+    pass
 
+
+def _slow_path(t, reason, line=None):
+    # fall back to the PLY parser for the VALUE section
+    t.lexer.fast_path = FastPath(taken=False, reason=reason, line=line)
     t.type = 'VALUE'
     return t
 
 
-# Identifier tokens {{{2
+sweep_section = re.compile(r'^SWEEP\b', re.M)
+end_of_section = re.compile(r'END\b')
+
+
+def t_VALUE(t):
+    r'VALUE'
+    # Try to read the entire section with the fast reader, which returns the
+    # values in the form they are given by the PLY parser, except that the
+    # values of a swept file are arrays that hold each value across the sweep
+    start = time.perf_counter()
+    lexer = t.lexer
+    lexdata = lexer.lexdata
+    lexpos = lexer.lexpos
+    # the section ends at the last line that starts with END; no line within
+    # the section can start with END as each starts with a name or a value, so
+    # searching back from the end of the file finds it quickly
+    end_idx = lexdata.rfind('\nEND', lexpos) + 1
+    if not end_idx or not end_of_section.match(lexdata, end_idx):
+        return _slow_path(t, 'value section is not terminated')
+    section = lexdata[lexpos:end_idx]
+    swept = sweep_section.search(lexdata, 0, lexpos)
+    monitor = lexer.monitor
+    report = None
+    if monitor and monitor.active:
+        # the fast reader reports the fraction of the section it has read
+        report = lambda fraction: monitor.update(lexpos + int(fraction*len(section)))
+    try:
+        if swept and len(lexer.sweeps) > 1:
+            items, rows, partial, starts = fast.read_nested(
+                section, lexer.sweeps[:-1], lexer.storage, report
+            )
+            values = {n: Value(values=v, is_fast=True) for n, v in items.items()}
+            for name, rows_given in starts.items():
+                values[name].rows = rows_given
+        elif swept:
+            items, rows, partial = fast.read_swept(section, lexer.storage, report)
+            values = {n: Value(values=v, is_fast=True) for n, v in items.items()}
+        else:
+            values = {}
+            for name, type, value in fast.read_unswept(section):
+                if name in values:
+                    values[name].values.append(value)
+                else:
+                    values[name] = Value(type=type, values=[value])
+            rows, partial = 1, False
+    except fast.Fallback as e:
+        line = None
+        if e.line is not None:
+            line = lexdata.count('\n', 0, lexpos) + e.line + 1
+        return _slow_path(t, e.reason, line)
+    except (ValueError, TypeError) as e:
+        return _slow_path(t, f'values could not be converted: {e}')
+
+    t.type = 'FAST_VALUES'
+    t.value = values
+    lexer.fast_path = FastPath(
+        taken = True,
+        rows = rows,
+        partial = partial,
+        time = time.perf_counter() - start,
+    )
+    # skip the consumed content, leaving END for the parser
+    lexer.lexpos = end_idx
+    return t
+
+
 def t_ID(t):
     r'[A-Z]+'
     t.type = reserved.get(t.value)
@@ -317,6 +302,12 @@ def p_contents_without_sweep(p):
     p[0] = (p[1], p[2], None, None, p[3])
 
 
+def p_contents_without_values(p):
+    # used to read just the header of a swept file, as when cataloging
+    "contents : header_section type_section sweep_section trace_section end"
+    p[0] = (p[1], p[2], p[3], p[4], {})
+
+
 def p_contents_only_header(p):
     "contents : header_section end"
     p[0] = (p[1], {}, None, None, {})
@@ -448,6 +439,10 @@ def p_prop(p):
 
 def p_sweep_section(p):
     "sweep_section : SWEEP sweeps"
+    # the values of nested sweeps are decoded using the names of the sweeps,
+    # which are kept by the lexer; the list is updated in place as p.lexer may
+    # be a wrapper around the lexer
+    p.lexer.sweeps[:] = [s.name for s in p[2]]
     p[0] = p[2]
 
 
@@ -541,25 +536,7 @@ def p_value_section(p):
 
 def p_value_section_fast(p):
     "value_section : FAST_VALUES"
-    names, data = p[1]
-    values = {}
-
-    # Construct values dict
-    # We need to handle escaped names here too?
-    # The names come from fast reader which might have escapes.
-    # But standard parser unescapes strings in p_string.
-    # So we should probably unescape here to match standard parser output.
-
-    for i, name in enumerate(names):
-        clean_name = name.replace('\\', '')
-        col = data[:, i]
-        # Wrap in Value object.
-        # Note: Standard parser produces Value(type=..., values=[list])
-        # We produce Value(values=numpy_array, is_fast=True)
-        # We don't have type info here, but __init__ handles that.
-        values[clean_name] = Value(values=col, is_fast=True)
-
-    p[0] = values
+    p[0] = p[1]
 
 
 def p_values(p):
@@ -568,12 +545,31 @@ def p_values(p):
         p[1][p[2][0]] = Value(type=p[2][1], values=[p[2][2]])
     else:
         p[1][p[2][0]].values.append(p[2][2])
+    sweeps = p.lexer.sweeps
+    if len(sweeps) > 1:
+        _nested_row(p[1], p[2][0], sweeps)
     p[0] = p[1]
 
 
 def p_values_last(p):
     "values : signal_value"
     p[0] = {p[1][0]: Value(type=p[1][1], values=[p[1][2]])}
+    sweeps = p.lexer.sweeps
+    if len(sweeps) > 1:
+        _nested_row(p[0], p[1][0], sweeps)
+
+
+def _nested_row(values, name, sweeps):
+    # with nested sweeps, the rows of the inner sweep are given in blocks, each
+    # preceded by values of the outer sweeps, so record the row of the inner
+    # sweep at which each value of an outer sweep is given
+    if name in sweeps[:-1]:
+        inner = values.get(sweeps[-1])
+        row = len(inner.values) if inner else 0
+        value = values[name]
+        if value.rows is None:
+            value.rows = []
+        value.rows.append(row)
 
 
 def p_named_signal_scalar(p):
@@ -659,9 +655,47 @@ class ParsePSF:
         self.lexer = ply.lex.lex()
         self.parser = ply.yacc.yacc(write_tables=False, debug=False)
 
-    def parse(self, filename, content):
+    def parse(self, filename, content, storage=None, monitor=None):
         global Filename
         Filename = filename
-
-        result = self.parser.parse(content, tracking=False, lexer=self.lexer)
+        self.lexer.sweeps = []
+        self.lexer.storage = storage
+        self.lexer.monitor = monitor
+        self.lexer.fast_path = None
+
+        lexer = self.lexer
+        if monitor and monitor.active:
+            lexer = MonitoredLexer(lexer, monitor)
+        try:
+            result = self.parser.parse(content, tracking=False, lexer=lexer)
+        finally:
+            # the parser and lexer would otherwise retain the content and the
+            # values of the last file until the next is parsed
+            self.parser.symstack = self.parser.statestack = None
+            self.lexer.lexdata = ''
+            self.lexer.storage = self.lexer.monitor = None
+        self.fast_path = self.lexer.fast_path
         return result
+
+
+class MonitoredLexer:
+    # passes the tokens of the lexer to the parser, periodically reporting the
+    # position in the content to the monitor, which may cancel the parse
+    def __init__(self, lexer, monitor, every=1000):
+        self.lexer = lexer
+        self.monitor = monitor
+        self.every = every
+        self.count = 0
+
+    def input(self, content):
+        self.lexer.input(content)
+
+    def token(self):
+        self.count += 1
+        if self.count >= self.every:
+            self.count = 0
+            self.monitor.update(self.lexer.lexpos)
+        return self.lexer.token()
+
+    def __getattr__(self, name):
+        return getattr(self.lexer, name)
@@ -0,0 +1,291 @@
+"""
+Progress
+
+Progress reporting and cancellation for long loads.
+
+A load passes through several phases: reading the file, parsing it, building the
+signals and writing the cache.  A :class:`Monitor` follows the load through
+these phases, passing a :class:`Progress` object to a callback no more often
+than every tenth of a second, and checking whether the load has been cancelled.
+Cancellation is cooperative: the load stops at the next check by raising
+:class:`Cancelled`, generally within a fraction of a second.
+"""
+
+# License {{{1
+# Copyright (C) 2016-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see http://www.gnu.org/licenses/.
+
+
+# Imports {{{1
+from inform import Error, Info
+from quantiphy import Quantity
+import sys
+import time
+
+
+# Globals {{{1
+INTERVAL = 0.1      # minimum time between reports in seconds
+
+
+# Cancelled exception {{{1
+class Cancelled(Error):
+    """
+    Cancelled
+
+    Raised when a load is cancelled.  No cache file is written for a cancelled
+    load and any existing cache is left untouched.
+    """
+    template = 'load cancelled.'
+
+
+# Progress class {{{1
+class Progress(Info):
+    """
+    Progress
+
+    The progress of a phase of a load, as passed to the progress callback.
+
+    filename (str):
+        The path to the file being loaded.
+    phase (str):
+        The phase: read, parse, build, cache read, cache write or index write.
+    done (int):
+        The amount of work completed in this phase.
+    total (int):
+        The total amount of work in this phase, None if not known.
+    units (str):
+        The units of done and total: B (bytes of the file or cache), chars
+        (characters parsed) or signals (signals built).
+    fraction (float):
+        The fraction of the phase that is complete, None if total is not known.
+    elapsed (float):
+        The time spent in this phase so far in seconds.
+    eta (float):
+        The estimated time remaining in this phase in seconds, None if not
+        known.
+    """
+
+
+# Monitor class {{{1
+class Monitor:
+    """
+    Monitor
+
+    Follows a load through its phases, reporting progress and checking for
+    cancellation.
+
+    callback (callable):
+        Called with a :class:`Progress` object at the start and end of each
+        phase and periodically within it.
+    cancel (threading.Event or callable):
+        The load is cancelled once the event is set or the callable returns
+        True.
+    filename (str):
+        The path to the file being loaded, used when reporting.
+    interval (float):
+        The minimum time between periodic reports in seconds.
+    """
+
+    def __init__(self, callback=None, cancel=None, filename=None, interval=INTERVAL):
+        self.callback = callback
+        if cancel is None:
+            self.cancelled = None
+        elif hasattr(cancel, 'is_set'):
+            self.cancelled = cancel.is_set
+        else:
+            self.cancelled = cancel
+        self.filename = filename
+        self.interval = interval
+        self.active = bool(callback or cancel)
+        self.phase = None
+
+    def check(self):
+        """
+        Check
+
+        Raises :class:`Cancelled` if the load has been cancelled.
+        """
+        if self.cancelled and self.cancelled():
+            raise Cancelled(culprit=self.filename)
+
+    def start(self, phase, total=None, units=''):
+        """
+        Start
+
+        Starts a phase.
+
+        phase (str):
+            The name of the phase.
+        total (int):
+            The total amount of work in the phase, if known.
+        units (str):
+            The units of the work.
+        """
+        self.check()
+        self.phase = phase
+        self.total = total
+        self.units = units
+        self.done = 0
+        self.began = time.perf_counter()
+        self.next = self.began + self.interval
+        self._report(self.began)
+
+    def update(self, done):
+        """
+        Update
+
+        Records the work done so far in the current phase.  This is cheap
+        enough to call often; the callback and the cancellation check only
+        occur once the interval has passed.
+        """
+        self.done = done
+        now = time.perf_counter()
+        if now >= self.next:
+            self.next = now + self.interval
+            self.check()
+            self._report(now)
+
+    def finish(self):
+        """
+        Finish
+
+        Ends the current phase.
+        """
+        if self.total is not None:
+            self.done = self.total
+        self._report(time.perf_counter())
+        self.phase = None
+
+    def track(self, stream):
+        """
+        Track
+
+        Returns a wrapper around a binary file that reports the number of bytes
+        read or written as the progress of the current phase.
+        """
+        return _Tracked(stream, self) if self.active else stream
+
+    def _report(self, now):
+        if not self.callback:
+            return
+        elapsed = now - self.began
+        fraction = eta = None
+        if self.total:
+            fraction = min(self.done/self.total, 1)
+            if self.done:
+                eta = elapsed*(1 - fraction)/fraction
+        self.callback(Progress(
+            filename = self.filename,
+            phase = self.phase,
+            done = self.done,
+            total = self.total,
+            units = self.units,
+            fraction = fraction,
+            elapsed = elapsed,
+            eta = eta,
+        ))
+
+
+class _Tracked:
+    # wraps a binary stream, reporting the bytes that pass through it
+    def __init__(self, stream, monitor):
+        self.stream = stream
+        self.monitor = monitor
+        self.count = 0
+
+    def _add(self, count):
+        self.count += count
+        self.monitor.update(self.count)
+        return count
+
+    def write(self, data):
+        return self._add(self.stream.write(data))
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self._add(len(data))
+        return data
+
+    def readinto(self, buffer):
+        return self._add(self.stream.readinto(buffer))
+
+    def readline(self, size=-1):
+        data = self.stream.readline(size)
+        self._add(len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+# ProgressBar class {{{1
+class ProgressBar:
+    """
+    Progress Bar
+
+    A progress callback that draws a bar on the standard error stream.  The bar
+    is redrawn in place and erased by :meth:`close`.  It may be used as a
+    context manager that gives the callback, or None if not enabled, and erases
+    the bar on exit::
+
+        with ProgressBar() as progress:
+            psf = PSF(filename, progress=progress)
+
+    stream (file):
+        The stream on which to draw the bar.
+    width (int):
+        The width of the bar in characters.
+    enabled (bool):
+        Whether the bar is shown.
+    """
+
+    def __init__(self, stream=None, width=30, enabled=True):
+        self.stream = stream or sys.stderr
+        self.width = width
+        self.enabled = enabled
+        self.shown = 0
+
+    def __enter__(self):
+        return self if self.enabled else None
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __call__(self, progress):
+        with Quantity.prefs(prec=2, strip_zeros=False):
+            if progress.fraction is None:
+                bar = ''
+                amount = Quantity(progress.done, progress.units) if progress.done else ''
+            else:
+                filled = round(self.width*progress.fraction)
+                bar = '[' + '#'*filled + '-'*(self.width - filled) + '] '
+                amount = '{:3.0f}%'.format(100*progress.fraction)
+            line = f'{progress.phase:<12} {bar}{amount}'
+            if progress.eta and progress.fraction < 1:
+                line += f'  ETA {Quantity(progress.eta, "s")}'
+        self.stream.write('\r' + line.ljust(self.shown))
+        self.stream.flush()
+        self.shown = len(line)
+
+    def close(self):
+        """
+        Close
+
+        Erases the bar.
+        """
+        if self.shown:
+            self.stream.write('\r' + ' '*self.shown + '\r')
+            self.stream.flush()
+            self.shown = 0
@@ -21,6 +21,10 @@ Read PSF File
 
 # Imports {{{1
 from .parse import ParsePSF, ParseError
+from .interning import SweepStore, share_psf
+from .index import RowIndex, index_filepath
+from .progress import Cancelled, Monitor
+from .storage import Storage
 from inform import Error, Info, join, log, os_error
 from pathlib import Path
 import numpy as np
@@ -29,18 +33,130 @@ try:
     import cPickle as pickle
 except ImportError:
     import pickle
+import os
 import re
+import time
+
+
+# Globals {{{1
+READ_CHUNK = 1 << 24    # bytes read at a time when reporting progress
 
 
 # Utilities {{{1
 class Signal(Info):
-    pass
+    def __getattr__(self, name):
+        # a compact signal is expanded when its ordinate is first accessed
+        if name == 'ordinate':
+            runs = self.__dict__.get('compact')
+            if runs is not None:
+                ordinate = self.__dict__['ordinate'] = runs.expand()
+                return ordinate
+        return super().__getattr__(name)
 
 
 class UnknownSignal(Error):
     template = 'unknown signal: {}.'
 
 
+class LoadStats(Info):
+    """
+    Load Statistics
+
+    Describes how the data of a PSF object was loaded.
+
+    filename (str):
+        The path to the PSF file.
+    times (dict):
+        Maps each phase to the time it took in seconds.  The phases are
+        parser setup, read, decode, parse, build (constructing the signals,
+        including converting the units of DC values), compact, cache read,
+        cache write and index write.  Only the phases that occurred are
+        included.  Parse includes the fast reader, whose time is also given
+        separately.
+    total (float):
+        The total time in seconds.
+    cache (str):
+        What became of the cache: hit (the data was read from the cache), miss
+        (there was no cache), stale (the cache was older than the file),
+        unusable (the cache could not be read or was written with a different
+        precision) or not used.
+    bytes (int):
+        The size of the PSF file, None if it was not read.
+    fast_path (bool):
+        Whether the values were read by the fast reader, None if the file was
+        not parsed or has no values.
+    fallback (str):
+        Why the fast reader was not used, including the line of the PSF file on
+        which the problem was found if known.
+    partial (bool):
+        True if a partial last row was found and discarded by the fast reader,
+        as occurs when a simulation is interrupted.
+    rows (int):
+        The number of points in the sweep, None if not swept.
+    signals (int):
+        The number of signals.
+    memory (int):
+        The bytes held by the arrays of signal values.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.start = time.perf_counter()
+        self.times = {}
+
+    def phase(self, name):
+        """
+        Phase
+
+        Returns a context manager that adds the time spent within it to the
+        named phase.
+        """
+        return _Phase(self.times, name)
+
+    def summary(self):
+        """
+        Summary
+
+        Returns the statistics as lines of text.
+        """
+        with Quantity.prefs(prec=3, map_sf=Quantity.map_sf_to_greek):
+            lines = [f'load statistics for {self.filename}:']
+            width = max([len(p) for p in self.times] + [5]) + 1
+            for phase, duration in self.times.items():
+                note = ''
+                if phase == 'read':
+                    note = f'  ({Quantity(self.bytes, "B")})'
+                elif phase == 'parse':
+                    if self.partial:
+                        note = '  (fast reader, partial last row discarded)'
+                    elif self.fast_path:
+                        note = '  (fast reader)'
+                    elif self.fast_path is False:
+                        note = f'  (fast reader not used: {self.fallback})'
+                elif phase == 'build':
+                    note = f'  ({self.signals} signals, {Quantity(self.memory, "B")})'
+                lines.append(f'    {phase + ":":<{width}} {Quantity(duration, "s")}{note}')
+            lines.append(f'    {"total:":<{width}} {Quantity(self.total, "s")}')
+            lines.append(f'    {"cache:":<{width}} {self.cache}')
+            if self.rows is not None:
+                lines.append(f'    {"rows:":<{width}} {self.rows}')
+        return '\n'.join(lines)
+
+
+class _Phase:
+    # context manager that accumulates the time spent in a phase
+    def __init__(self, times, name):
+        self.times = times
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        self.times[self.name] = self.times.get(self.name, 0) + elapsed
+
+
 unicode_unit_maps = {
     r'sqrt\(([^)]+)\)': r'√\1',
     r'\^2': '²',
@@ -79,29 +195,122 @@ class PSF:
         This can substantially reduced the time required to access the data.
     update_cache (bool):
         If True, a cached version of the data is updated if it does not exist or
-        is out-of-date.
+        is out-of-date.  An index of the rows in the VALUE section is also saved
+        beside the cache (see :func:`psf_utils.index.get_row_index`).
+    compact (bool or float):
+        If True or a tolerance, swept signals that are piecewise constant, such
+        as logic signals, are stored as runs, which are expanded when the
+        ordinate is first accessed.  Such signals have a *compact* attribute
+        that supports edge queries without expansion (see
+        :class:`psf_utils.compact.Runs`).  If True the conversion is lossless,
+        otherwise values may change by as much as the tolerance, which is given
+        in the units of the signal.
+    dtype (str or dtype):
+        The precision used to store swept signals, float64 (the default),
+        float32 or float16.  Sweeps are always stored as float64.  Values are
+        converted as the file is parsed.  See :class:`psf_utils.storage.Storage`
+        for the error introduced.
+    dtypes (dict):
+        Precisions for particular signals, given as a dictionary that maps
+        glob patterns to precisions.  For example, {'clk*': 'float16'}.
+    compress_cache (bool or str):
+        If True or the name of a codec (zlib, bz2 or lzma), the cache is
+        written in a compressed form in which each signal is stored in
+        independently compressed chunks (see :mod:`psf_utils.cache`).  Either
+        form of the cache is read regardless of this setting.
+    progress (callable):
+        Called with a :class:`psf_utils.progress.Progress` object as the load
+        proceeds, giving the phase, the amount done and the estimated time
+        remaining.  :class:`psf_utils.progress.ProgressBar` draws a bar.
+    cancel (threading.Event or callable):
+        Cancels the load once the event is set or the callable returns True,
+        in which case :class:`psf_utils.progress.Cancelled` is raised.  The
+        load stops promptly and the cache is left untouched; the cache and
+        index are written to temporary files that only replace the originals
+        once complete.
+    intern (bool):
+        If True, sweeps are shared with other PSF objects that were loaded with
+        *intern* and hold the same values, as are the strings of the header
+        and types, and the cache places large sweeps in a store shared by the
+        caches of the directory (see :mod:`psf_utils.interning`).  Shared
+        sweeps are read-only.
+
+    The time taken by each phase of loading the data is recorded in the
+    *load_stats* attribute (see :class:`LoadStats`).  If the *load_hook* class
+    attribute is set, it is called with these statistics after every load.
     """
+    load_hook = None
 
-    def __init__(self, filename, sep=':', use_cache=True, update_cache=True):
+    def __init__(
+        self, filename, sep=':', use_cache=True, update_cache=True, compact=False,
+        dtype=None, dtypes=None, compress_cache=False, progress=None, cancel=None,
+        intern=False,
+    ):
         psf_filepath = Path(filename)
         cache_filepath = psf_filepath.with_suffix(psf_filepath.suffix + '.cache')
+        storage = Storage(dtype, dtypes)
+        stats = LoadStats(filename=str(psf_filepath))
+        monitor = Monitor(progress, cancel, str(psf_filepath))
 
         # read cache if desired and current
         if use_cache:
             try:
                 if cache_filepath.stat().st_mtime > psf_filepath.stat().st_mtime:
-                    self._read_cache(cache_filepath)
+                    with stats.phase('cache read'):
+                        self._read_cache(cache_filepath, monitor, intern)
+                        if intern:
+                            share_psf(self)
+                    if self.__dict__.get('storage', Storage()) != storage:
+                        raise Error('cache was written with a different precision.')
+                    if compact is not False:
+                        with stats.phase('compact'):
+                            self._compact_signals(compact)
+                    if update_cache and compress_cache:
+                        from .cache import is_compressed
+                        if not is_compressed(cache_filepath):
+                            with stats.phase('cache write'):
+                                self._write_cache(
+                                    cache_filepath, compress_cache, monitor, intern
+                                )
+                    stats.cache = 'hit'
+                    self._loaded(stats)
                     return
+                stats.cache = 'stale'
+            except Cancelled:
+                raise
             except OSError as e:
                 log(os_error(e))
+                stats.cache = 'miss'
             except Exception as e:
                 log(e)
+                stats.cache = 'unusable'
+        else:
+            stats.cache = 'not used'
 
         # open and parse PSF file
-        parser = ParsePSF()
+        with stats.phase('parser setup'):
+            parser = ParsePSF()
         try:
-            content = psf_filepath.read_text()
-            sections = parser.parse(filename, content)
+            with stats.phase('read'):
+                raw = self._read_file(psf_filepath, monitor)
+            stats.bytes = len(raw)
+            with stats.phase('decode'):
+                monitor.start('decode')
+                content = raw.decode()
+            with stats.phase('parse'):
+                monitor.start('parse', len(content), 'chars')
+                sections = parser.parse(filename, content, storage, monitor)
+                monitor.finish()
+            fast_path = parser.fast_path
+            if fast_path:
+                stats.fast_path = fast_path.taken
+                if fast_path.taken:
+                    stats.times['fast reader'] = fast_path.time
+                    stats.partial = fast_path.partial
+                elif fast_path.line:
+                    stats.fallback = f'{fast_path.reason}, line {fast_path.line}'
+                else:
+                    stats.fallback = fast_path.reason
         except ParseError as e:
             raise Error(str(e))
         except OSError as e:
@@ -117,11 +326,13 @@ class PSF:
                 )
             )
 
+        build_start = time.perf_counter()
         meta, types, sweeps, traces, values = sections
         self.meta = meta
         self.types = types
         self.sweeps = sweeps
         self.traces = traces
+        self.storage = storage
 
         # add values to sweeps
         if sweeps:
@@ -130,18 +341,24 @@ class PSF:
                 val_obj = values[n]
                 # Check for fast read
                 if getattr(val_obj, 'is_fast', False):
-                    sweep.abscissa = val_obj.values
+                    sweep.abscissa = val_obj.values[0]
                 else:
                     sweep.abscissa = np.array([v[0] for v in val_obj.values])
+                if sweep is not sweeps[-1]:
+                    # an outer sweep of nested sweeps, record the row of the
+                    # inner sweep at which each of its values takes effect
+                    sweep.starts = np.array(val_obj.rows, dtype=int)
 
         # process signals
         # 1. convert to numpy and delete the original list
         # 2. convert to Signal class
         # 3. create signals dictionary
         signals = {}
+        monitor.start('build', len(values), 'signals')
         if traces:
             traces, groups = traces
-            for trace in traces:
+            for count, trace in enumerate(traces):
+                monitor.update(count)
                 name = trace.name
                 type = types.get(trace.type, trace.type)
 
@@ -166,11 +383,33 @@ class PSF:
                     joined_name = prefix + n
 
                     if is_fast:
-                        # Fast read assumes simple scalar floats
-                        ordinate = vals
+                        # the fast reader gives each value as an array that
+                        # spans the sweep, or a list of them if composite
+                        ordinate = get_value(vals, i)
+                        if 'complex' in t.kind:
+                            real, imag = ordinate
+                            ordinate = np.empty(
+                                len(real), dtype=storage.complex_dtype(joined_name)
+                            )
+                            ordinate.real = real
+                            ordinate.imag = imag
+                        elif 'float' in t.kind:
+                            ordinate = ordinate.astype(
+                                storage.real_dtype(joined_name), copy=False
+                            )
+                        elif 'int' in t.kind:
+                            ordinate = ordinate.astype(int)
                     else:
                         if 'complex' in t.kind:
-                            ordinate = np.array([complex(*get_value(v, i)) for v in vals])
+                            ordinate = np.array(
+                                [complex(*get_value(v, i)) for v in vals],
+                                dtype = storage.complex_dtype(joined_name)
+                            )
+                        elif 'float' in t.kind:
+                            ordinate = np.array(
+                                [get_value(v, i) for v in vals],
+                                dtype = storage.real_dtype(joined_name)
+                            )
                         else:
                             ordinate = np.array([get_value(v, i) for v in vals])
 
@@ -193,49 +432,107 @@ class PSF:
         else:
             # no traces, this should be a DC op-point analysis dataset
             for name, value in values.items():
-                is_fast = getattr(value, 'is_fast', False)
-                if is_fast:  # pragma: no cover
-                    # Fast reader doesn't handle DC files (no SWEEP section)
-                     v = value.values[0]
-                else:
-                    assert len(value.values) == 1
-                    type = types[value.type]
-                    if type.struct:
-                        for t, v in zip(type.struct.types.values(), value.values[0][0]):
-                            n = f'{name}.{t.name}'
-                            if 'float' in t.kind:
-                                v = Quantity(v, unicode_units(t.units))
-                            elif 'complex' in t.kind:
-                                v = complex(v[0], v[1])
-                            signal = Signal(
-                                name = n,
-                                ordinate = v,
-                                type = t,
-                                units = t.units,
-                                meta = meta,
-                            )
-                            signals[n] = signal
-                    else:
-                        if 'float' in type.kind:
-                            v = Quantity(value.values[0][0], unicode_units(type.units))
-                        elif 'complex' in type.kind:  # pragma: no cover
-                            v = complex(value.values[0][0], value.values[0][1])
-                        else:
-                            v = value.values[0]
-
+                assert len(value.values) == 1
+                type = types[value.type]
+                if type.struct:
+                    for t, v in zip(type.struct.types.values(), value.values[0][0]):
+                        n = f'{name}.{t.name}'
+                        if 'float' in t.kind:
+                            v = Quantity(v, unicode_units(t.units))
+                        elif 'complex' in t.kind:
+                            v = complex(v[0], v[1])
                         signal = Signal(
-                            name = name,
+                            name = n,
                             ordinate = v,
-                            type = type,
-                            access = type.name,
-                            units = type.units,
+                            type = t,
+                            units = t.units,
                             meta = meta,
                         )
-                        signals[name] = signal
+                        signals[n] = signal
+                else:
+                    if 'float' in type.kind:
+                        v = Quantity(value.values[0][0], unicode_units(type.units))
+                    elif 'complex' in type.kind:  # pragma: no cover
+                        v = complex(value.values[0][0], value.values[0][1])
+                    else:
+                        v = value.values[0]
+
+                    signal = Signal(
+                        name = name,
+                        ordinate = v,
+                        type = type,
+                        access = type.name,
+                        units = type.units,
+                        meta = meta,
+                    )
+                    signals[name] = signal
         self.signals = signals
+        if intern:
+            share_psf(self)
+        monitor.finish()
+        stats.times['build'] = time.perf_counter() - build_start
+        if compact is not False:
+            with stats.phase('compact'):
+                monitor.start('compact')
+                self._compact_signals(compact)
 
         if update_cache:
-            self._write_cache(cache_filepath)
+            with stats.phase('cache write'):
+                self._write_cache(cache_filepath, compress_cache, monitor, intern)
+            if sweeps and len(sweeps) == 1:
+                with stats.phase('index write'):
+                    monitor.start('index write')
+                    self._write_index(raw, psf_filepath)
+        self._loaded(stats)
+
+    def _loaded(self, stats):
+        # completes the load statistics and passes them to the hook
+        sweep = self.get_sweep(-1)
+        stats.rows = len(sweep.abscissa) if sweep else None
+        stats.signals = len(self.signals)
+        stats.memory = sum(
+            s.__dict__['ordinate'].nbytes for s in self.signals.values()
+            if isinstance(s.__dict__.get('ordinate'), np.ndarray)
+        )
+        stats.total = time.perf_counter() - stats.start
+        self.load_stats = stats
+        hook = type(self).load_hook
+        if hook:
+            hook(stats)
+
+    @classmethod
+    async def aopen(cls, filename, executor=None, **kwargs):
+        """
+        Open Asynchronously
+
+        filename (str or Path):
+            Path to ASCII PSF file.
+        executor (concurrent.futures.Executor):
+            The executor that performs the load, the default executor of the
+            event loop if None.
+        kwargs:
+            Passed to :class:`PSF`.
+
+        A coroutine that loads the file in an executor, so the event loop is not
+        blocked.  Concurrent requests for the same file share a single load.
+        See :func:`psf_utils.aio.open_psf`.
+        """
+        from .aio import open_psf
+        return await open_psf(filename, executor, **kwargs)
+
+    def share(self):
+        """
+        Share
+
+        Places the data in shared memory and returns a
+        :class:`psf_utils.shared.SharedPSF` handle.  The handle can be passed to
+        other processes, such as multiprocessing workers, which call its
+        *attach()* method to get a PSF object whose arrays are views of the
+        shared memory rather than copies.  The memory is released when the
+        handle is closed or discarded, or when this process exits.
+        """
+        from .shared import SharedPSF
+        return SharedPSF(self)
 
     def get_sweep(self, index=0):
         """
@@ -243,11 +540,37 @@ class PSF:
 
         index (int):
             PSF allows multiple sweeps (abscissas). You can use this argument to
-            select the one you want. The default is 0.
+            select the one you want. The default is 0.  If the sweeps are
+            nested, the last is the inner sweep, the one whose values are
+            paired with those of the signals.  The abscissa of an outer sweep
+            holds one value for each block of rows and its *starts* attribute
+            holds the first row of each block (see :meth:`get_array`).
         """
         if self.sweeps:
             return self.sweeps[index]
 
+    def get_array(self, name, grid=None, kind='linear'):
+        """
+        Get Array
+
+        name (string):
+            Name of signal return.
+        grid (array):
+            The values of the inner sweep onto which each block of rows is
+            resampled, needed if the blocks differ in length.
+        kind (string):
+            'linear' for linear interpolation, or 'hold' to hold the previous
+            value.
+
+        Returns the values of a signal of a file with nested sweeps as an
+        N-dimensional :class:`psf_utils.nested.SweptArray` with one named axis
+        per sweep, the inner sweep last.  Unless a grid is given, the array is
+        a view of the signal.  Raises UnknownSignal if the name given does not
+        correspond to a known signal.
+        """
+        from .nested import get_array
+        return get_array(self, name, grid, kind)
+
     def get_signal(self, name):
         """
         Get Signal
@@ -263,6 +586,86 @@ class PSF:
         except KeyError:
             raise UnknownSignal(name, choices=self.signals.keys())
 
+    def eval(self, expr):
+        """
+        Evaluate Expression
+
+        expr (string):
+            An expression involving signals, constants, the operators + - * / ^
+            and functions such as db(), ph(), mag(), deriv() and V(p,n).  For
+            example: (out_p-out_n)/2 or db(out/in).
+
+        Returns a Signal whose ordinate holds the value of the expression.
+        Only the signals referenced by the expression are accessed, and
+        repeated subexpressions are computed once.  Raises UnknownSignal if the
+        expression references an unknown signal.
+        """
+        from .expr import evaluate
+        value, units = evaluate(self, expr)[0]
+        return Signal(name=expr, ordinate=value, units=units)
+
+    def resample(self, grid, names=None, kind='linear'):
+        """
+        Resample
+
+        grid (array):
+            The new abscissa.
+        names (list of strings):
+            Names of the signals to resample, all swept signals if None.
+        kind (string):
+            'linear' for linear interpolation, or 'hold' to hold the previous
+            value.
+
+        Returns the names of the signals along with a 2D array that holds the
+        resampled signals, one per row.  See
+        :func:`psf_utils.resample.resample_signals` for more control.
+        """
+        from .resample import resample_signals
+        return resample_signals(self, grid, names, kind)
+
+    def to_pandas(self, names=None):
+        """
+        To Pandas
+
+        names (list of strings):
+            Names of the signals to include, all numeric signals if None.
+
+        Returns a pandas DataFrame indexed by the sweep, which is a view of the
+        data where possible.  Requires pandas.  See
+        :func:`psf_utils.frames.to_pandas`.
+        """
+        from .frames import to_pandas
+        return to_pandas(self, names)
+
+    def to_xarray(self, names=None):
+        """
+        To Xarray
+
+        names (list of strings):
+            Names of the signals to include, all numeric signals if None.
+
+        Returns an xarray Dataset whose variables wrap the signals without
+        copying them.  Requires xarray.  See :func:`psf_utils.frames.to_xarray`
+        and :func:`psf_utils.frames.runs_to_xarray` for Monte Carlo runs.
+        """
+        from .frames import to_xarray
+        return to_xarray(self, names)
+
+    def write(self, path, names=None):
+        """
+        Write
+
+        path (str or Path):
+            The path to the new PSF file.
+        names (list of strings):
+            Names of the signals to write, all numeric signals if None.
+
+        Writes the signals to an ASCII PSF file.  See
+        :func:`psf_utils.write.write_signals`.
+        """
+        from .write import write_signals
+        write_signals(self, path, names)
+
     def all_signals(self):
         """
         All Signals
@@ -272,6 +675,41 @@ class PSF:
         for signal in self.signals.values():
             yield signal
 
+    def get_bus(self, name):
+        """
+        Get Bus
+
+        name (string):
+            Name of the bus, which is the name of its bits without the index.
+            For example, the bus out gathers the signals out<0>, out<1>, etc.
+
+        Returns a :class:`psf_utils.bus.Bus`, whose ordinate is a 2D array
+        that holds the bits, most significant first.  Raises UnknownSignal if
+        there is no such bus.
+        """
+        buses = self._get_buses()
+        try:
+            return buses[name]
+        except KeyError:
+            raise UnknownSignal(name, choices=buses.keys())
+
+    def all_buses(self):
+        """
+        All Buses
+
+        Iterates through all buses.
+        """
+        for bus in self._get_buses().values():
+            yield bus
+
+    def _get_buses(self):
+        # buses are found when first needed; they are not cached on disk
+        buses = self.__dict__.get('_buses')
+        if buses is None:
+            from .bus import find_buses
+            buses = self._buses = find_buses(self)
+        return buses
+
     def log_x(self, sweep=None):
         """
         Log X
@@ -279,7 +717,7 @@ class PSF:
         True if PSF is recommending a logarithmic x-axis.
         """
         if not sweep:
-            sweep = self.get_sweep()
+            sweep = self.get_sweep(-1)
         return sweep.grid == 3
 
     def log_y(self, sweep=None):
@@ -289,7 +727,7 @@ class PSF:
         True if PSF is recommending a logarithmic y-axis.
         """
         if not sweep:
-            sweep = self.get_sweep()
+            sweep = self.get_sweep(-1)
         return sweep.grid == 3
 
     @staticmethod
@@ -314,10 +752,96 @@ class PSF:
         """
         return units
 
-    def _read_cache(self, cache_filepath):
+    def _compact_signals(self, tol):
+        from .compact import compact
+        sweep = self.get_sweep(-1)
+        if not sweep:
+            return
+        tol = 0 if tol is True else tol
+        for signal in self.signals.values():
+            if signal.__dict__.get('compact') is None:
+                runs = compact(signal.ordinate, sweep.abscissa, tol)
+                if runs is not None:
+                    signal.compact = runs
+                    del signal.ordinate
+
+    def _read_file(self, psf_filepath, monitor):
+        # reads the file in chunks when reporting progress so the load can be
+        # cancelled while reading
+        if not monitor.active:
+            return psf_filepath.read_bytes()
+        with open(psf_filepath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            monitor.start('read', size, 'B')
+            raw = bytearray(size)
+            with memoryview(raw) as view:
+                done = 0
+                while done < size:
+                    count = f.readinto(view[done:done + READ_CHUNK])
+                    if not count:
+                        break
+                    done += count
+                    monitor.update(done)
+            del raw[done:]
+        monitor.finish()
+        return raw
+
+    def _read_cache(self, cache_filepath, monitor=None, intern=False):
+        from . import cache
+        if cache.is_compressed(cache_filepath):
+            self.__dict__ = cache.read(cache_filepath)
+            return
         with open(cache_filepath, 'rb') as f:
-            self.__dict__ = pickle.load(f)
+            if monitor:
+                monitor.start('cache read', os.fstat(f.fileno()).st_size, 'B')
+                f = monitor.track(f)
+            self.__dict__ = SweepStore(cache_filepath.parent).load(f, intern)
+        if monitor:
+            monitor.finish()
+
+    def _write_cache(self, cache_filepath, compress=False, monitor=None, intern=False):
+        # the statistics describe a particular load, so they are not cached
+        # the cache is written atomically so an interrupted write leaves no
+        # truncated cache behind
+        from . import cache
+        attributes = {k: v for k, v in self.__dict__.items() if k != 'load_stats'}
+        store = SweepStore(cache_filepath.parent)
+        keys = []   # the sweeps the cache places in the store
+        if monitor:
+            # the size of the cache is estimated from that of the arrays
+            size = sum(a.nbytes for a in self._arrays())
+            monitor.start('cache write', size or None, 'B')
+        with cache.atomic_write(cache_filepath) as f:
+            if monitor:
+                f = monitor.track(f)
+            if compress:
+                codec = 'zlib' if compress is True else compress
+                cache.dump(f, attributes, codec)
+            elif intern:
+                keys = store.dump(attributes, f)
+            else:
+                pickle.dump(attributes, f, pickle.HIGHEST_PROTOCOL)
+            if monitor:
+                # a cancelled write is discarded rather than replacing the cache
+                monitor.check()
+        store.record(cache_filepath.name, keys)
+        if monitor:
+            monitor.finish()
+
+    def _arrays(self):
+        # the arrays that hold the values of the sweeps and signals
+        for sweep in self.sweeps or []:
+            if isinstance(sweep.abscissa, np.ndarray):
+                yield sweep.abscissa
+        for signal in self.signals.values():
+            ordinate = signal.__dict__.get('ordinate')
+            if isinstance(ordinate, np.ndarray):
+                yield ordinate
 
-    def _write_cache(self, cache_filepath):
-        with open(cache_filepath, 'wb') as f:
-            pickle.dump(self.__dict__, f, pickle.HIGHEST_PROTOCOL)
+    def _write_index(self, raw, psf_filepath):
+        try:
+            index = RowIndex.build(raw)
+            if index:
+                index.save(index_filepath(psf_filepath), psf_filepath)
+        except OSError as e:
+            log(os_error(e))
@@ -0,0 +1,258 @@
+"""
+Resample Signals
+
+Interpolates blocks of signals onto a common grid.  The search for the points
+that bracket each point of the new grid is done once and reused for every
+signal, and long grids are processed in chunks to bound the size of the
+temporaries.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from inform import Error
+import numpy as np
+
+
+# Globals {{{1
+DEFAULT_CHUNK = 1 << 16
+kinds = ['linear', 'hold']
+
+
+# Grids {{{1
+# uniform_grid() {{{2
+def uniform_grid(start, stop, num=None, step=None):
+    """
+    Uniform Grid
+
+    Returns a grid of equally spaced points from start to stop, inclusive.
+    Give either the number of points or the step between them.  If the step
+    does not evenly divide the interval, the grid ends at the last point that
+    does not exceed stop.
+
+    start, stop (float):
+        The bounds of the grid.
+    num (int):
+        The number of points.
+    step (float):
+        The spacing between points.
+    """
+    if (num is None) == (step is None):
+        raise Error('specify either num or step.')
+    if num is not None:
+        return np.linspace(start, stop, int(num))
+    count = int(np.floor((stop - start)/step*(1 + 1e-12))) + 1
+    return start + step*np.arange(count)
+
+
+# log_grid() {{{2
+def log_grid(start, stop, num=None, per_decade=None):
+    """
+    Logarithmic Grid
+
+    Returns a grid of logarithmically spaced points from start to stop,
+    inclusive.  Give either the total number of points or the number of points
+    per decade.
+
+    start, stop (float):
+        The bounds of the grid, both must be positive.
+    num (int):
+        The number of points.
+    per_decade (int):
+        The number of points per decade.
+    """
+    if start <= 0 or stop <= 0:
+        raise Error('bounds of a logarithmic grid must be positive.')
+    if (num is None) == (per_decade is None):
+        raise Error('specify either num or per_decade.')
+    if num is None:
+        num = int(round(np.log10(stop/start)*per_decade)) + 1
+    return np.logspace(np.log10(start), np.log10(stop), int(num))
+
+
+# Interpolator class {{{1
+class Interpolator:
+    """
+    Interpolator
+
+    Maps signals sampled on one abscissa onto a new grid.  The bracketing
+    indices and interpolation weights are computed once when the interpolator
+    is created and then applied to any number of signals.
+
+    x (array):
+        The original abscissa, which must be ascending.
+    grid (array):
+        The new abscissa.
+    kind (str):
+        'linear' for linear interpolation or 'hold' to use the value at the
+        last original point that does not follow the new point, which is
+        appropriate for piecewise-constant signals.
+    fill (float):
+        The value given to points of the grid that lie outside the original
+        abscissa.  If None, the first and last values are extended.
+    chunk (int):
+        The number of grid points processed at once.
+    """
+
+    def __init__(self, x, grid, kind='linear', fill=None, chunk=DEFAULT_CHUNK):
+        if kind not in kinds:
+            raise Error(
+                f'unknown interpolation: {kind}.',
+                codicil = f"Choose from {', '.join(kinds)}."
+            )
+        x = np.asarray(x, dtype=float)
+        grid = np.asarray(grid, dtype=float)
+        if len(x) < 1:
+            raise Error('cannot resample an empty signal.')
+        self.grid = grid
+        self.kind = kind
+        self.fill = fill
+        self.chunk = max(int(chunk or len(grid)), 1)
+        self.size = len(x)
+
+        # bracketing indices and weights
+        last = max(len(x) - 2, 0)
+        index = np.searchsorted(x, grid, side='right') - 1
+        self.outside = (grid < x[0]) | (grid > x[-1])
+        if kind == 'hold':
+            self.index = np.clip(index, 0, len(x) - 1)
+            self.frac = None
+        else:
+            self.index = np.clip(index, 0, last)
+            if len(x) > 1:
+                x0 = x[self.index]
+                dx = x[self.index + 1] - x0
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    frac = np.where(dx > 0, (grid - x0)/dx, 0)
+                self.frac = np.clip(frac, 0, 1)
+            else:
+                self.frac = np.zeros(len(grid))
+                self.index = np.zeros(len(grid), dtype=int)
+        if not self.outside.any():
+            self.outside = None
+
+    def __call__(self, y, out=None):
+        """
+        Interpolate
+
+        y (array or list of arrays):
+            A single signal, a 2D array with one signal per row, or a list of
+            signals.  A list avoids stacking the signals into a new array.
+        out (array):
+            Optionally, the array into which the results are written.  Must
+            have one row per signal and one column per grid point.
+
+        Returns the resampled signals, a 1D array for a single signal and a 2D
+        array with one row per signal otherwise.
+        """
+        single = not isinstance(y, (list, tuple)) and np.ndim(y) == 1
+        rows = [y] if single else y
+        if not isinstance(rows, np.ndarray):
+            rows = [np.asarray(r) for r in rows]
+        if any(len(r) != self.size for r in rows):
+            raise Error('signal and abscissa lengths differ.')
+        dtype = np.result_type(float, *[r.dtype for r in rows]) if len(rows) else float
+        if out is None:
+            out = np.empty((len(rows), len(self.grid)), dtype=dtype)
+
+        for start in range(0, len(self.grid), self.chunk):
+            stop = min(start + self.chunk, len(self.grid))
+            index = self.index[start:stop]
+            if isinstance(rows, np.ndarray):
+                # one block operation covers all signals
+                out[:, start:stop] = self._apply(rows, index, start, stop, dtype)
+            else:
+                for i, row in enumerate(rows):
+                    out[i, start:stop] = self._apply(row, index, start, stop, dtype)
+
+        if self.outside is not None and self.fill is not None:
+            out[:, self.outside] = self.fill
+        return out[0] if single else out
+
+    def _apply(self, y, index, start, stop, dtype):
+        y0 = y[..., index]
+        if self.frac is None or self.size == 1:
+            return y0
+        y1 = y[..., index + 1].astype(dtype, copy=False)
+        y1 -= y0
+        y1 *= self.frac[start:stop]
+        y1 += y0
+        return y1
+
+
+# resample() {{{1
+def resample(x, y, grid, kind='linear', fill=None, chunk=DEFAULT_CHUNK):
+    """
+    Resample
+
+    Interpolates signals onto a new grid.
+
+    x (array):
+        The original abscissa, which must be ascending.
+    y (array or list of arrays):
+        A single signal, a 2D array with one signal per row, or a list of
+        signals.
+    grid (array):
+        The new abscissa.
+    kind (str):
+        'linear' or 'hold'.
+    fill (float):
+        The value given to points outside the original abscissa.  If None, the
+        first and last values are extended.
+    chunk (int):
+        The number of grid points processed at once.
+    """
+    return Interpolator(x, grid, kind, fill, chunk)(y)
+
+
+# resample_signals() {{{1
+def resample_signals(psf, grid, names=None, kind='linear', fill=None, chunk=DEFAULT_CHUNK):
+    """
+    Resample Signals
+
+    Interpolates signals from a PSF file onto a new grid.
+
+    psf (PSF):
+        The PSF data.
+    grid (array):
+        The new abscissa, for example from :func:`uniform_grid`,
+        :func:`log_grid` or the sweep of another PSF file.
+    names (list of str):
+        Names of the signals to resample.  If None, all swept signals are
+        resampled.
+    kind (str):
+        'linear' or 'hold'.
+    fill (float):
+        The value given to points outside the original abscissa.  If None, the
+        first and last values are extended.
+    chunk (int):
+        The number of grid points processed at once.
+
+    Returns the names of the signals and a 2D array that contains the
+    resampled signals, one per row.
+    """
+    sweep = psf.get_sweep(-1)
+    if not sweep:
+        raise Error('resampling requires swept data.')
+    if names is None:
+        names = [
+            s.name for s in psf.all_signals()
+            if 'string' not in (s.type.kind or '')
+        ]
+    interpolate = Interpolator(sweep.abscissa, grid, kind, fill, chunk)
+    return names, interpolate([psf.get_signal(n).ordinate for n in names])
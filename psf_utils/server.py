@@ -0,0 +1,497 @@
+# Usage {{{1
+"""
+PSF Server
+
+A resident process that keeps recently used PSF files loaded, so that
+list-psf and show-psf need not load the data anew on each run.
+
+Usage:
+    psf-server [options] start
+    psf-server [options] run
+    psf-server [options] stop
+    psf-server [options] status
+
+Options:
+    -s <path>, --socket <path>    the path of the socket of the server
+    -n <count>, --max-files <count>
+                                  the number of files kept loaded [default: 8]
+    -i <secs>, --idle <secs>      exit after this many seconds without a request,
+                                  never if 0 [default: 3600]
+    -V, --version                 show version number and exit
+
+start runs the server in the background, run runs it in the foreground, stop
+stops a running server and status lists the files it holds.
+
+The server is reached through a Unix domain socket, by default psf-server.sock
+in $XDG_RUNTIME_DIR, or in a private directory in /tmp if that is not set.
+Set $PSF_SERVER_SOCKET to use another path.  If the server is not running,
+list-psf and show-psf load the data themselves.
+
+The data of each file is held in an anonymous shared memory file that is passed
+to the client, which maps it into its own memory rather than copying it.  If
+the PSF file changes, it is reloaded on the next request.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .psf import PSF, LoadStats, Quantity
+from .shared import Layout, read
+from . import __version__, __released__
+from collections import OrderedDict
+from docopt import docopt
+from inform import Error, display, done, full_stop, os_error, plural
+from pathlib import Path
+import json
+import mmap
+import os
+import socket
+import tempfile
+import threading
+import time
+
+
+# Globals {{{1
+SOCKET_VAR = 'PSF_SERVER_SOCKET'
+MAX_FILES = 8
+IDLE = 3600         # seconds without a request before the server exits
+STARTUP = 10        # seconds to wait for a server to start
+supported = hasattr(socket, 'AF_UNIX') and hasattr(socket, 'send_fds')
+
+
+# Utilities {{{1
+# socket_path() {{{2
+def socket_path():
+    """
+    Socket Path
+
+    Returns the path of the socket of the server: $PSF_SERVER_SOCKET if set,
+    otherwise psf-server.sock in $XDG_RUNTIME_DIR, or in a directory in the
+    temporary directory that is private to the user.
+    """
+    path = os.environ.get(SOCKET_VAR)
+    if path:
+        return Path(path)
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return Path(runtime, 'psf-server.sock')
+    return Path(tempfile.gettempdir(), f'psf-server-{os.getuid()}', 'socket')
+
+
+# _send() {{{2
+def _send(sock, message, fds=()):
+    # sends a message, a line of JSON, along with any file descriptors
+    data = json.dumps(message).encode() + b'\n'
+    sent = socket.send_fds(sock, [data], fds) if fds else 0
+    sock.sendall(data[sent:])
+
+
+# _receive() {{{2
+def _receive(sock):
+    # receives a message along with any file descriptors
+    data = b''
+    fds = []
+    while not data.endswith(b'\n'):
+        chunk, received, flags, address = socket.recv_fds(sock, 1 << 16, 4)
+        fds += received
+        if not chunk:
+            for fd in fds:
+                os.close(fd)
+            raise ConnectionError('connection closed by peer.')
+        data += chunk
+    return json.loads(data), fds
+
+
+# _shared_file() {{{2
+def _shared_file():
+    # returns the descriptor of an anonymous file held in memory where
+    # available, otherwise of an unlinked temporary file
+    if hasattr(os, 'memfd_create'):
+        return os.memfd_create('psf', os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+    with tempfile.TemporaryFile() as f:
+        return os.dup(f.fileno())
+
+
+# _publish() {{{2
+def _publish(psf):
+    # writes the data of a PSF object to a shared file and returns its
+    # descriptor, see psf_utils.shared for the layout
+    layout = Layout(psf)
+    fd = _shared_file()
+    try:
+        os.ftruncate(fd, max(layout.size, 1))
+        with mmap.mmap(fd, max(layout.size, 1)) as mapped:
+            layout.write(mapped)
+        if hasattr(os, 'memfd_create'):
+            # clients map the file privately, this guards against writes too
+            import fcntl
+            seals = fcntl.F_SEAL_WRITE | fcntl.F_SEAL_GROW | fcntl.F_SEAL_SHRINK
+            fcntl.fcntl(fd, fcntl.F_ADD_SEALS, seals | fcntl.F_SEAL_SEAL)
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
+# _attach() {{{2
+def _attach(fd):
+    # maps a shared file written by _publish() and returns the attributes of
+    # the PSF object; the map is private, so the arrays may be modified
+    # without affecting the server or other clients
+    try:
+        mapped = mmap.mmap(fd, os.fstat(fd).st_size, access=mmap.ACCESS_COPY)
+    finally:
+        os.close(fd)
+    return read(mapped)
+
+
+# _connect() {{{2
+def _connect(path):
+    # connects to the server, the socket must belong to the user as the
+    # server is trusted to send pickled data
+    if not supported:
+        raise ConnectionError('not supported.')
+    if path.stat().st_uid != os.getuid():
+        raise ConnectionError(f'{path} belongs to another user.')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        raise
+    return sock
+
+
+# request() {{{2
+def request(op, socket=None, **kwargs):
+    """
+    Request
+
+    Sends a request to the server and returns its response and any file
+    descriptors passed with it.  Raises OSError if the server is not running.
+
+    op (str):
+        The request: load, status or stop.
+    socket (str or Path):
+        The path of the socket of the server, see :func:`socket_path` if None.
+    kwargs:
+        The arguments of the request.
+    """
+    path = Path(socket) if socket else socket_path()
+    with _connect(path) as sock:
+        _send(sock, dict(op=op, **kwargs))
+        return _receive(sock)
+
+
+# fetch() {{{1
+def fetch(filename, sep=':', use_cache=True, socket=None):
+    """
+    Fetch
+
+    Gets a PSF file from the server, which loads it if it does not already
+    hold it.  The arrays of the signals are mapped from memory shared with
+    the server rather than copied.
+
+    filename (str or Path):
+        Path to ASCII PSF file.
+    sep (str):
+        Join string to use when converting composite names into a single name.
+    use_cache (bool):
+        If False, the server reloads the file, refreshing the cache.
+    socket (str or Path):
+        The path of the socket of the server, see :func:`socket_path` if None.
+
+    Returns a :class:`psf_utils.PSF` object, or None if the server is not
+    running or could not load the file, in which case the file should be
+    loaded directly.  The load statistics give the time taken by the request
+    and cache is server.
+    """
+    stats = LoadStats(filename=str(filename), cache='server')
+    try:
+        with stats.phase('request'):
+            response, fds = request(
+                'load', socket, path=str(Path(filename).resolve()), sep=sep,
+                use_cache=use_cache,
+            )
+    except OSError:
+        return None
+    if not fds:
+        return None
+    for fd in fds[1:]:
+        os.close(fd)
+    with stats.phase('map'):
+        attributes = _attach(fds[0])
+    psf = PSF.__new__(PSF)
+    psf.__dict__ = attributes
+    psf._loaded(stats)
+    return psf
+
+
+# Server class {{{1
+class _Entry:
+    # a loaded file held by the server
+    def __init__(self, fd, stamp):
+        self.fd = fd
+        self.stamp = stamp
+        self.size = os.fstat(fd).st_size
+        self.hits = 0
+
+
+class Server:
+    """
+    Server
+
+    Holds recently used PSF files in shared memory and passes them to clients
+    on request.
+
+    socket (str or Path):
+        The path of the socket, see :func:`socket_path` if None.
+    max_files (int):
+        The number of files held, the least recently used are released.
+    idle (float):
+        The server stops if no request arrives for this many seconds, never if
+        0 or None.
+    """
+
+    def __init__(self, socket=None, max_files=MAX_FILES, idle=IDLE):
+        self.path = Path(socket) if socket else socket_path()
+        self.max_files = max_files
+        self.idle = idle
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()        # guards the entries
+        self.loading = threading.Lock()     # files are loaded one at a time
+        self.stopping = threading.Event()
+
+    def serve(self):
+        """
+        Serve
+
+        Serves requests until stopped or idle.
+        """
+        listener = self._listen()
+        self.last = time.monotonic()
+        try:
+            while not self.stopping.is_set():
+                try:
+                    connection, address = listener.accept()
+                except socket.timeout:
+                    if self.idle and time.monotonic() - self.last > self.idle:
+                        break
+                    continue
+                self.last = time.monotonic()
+                threading.Thread(
+                    target=self._handle, args=(connection,), daemon=True
+                ).start()
+        finally:
+            listener.close()
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+            with self.lock:
+                for entry in self.entries.values():
+                    os.close(entry.fd)
+                self.entries.clear()
+
+    def stop(self):
+        """
+        Stop
+
+        Stops the server within a second.
+        """
+        self.stopping.set()
+
+    def _listen(self):
+        if not supported:
+            raise Error('not supported on this platform.')
+        if not os.environ.get(SOCKET_VAR):
+            self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        try:
+            request('status', self.path)
+            raise Error('already running.', culprit=self.path)
+        except OSError:
+            pass
+        try:
+            self.path.unlink()    # left behind by a server that did not exit
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            raise Error(os_error(e))
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            listener.bind(str(self.path))
+            os.chmod(self.path, 0o600)
+            listener.listen()
+        except OSError as e:
+            listener.close()
+            raise Error(os_error(e))
+        listener.settimeout(1)
+        return listener
+
+    def _handle(self, connection):
+        with connection:
+            try:
+                message, fds = _receive(connection)
+                op = message.pop('op', None)
+                if op == 'load':
+                    self._load(connection, **message)
+                elif op == 'status':
+                    _send(connection, self._status())
+                elif op == 'stop':
+                    self.stop()
+                    _send(connection, dict(stopping=True))
+                else:
+                    _send(connection, dict(error=f'unknown request: {op}.'))
+            except (OSError, ValueError, TypeError):
+                pass    # the client went away or sent garbage
+
+    def _load(self, connection, path, sep=':', use_cache=True):
+        key = (path, sep)
+        try:
+            stat = os.stat(path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            fd = self._hit(key, stamp) if use_cache else None
+            if fd is None:
+                with self.loading:
+                    # the file may have been loaded while waiting
+                    fd = self._hit(key, stamp) if use_cache else None
+                    if fd is None:
+                        psf = PSF(path, sep=sep, use_cache=use_cache)
+                        entry = _Entry(_publish(psf), stamp)
+                        del psf
+                        fd = self._add(key, entry)
+        except Error as e:
+            _send(connection, dict(error=full_stop(e.render())))
+            return
+        except OSError as e:
+            _send(connection, dict(error=os_error(e)))
+            return
+        try:
+            _send(connection, dict(path=path), [fd])
+        finally:
+            os.close(fd)
+
+    def _hit(self, key, stamp):
+        # returns a descriptor of the shared file of a current entry, or None;
+        # it is duplicated as the entry may be released meanwhile
+        with self.lock:
+            entry = self.entries.get(key)
+            if not entry or entry.stamp != stamp:
+                return None
+            entry.hits += 1
+            self.entries.move_to_end(key)
+            return os.dup(entry.fd)
+
+    def _add(self, key, entry):
+        # adds an entry and returns a descriptor of its shared file
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                os.close(old.fd)
+            entry.hits += 1
+            fd = os.dup(entry.fd)
+            self.entries[key] = entry
+            while len(self.entries) > self.max_files:
+                key, old = self.entries.popitem(last=False)
+                os.close(old.fd)
+            return fd
+
+    def _status(self):
+        with self.lock:
+            files = [
+                dict(path=path, sep=sep, size=e.size, hits=e.hits)
+                for (path, sep), e in self.entries.items()
+            ]
+        return dict(pid=os.getpid(), socket=str(self.path), files=files)
+
+
+# _daemonize() {{{2
+def _daemonize():
+    # forks a detached child, returns True in the child and False in the parent
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return False
+    os.setsid()
+    if os.fork():
+        os._exit(0)
+    os.chdir('/')
+    null = os.open(os.devnull, os.O_RDWR)
+    for fd in range(3):
+        os.dup2(null, fd)
+    os.close(null)
+    return True
+
+
+# psf_server() {{{1
+def psf_server():
+    # Read command line {{{2
+    cmdline = docopt(__doc__, version=f"{__version__} ({__released__})")
+    path = Path(cmdline['--socket']) if cmdline['--socket'] else socket_path()
+
+    try:
+        if cmdline['status']:
+            try:
+                response, fds = request('status', path)
+            except OSError:
+                display('not running.')
+                return
+            display(f"running as process {response['pid']} on {response['socket']}.")
+            for each in response['files']:
+                size = Quantity(each['size'], 'B')
+                display(f"    {each['path']}  ({size}, {plural(each['hits']):# request/s})")
+            return
+
+        if cmdline['stop']:
+            try:
+                request('stop', path)
+            except OSError:
+                display('not running.')
+            return
+
+        server = Server(
+            path, int(cmdline['--max-files']), float(cmdline['--idle'])
+        )
+        if cmdline['run']:
+            server.serve()
+            return
+
+        # start in the background, then wait until the server answers
+        try:
+            request('status', path)
+            raise Error('already running.', culprit=path)
+        except OSError:
+            pass
+        if _daemonize():
+            try:
+                server.serve()
+            finally:
+                os._exit(0)
+        limit = time.monotonic() + STARTUP
+        while time.monotonic() < limit:
+            try:
+                response, fds = request('status', path)
+                display(f"running as process {response['pid']} on {path}.")
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise Error('server did not start.', culprit=path)
+    except Error as e:
+        e.terminate()
+    except KeyboardInterrupt:
+        done()
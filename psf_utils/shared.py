@@ -0,0 +1,284 @@
+"""
+Shared Memory
+
+Publishes the data of a PSF object in shared memory so that other processes,
+such as the workers of a multiprocessing pool, can use it without copying it.
+
+:meth:`psf_utils.PSF.share` places the data in a block of shared memory and
+returns a :class:`SharedPSF` handle.  The handle is small and can be passed to
+workers, which call :meth:`SharedPSF.attach` to get a PSF object whose arrays
+are views of the shared memory::
+
+    from multiprocessing import Pool
+    from psf_utils import PSF
+
+    def peak(args):
+        handle, name = args
+        return handle.attach().get_signal(name).ordinate.max()
+
+    psf = PSF('adc.raw/tran.tran')
+    with psf.share() as handle, Pool() as pool:
+        peaks = pool.map(peak, [(handle, n) for n in psf.signals])
+
+The block is released when the handle is closed, when it is garbage collected
+in the publishing process, or when that process exits.
+
+The block holds a pickle of the PSF object in which the arrays are stored out of
+band, each aligned in its own span of the block, so that unpickling them yields
+views rather than copies.  The same layout is used by :mod:`psf_utils.server`.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from inform import Error
+from multiprocessing import shared_memory
+import io
+import numpy as np
+import os
+import pickle
+import struct
+import sys
+import threading
+import weakref
+
+
+# Globals {{{1
+ALIGN = 64          # alignment of the arrays within the block
+HEADER = struct.Struct('<QQ')   # length of pickle, number of arrays
+SPAN = struct.Struct('<QQ')     # offset and length of an array
+_attached = {}      # blocks attached by this process, by name
+_lock = threading.Lock()
+
+
+# Layout {{{1
+# _Pickler class {{{2
+class _Pickler(pickle.Pickler):
+    # only contiguous arrays can be stored out of band, others are copied
+    # as they are pickled rather than being modified in place
+    def reducer_override(self, obj):
+        if isinstance(obj, np.ndarray) and not (
+            obj.flags.c_contiguous or obj.flags.f_contiguous
+        ):
+            return np.ascontiguousarray(obj).__reduce_ex__(5)
+        return NotImplemented
+
+
+# Layout class {{{2
+class Layout:
+    """
+    Layout
+
+    The arrangement of the data of a PSF object within a block of memory.
+
+    psf (PSF):
+        The object to lay out; the load statistics are not included.
+    """
+
+    def __init__(self, psf):
+        attributes = {k: v for k, v in psf.__dict__.items() if k != 'load_stats'}
+        arrays = []
+        stream = io.BytesIO()
+        _Pickler(stream, 5, buffer_callback=arrays.append).dump(attributes)
+        self.data = stream.getbuffer()
+        self.arrays = [a.raw() for a in arrays]
+        offset = HEADER.size + SPAN.size*len(arrays) + len(self.data)
+        self.spans = []
+        for array in self.arrays:
+            offset += -offset % ALIGN
+            self.spans.append((offset, array.nbytes))
+            offset += array.nbytes
+        self.size = offset
+
+    def write(self, block):
+        """
+        Write
+
+        Writes the data into a writable buffer of at least *size* bytes.
+        """
+        block = memoryview(block).cast('B')
+        HEADER.pack_into(block, 0, len(self.data), len(self.arrays))
+        for i, span in enumerate(self.spans):
+            SPAN.pack_into(block, HEADER.size + i*SPAN.size, *span)
+        start = HEADER.size + len(self.spans)*SPAN.size
+        block[start:start+len(self.data)] = self.data
+        for (offset, length), array in zip(self.spans, self.arrays):
+            block[offset:offset+length] = array.cast('B')
+
+
+# read() {{{2
+def read(block):
+    """
+    Read
+
+    Returns the attributes of a PSF object from a buffer written by
+    :meth:`Layout.write`.  The arrays are views of the buffer, and are
+    writable if it is.
+    """
+    view = memoryview(block).cast('B')
+    length, count = HEADER.unpack_from(view)
+    spans = [
+        SPAN.unpack_from(view, HEADER.size + i*SPAN.size) for i in range(count)
+    ]
+    start = HEADER.size + count*SPAN.size
+    arrays = [view[offset:offset+size] for offset, size in spans]
+    return pickle.loads(view[start:start+length], buffers=arrays)
+
+
+# Utilities {{{1
+# _Block class {{{2
+class _Block(shared_memory.SharedMemory):
+    # a block of shared memory that may be discarded while views of it
+    # remain, in which case the memory is unmapped once they are gone
+    def __del__(self):
+        try:
+            self.close()
+        except (BufferError, OSError):
+            pass
+
+
+# _open() {{{2
+def _open(name):
+    # attaches to a block created by another process; it is left to the
+    # publisher to release it, so where possible it is not tracked here
+    if sys.version_info >= (3, 13):
+        return _Block(name, track=False)
+    return _Block(name)
+
+
+# _release() {{{2
+def _release(block):
+    # releases a block created by this process
+    with _lock:
+        _attached.pop(block.name, None)
+    try:
+        block.unlink()
+    except OSError:
+        pass
+    try:
+        block.close()
+    except BufferError:
+        pass    # views remain in this process, the memory goes with them
+
+
+# SharedPSF class {{{1
+class SharedPSF:
+    """
+    Shared PSF
+
+    A handle to the data of a PSF object held in shared memory, as returned by
+    :meth:`psf_utils.PSF.share`.  It is pickled as the name of the block, so it
+    is cheap to pass to other processes.
+
+    name (str):
+        The name of the block of shared memory.
+    size (int):
+        The size of the block in bytes.
+    filename (str):
+        The path to the PSF file.
+    """
+
+    def __init__(self, psf):
+        layout = Layout(psf)
+        block = _Block(create=True, size=max(layout.size, 1))
+        try:
+            layout.write(block.buf)
+        except BaseException:
+            _release(block)
+            raise
+        self.name = block.name
+        self.size = layout.size
+        stats = getattr(psf, 'load_stats', None)
+        self.filename = stats.filename if stats else None
+        self.owner = os.getpid()
+        with _lock:
+            _attached[self.name] = block
+        # releases the block once the handle is discarded or the process exits
+        self._finalizer = weakref.finalize(self, _release, block)
+
+    def __getstate__(self):
+        return dict(name=self.name, size=self.size, filename=self.filename)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.owner = None
+        self._finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def attach(self):
+        """
+        Attach
+
+        Returns a PSF object whose arrays are views of the shared memory.  They
+        must not be modified.  Handles of the same block share one mapping
+        within a process, which is retained for as long as the process runs or
+        until :meth:`detach` is called.
+        """
+        from .psf import PSF, LoadStats
+        stats = LoadStats(filename=self.filename, cache='shared')
+        with _lock:
+            block = _attached.get(self.name)
+            if block is None:
+                try:
+                    block = _attached[self.name] = _open(self.name)
+                except FileNotFoundError:
+                    raise Error(
+                        'shared data is no longer available.', culprit=self.filename
+                    )
+        with stats.phase('attach'):
+            attributes = read(block.buf[:self.size].toreadonly())
+        psf = PSF.__new__(PSF)
+        psf.__dict__ = attributes
+        psf._loaded(stats)
+        return psf
+
+    def detach(self):
+        """
+        Detach
+
+        Unmaps the shared memory from this process.  Any PSF objects returned
+        by :meth:`attach` must no longer be in use.  Has no effect in the
+        publishing process; use :meth:`close` instead.
+        """
+        if self.owner == os.getpid():
+            return
+        with _lock:
+            block = _attached.pop(self.name, None)
+        if block:
+            try:
+                block.close()
+            except BufferError:
+                with _lock:
+                    _attached[self.name] = block
+
+    def close(self):
+        """
+        Close
+
+        Releases the shared memory.  Must be called by the publishing process.
+        Processes that are attached retain their views, but no more processes
+        can attach.
+        """
+        if self.owner != os.getpid():
+            raise Error('only the publishing process may close shared data.')
+        self._finalizer()
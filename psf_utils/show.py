@@ -14,12 +14,17 @@ Options:
     -d, --db                      show the magnitude of the signals in dB
     -m, --mag                     show the magnitude of the signals
     -p, --ph                      show the phase of the signals
+    -F, --fft                     show the power spectrum of the signals in dB
+    -w <name>, --window <name>    window used by --fft [default: hann]
+    -b, --bus                     show buses as integer codes
     -g, --major-grid              show major grid lines
     -G, --minor-grid              show major and minor grid lines
     -s <file>, --svg <file>       produce graph as SVG file rather than display it
     -t <title>, --title <title>   title
     -M, --mark-points             place marker on each point
     -P, --just-points             do not connect points with lines (implies -M)
+    --profile                     report the time taken to load the data
+    --progress                    show the progress of loading the data
     -V, --version                 show version number and exit
 
 The PSF file need only be given if it differs from the one used previously.
@@ -27,16 +32,32 @@ The PSF file need only be given if it differs from the one used previously.
 Reading large ASCII data files is slow, so show-psf reads the PSF file once,
 then pickles the data and writes it to disk. On subsequent runs the pickled data
 is used if the pickle file is newer that the corresponding PSF file.
+If psf-server is running, show-psf gets the data from it instead.
+Type Ctrl-C to abandon a load; the cache is only replaced once it has been
+written in full.
 
 A signal may contain glob characters. For examples, R1:* shows all signals that
-start with R1:.
-
-If a signal as specified on the command line contains a dash, it is split into
-two pieces, each of which are considered signals that are components of a
-differential signal. The two are accessed individually and the difference is
-shown. So for example, out_p-out_n results in V(out_p, ount_n) being shown.
-There may only be one dash in a signal, and signals with dashes must not contain
-glob characters.
+start with R1:.  A signal that ends in a range of bits, such as out<7:0>, shows
+each of the bits in the range.
+
+With --bus, the signals are taken to be the names of buses, which are signals
+that share a name and differ only in an index in chevrons, as in out<0>,
+out<1>, etc.  Each bus is converted to a sequence of integer codes by comparing
+its bits to the midpoint of its values.  Bus names may contain glob characters.
+
+A signal may also be an expression involving signals, constants, the operators
++ - * / ^, parentheses and functions.  For example, out_p-out_n results in
+V(out_p, out_n) being shown and (out_p-out_n)/2, db(out/in) and V(vdd)*I(VDD:p)
+are also allowed.  The available functions are V(p), V(p,n), I(branch), db(),
+mag(), abs(), ph(), real(), imag(), conj(), sqrt(), exp(), ln(), log10(),
+deriv(), integ(), min(), max() and mean().  Expressions must not contain glob
+characters; * is treated as multiplication only if the signal also contains
+another operator or a parenthesis.  Quote expressions to protect them from the
+shell.
+
+With --fft, the signals are resampled onto a uniform grid, windowed and their
+power spectra are shown in dB.  The available windows are rect, hann, hamming,
+blackman, blackmanharris and flattop.
 """
 
 
@@ -58,7 +79,11 @@ glob characters.
 
 
 # Imports {{{1
+from .progress import ProgressBar
 from .psf import PSF, Quantity
+from .expr import evaluate, is_expression
+from .spectrum import spectrum
+from .bus import expand_range
 from . import __version__, __released__
 from docopt import docopt
 import fnmatch
@@ -84,7 +109,6 @@ Quantity.set_prefs(
 warnings.filterwarnings('ignore', category=FutureWarning)
 saved_psf_file_filename = '.psf_file'
 saved_arguments_filename = '.psf_show_args'
-operators = '+ - * /'.split()
 
 
 # Utilities {{{1
@@ -127,13 +151,29 @@ def get_psf_filename(psf_file):
     return psf_file
 
 
+# fetch() {{{2
+def fetch(psf_file, sep=':', use_cache=True):
+    # returns the PSF data from psf-server, or None if it is not available; the
+    # server is imported here as it relies on shared memory (Python 3.8) and
+    # on passing file descriptors (Python 3.9)
+    try:
+        from .server import fetch
+    except ImportError:
+        return None
+    return fetch(psf_file, sep=sep, use_cache=use_cache)
+
+
 # in_args() {{{2
 def expand_args(signals, args, allow_diff=True):
-    # special case args that contain -, they are considered differential signals
+    # special case args that contain operators, they are considered expressions
     # they should not include glob chars (*, ?)
-    selected = set(a for a in args if '-' in a) if allow_diff else set()
+    if allow_diff:
+        selected = set(a for a in args if is_expression(a) and a not in signals)
+    else:
+        selected = set()
     for arg in args:
-        selected.update(fnmatch.filter(signals, arg))
+        for each in expand_range(arg):
+            selected.update(fnmatch.filter(signals, each))
     return sorted(selected)
 
 
@@ -153,14 +193,29 @@ def show_signals():
         dB = cmdline['--db']
         mag = cmdline['--mag']
         phase = cmdline['--ph']
+        fft = cmdline['--fft']
+        window_name = cmdline['--window']
+        show_buses = cmdline['--bus']
         use_cache = not cmdline['--refresh-cache']
         linestyle = '' if cmdline['--just-points'] else '-'
         marker = '.' if cmdline['--mark-points'] or cmdline['--just-points'] else ''
 
         # Open PSF file {{{2
-        psf = PSF(psf_file, sep=':', use_cache=use_cache)
-        sweep = psf.get_sweep()
-        to_show = expand_args(psf.signals.keys(), args)
+        psf = fetch(psf_file, sep=':', use_cache=use_cache)
+        if psf is None:
+            # the server is not running, so load the data here
+            with ProgressBar(enabled=cmdline['--progress']) as progress:
+                psf = PSF(psf_file, sep=':', use_cache=use_cache, progress=progress)
+        if cmdline['--profile']:
+            display(psf.load_stats.summary())
+        sweep = psf.get_sweep(-1)
+        if show_buses:
+            buses = {b.name: b for b in psf.all_buses()}
+            to_show = expand_args(buses.keys(), args, allow_diff=False)
+            if not to_show:
+                raise Error(f'{plural(args):no matching bus/es}.', culprit=args)
+        else:
+            to_show = expand_args(psf.signals.keys(), args)
 
         # Print scalars {{{2
         if not sweep:
@@ -169,7 +224,14 @@ def show_signals():
                 width = 0
                 for arg in to_show:
                     pair = arg.split('-')
-                    if len(pair) == 2:
+                    if arg in psf.signals:
+                        sig = psf.get_signal(arg)
+                        access = sig.access
+                        name = f'{access}({sig.name})' if access else sig.name
+                        y_data = sig.ordinate
+                        if hasattr(y_data, 'units'):
+                            y_data.units = psf.units_to_unicode(y_data.units)
+                    elif len(pair) == 2 and all(p in psf.signals for p in pair):
                         psig = psf.get_signal(pair[0])
                         nsig = psf.get_signal(pair[1])
                         if psig.units != nsig.units:
@@ -188,12 +250,9 @@ def show_signals():
                         else:
                             name = f'({psig.name} − {nsig.name})'
                     else:
-                        sig = psf.get_signal(arg)
-                        access = sig.access
-                        name = f'{access}({sig.name})' if access else sig.name
-                        y_data = sig.ordinate
-                        if hasattr(y_data, 'units'):
-                            y_data.units = psf.units_to_unicode(y_data.units)
+                        sig = psf.eval(arg)
+                        name = arg
+                        y_data = Quantity(sig.ordinate, psf.units_to_unicode(sig.units))
                     to_print.append((name, y_data))
                     width = max(width, len(name))
                 for name, y_data in to_print:
@@ -203,28 +262,32 @@ def show_signals():
         # Process arguments for graphs {{{2
         waves = []
         y_units = set()
+        exprs = [
+            arg for arg in to_show
+            if arg not in psf.signals and not show_buses
+        ]
+        evaluated = dict(zip(exprs, evaluate(psf, *exprs))) if exprs else {}
         for arg in to_show:
             use_log_scale = psf.log_y(sweep)
-            pair = arg.split('-')
-            if len(pair) == 2:
-                psig = psf.get_signal(pair[0])
-                nsig = psf.get_signal(pair[1])
-                name = arg
-                if psig.units != nsig.units:
-                    warn(
-                        f'incompatible units ({psig.units} != {nsig.units}',
-                        culprit=arg
-                    )
-                units = psig.units
-                y_data = psig.ordinate - nsig.ordinate
+            name = arg
+            if show_buses:
+                y_data = buses[arg].decode()
+                units = ''
+                use_log_scale = False
+            elif arg in evaluated:
+                y_data, units = evaluated[arg]
+                y_data = np.broadcast_to(y_data, sweep.abscissa.shape)
             else:
                 sig = psf.get_signal(arg)
-                name = arg
                 units = sig.units
                 y_data = sig.ordinate
             if units == 'Unitless':
                 units = ''
-            if dB:
+            if fft:
+                # spectra are computed below, all in one call
+                units = 'dB' + (units or '')
+                use_log_scale = False
+            elif dB:
                 y_data = 20*np.log10(np.absolute(y_data))
                 units = 'dB' + (units or '')
                 use_log_scale = False
@@ -240,11 +303,25 @@ def show_signals():
             y_units.add(units)
         if not y_units:
             raise Error(f'{plural(args):no match/es}.', culprit=args)
+        x_units = sweep.units
+        x_data = sweep.abscissa
+        log_x = psf.log_x(sweep)
+
+        # Compute spectra {{{2
+        if fft:
+            spec = spectrum(
+                x_data, [np.real(y) for n, y, u, l in waves],
+                window_name = window_name
+            )
+            with np.errstate(divide='ignore'):
+                power = 10*np.log10(spec.power)
+            waves = [(n, p, u, l) for (n, y, u, l), p in zip(waves, power)]
+            x_units = 'Hz'
+            x_data = spec.freq
+            log_x = False
 
         # Formatters {{{2
         # create formatter for x-axis values {{{3
-        x_units = sweep.units
-        x_data = sweep.abscissa
         x_formatter = FuncFormatter(
             lambda v, p: Quantity(v, x_units).render()
         )
@@ -282,7 +359,7 @@ def show_signals():
                         linewidth = 2,
                     )
             axes[i, 0].legend(frameon=False, loc='best')
-            axes[i, 0].set_xscale('log' if psf.log_x(sweep) else 'linear')
+            axes[i, 0].set_xscale('log' if log_x else 'linear')
             axes[i, 0].set_yscale('log' if use_log_scale else 'linear')
             axes[i, 0].xaxis.set_major_formatter(x_formatter)
             axes[i, 0].yaxis.set_major_formatter(y_formatters[units])
@@ -0,0 +1,292 @@
+"""
+Spectra of Transient Results
+
+Computes windowed spectra of many signals in one batched call, along with the
+metrics commonly used to characterize data converters: SNR, THD, SNDR, SFDR
+and ENOB.  Signals are resampled onto a uniform grid, which is required by the
+FFT because transient results use adaptive time steps.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .resample import Interpolator, uniform_grid
+from inform import Error, Info
+import numpy as np
+
+
+# Globals {{{1
+# Windows are given as the coefficients of a generalized cosine window along
+# with the half-width of the main lobe in bins, which is the number of bins on
+# either side of a tone that are attributed to that tone.
+windows = {
+    'rect':           ([1.0], 1),
+    'hann':           ([0.5, 0.5], 2),
+    'hamming':        ([0.54, 0.46], 2),
+    'blackman':       ([0.42, 0.5, 0.08], 3),
+    'blackmanharris': ([0.35875, 0.48829, 0.14128, 0.01168], 4),
+    'flattop':        ([0.21557895, 0.41663158, 0.277263158, 0.083578947, 0.006947368], 5),
+}
+
+
+# Utilities {{{1
+class Spectrum(Info):
+    pass
+
+
+# window() {{{2
+def window(name, n):
+    """
+    Window
+
+    Returns the window of length n.  The periodic form is used, which is the
+    appropriate choice for spectral analysis.
+
+    name (str):
+        One of rect, hann, hamming, blackman, blackmanharris or flattop.
+    n (int):
+        The length of the window.
+    """
+    try:
+        coefs, _ = windows[name]
+    except KeyError:
+        raise Error(
+            f'unknown window: {name}.',
+            codicil = f"Choose from {', '.join(windows)}."
+        )
+    phase = 2*np.pi*np.arange(n)/n
+    w = np.full(n, coefs[0])
+    for k, a in enumerate(coefs[1:], 1):
+        w += (-1)**k * a * np.cos(k*phase)
+    return w
+
+
+# spectrum() {{{1
+def spectrum(
+    x, y, points=None, window_name='hann', segments=1, overlap=0.5,
+    start=None, stop=None,
+):
+    """
+    Spectrum
+
+    Computes the one-sided power spectrum of one or more signals.  The signals
+    are resampled onto a uniform grid, windowed and transformed.  If segments
+    is greater than one, Welch's method is used: the record is split into
+    overlapping segments whose power spectra are averaged.
+
+    The spectrum is scaled so that a sinusoid of amplitude A that falls on a
+    bin produces a value of A²/2 (its power) in that bin.  The power of a tone
+    that falls between bins is spread over neighboring bins, so tone powers
+    should be found by summing over the main lobe of the window and dividing
+    by the equivalent noise bandwidth, as is done by :func:`metrics`.
+
+    x (array):
+        The abscissa, generally time.
+    y (array or list of arrays):
+        A single signal, a 2D array with one signal per row, or a list of
+        signals.
+    points (int):
+        The number of points in the uniform grid.  By default the number of
+        points in x is used.  Powers of two are fastest.
+    window_name (str):
+        The name of the window (see *windows*).
+    segments (int):
+        The number of segments averaged using Welch's method.
+    overlap (float):
+        The fraction of each segment that overlaps the next.
+    start, stop (float):
+        The portion of the record to use, by default all of it.  It is common
+        to skip the start-up transient.
+
+    Returns a Spectrum object with the attributes freq, the frequencies of
+    the bins, power, the power spectrum as an array with one row per signal
+    (or 1D for a single signal), lobe, the main-lobe half-width in bins, and
+    enbw, the equivalent noise bandwidth of the window in bins.
+    """
+    x = np.asarray(x, dtype=float)
+    single = not isinstance(y, (list, tuple)) and np.ndim(y) == 1
+    start = x[0] if start is None else start
+    stop = x[-1] if stop is None else stop
+    if points is None:
+        points = np.count_nonzero((x >= start) & (x <= stop))
+    segments = int(segments)
+    if segments < 1:
+        raise Error('segments must be at least one.')
+    if not 0 <= overlap < 1:
+        raise Error('overlap must be at least 0 and less than 1.')
+
+    # the segment length and the step between segments
+    length = int(points/(1 + (segments - 1)*(1 - overlap)))
+    step = int(length*(1 - overlap)) if segments > 1 else length
+    points = length + (segments - 1)*step
+    if length < 2:
+        raise Error('too few points.')
+
+    # resample directly into the buffer that is transformed; the grid excludes
+    # the final point so that the record is periodic
+    dt = (stop - start)/points
+    grid = uniform_grid(start, stop - dt, num=points)
+    samples = Interpolator(x, grid)(y if not single else [y])
+    if np.iscomplexobj(samples):
+        raise Error('spectrum requires real signals.')
+
+    w = window(window_name, length)
+    scale = 2/np.sum(w)**2
+    enbw = length*np.sum(w**2)/np.sum(w)**2
+
+    if segments == 1:
+        samples *= w
+        power = np.fft.rfft(samples, axis=-1)
+        power = power.real**2 + power.imag**2
+    else:
+        power = None
+        for i in range(segments):
+            segment = samples[:, i*step:i*step + length]*w
+            p = np.fft.rfft(segment, axis=-1)
+            p = p.real**2 + p.imag**2
+            if power is None:
+                power = p
+            else:
+                power += p
+        power /= segments
+    power *= scale
+    power[:, 0] /= 2
+    if length % 2 == 0:
+        power[:, -1] /= 2
+    freq = np.fft.rfftfreq(length, dt)
+
+    return Spectrum(
+        freq = freq,
+        power = power[0] if single else power,
+        lobe = windows[window_name][1],
+        enbw = enbw,
+        window = window_name,
+        segments = segments,
+    )
+
+
+# metrics() {{{1
+def metrics(spec, fundamental=None, harmonics=5):
+    """
+    Metrics
+
+    Computes the usual measures of spectral purity from a spectrum.  The power
+    of each tone is summed over the main lobe of the window and corrected for
+    its equivalent noise bandwidth.  Harmonics that lie above the Nyquist
+    frequency are folded back.
+
+    spec (Spectrum):
+        The spectrum returned by :func:`spectrum`.
+    fundamental (float):
+        The frequency of the fundamental.  If not given, the largest non-DC
+        bin is used.
+    harmonics (int):
+        The number of harmonics, including the fundamental, that contribute to
+        THD.
+
+    Returns an Info object with the attributes signal, the power of the
+    fundamental, fundamental, its frequency, harmonics, the total power of
+    the harmonics, noise, the remaining power, and snr, thd, sndr, sfdr, in
+    dB, and enob, in bits.  Each is a scalar for a single signal and an array
+    with one value per signal otherwise.
+    """
+    power = np.atleast_2d(spec.power)
+    single = np.ndim(spec.power) == 1
+    rows, bins = power.shape
+    lobe = spec.lobe
+    index = np.arange(bins)
+    row_index = np.arange(rows)
+
+    # the bins occupied by DC
+    dc = index[None, :] <= lobe
+
+    # the fundamental
+    if fundamental is None:
+        fund = np.argmax(np.where(dc, -np.inf, power), axis=1)
+    else:
+        step = spec.freq[1] - spec.freq[0]
+        fund = np.full(rows, int(round(fundamental/step)))
+
+    def lobe_mask(center):
+        return np.absolute(index[None, :] - center[:, None]) <= lobe
+
+    signal_mask = lobe_mask(fund)
+    harmonic_mask = np.zeros_like(signal_mask)
+    n = 2*(bins - 1)
+    for k in range(2, harmonics + 1):
+        # fold the harmonic about the Nyquist frequency
+        h = (k*fund) % n
+        h = np.where(h > n//2, n - h, h)
+        harmonic_mask |= lobe_mask(h)
+    harmonic_mask &= ~signal_mask & ~dc
+
+    total = power.sum(axis=1)/spec.enbw
+    signal = np.where(signal_mask, power, 0).sum(axis=1)/spec.enbw
+    harmonic = np.where(harmonic_mask, power, 0).sum(axis=1)/spec.enbw
+    dc_power = np.where(dc & ~signal_mask, power, 0).sum(axis=1)/spec.enbw
+    noise = total - signal - harmonic - dc_power
+
+    # largest spur is the largest bin outside DC and the fundamental
+    spur = np.where(dc | signal_mask, 0, power).max(axis=1)
+    peak = power[row_index, fund]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        snr = 10*np.log10(signal/noise)
+        thd = 10*np.log10(harmonic/signal)
+        sndr = 10*np.log10(signal/(noise + harmonic))
+        sfdr = 10*np.log10(peak/spur)
+    enob = (sndr - 1.76)/6.02
+
+    def finish(v):
+        return v[0] if single else v
+
+    return Info(
+        fundamental = finish(spec.freq[fund]),
+        signal = finish(signal),
+        harmonics = finish(harmonic),
+        noise = finish(noise),
+        snr = finish(snr),
+        thd = finish(thd),
+        sndr = finish(sndr),
+        sfdr = finish(sfdr),
+        enob = finish(enob),
+    )
+
+
+# signal_spectra() {{{1
+def signal_spectra(psf, names, **kwargs):
+    """
+    Signal Spectra
+
+    Computes the spectra of signals from a PSF file in one batched call.
+
+    psf (PSF):
+        The PSF data, generally from a transient analysis.
+    names (list of str):
+        Names of the signals.
+    kwargs:
+        Passed to :func:`spectrum`.
+
+    Returns a Spectrum object whose power attribute has one row per signal.
+    """
+    sweep = psf.get_sweep(-1)
+    if not sweep:
+        raise Error('spectra require swept data.')
+    return spectrum(
+        sweep.abscissa, [psf.get_signal(n).ordinate for n in names], **kwargs
+    )
@@ -0,0 +1,170 @@
+"""
+Storage Precision
+
+Describes the precision with which signal values are stored.  Storing values
+in single precision halves the memory they occupy.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from inform import Error
+import fnmatch
+import numpy as np
+
+
+# Globals {{{1
+aliases = {
+    'double': np.float64,
+    'single': np.float32,
+    'half': np.float16,
+}
+complex_types = {
+    np.dtype(np.float64): np.dtype(np.complex128),
+    np.dtype(np.float32): np.dtype(np.complex64),
+    np.dtype(np.float16): np.dtype(np.complex64),
+}
+
+
+# Utilities {{{1
+# as_dtype() {{{2
+def as_dtype(dtype):
+    """
+    As Dtype
+
+    Converts a precision, given as a NumPy floating-point type, its name or one
+    of double, single or half, to a NumPy dtype.
+    """
+    try:
+        dtype = np.dtype(aliases.get(dtype, dtype))
+    except TypeError:
+        raise Error(f'unknown precision: {dtype}.')
+    if dtype not in complex_types:
+        raise Error(
+            f'unsupported precision: {dtype}.',
+            codicil = 'Choose from float64 (double), float32 (single) or float16 (half).'
+        )
+    return dtype
+
+
+# Storage class {{{1
+class Storage:
+    """
+    Storage
+
+    The precision with which signals are stored.  Sweeps are always stored in
+    double precision.
+
+    dtype (str or dtype):
+        The precision of real signals, float64 (double), float32 (single) or
+        float16 (half).  Complex signals use the complex type whose parts have
+        this precision (complex64 for half precision).
+    overrides (dict):
+        Maps glob patterns to precisions.  A signal whose name matches one of
+        the patterns is stored with the corresponding precision; the first
+        match is used.
+
+    The values in a PSF file are converted directly to the requested precision
+    as they are parsed, which rounds each value to the nearest representable
+    number.  The relative error of the stored value is therefore at most half
+    the machine epsilon of the type (see :meth:`relative_error`):
+
+    =========  ================  ===================
+    precision  relative error    significant digits
+    =========  ================  ===================
+    float64    1.1 × 10⁻¹⁶       15
+    float32    6.0 × 10⁻⁸        7
+    float16    4.9 × 10⁻⁴        3
+    =========  ================  ===================
+
+    float32 represents magnitudes from 1.2 × 10⁻³⁸ to 3.4 × 10³⁸, which covers
+    the values found in circuit simulations, but float16 is limited to 6.1 ×
+    10⁻⁵ to 65504 and is only suitable for signals known to be in that range.
+    """
+
+    def __init__(self, dtype=None, overrides=None):
+        self.dtype = as_dtype(np.float64 if dtype is None else dtype)
+        self.overrides = [
+            (pattern, as_dtype(d)) for pattern, d in (overrides or {}).items()
+        ]
+
+    def __eq__(self, other):
+        if not isinstance(other, Storage):
+            return NotImplemented
+        return self.dtype == other.dtype and self.overrides == other.overrides
+
+    def __repr__(self):
+        return f'Storage({self.dtype}, {dict(self.overrides)})'
+
+    def is_default(self):
+        """
+        Is Default
+
+        True if every signal is stored in double precision.
+        """
+        return self == Storage()
+
+    def real_dtype(self, name):
+        """
+        Real Dtype
+
+        Returns the dtype used for a real signal.
+        """
+        for pattern, dtype in self.overrides:
+            if fnmatch.fnmatchcase(name, pattern):
+                return dtype
+        return self.dtype
+
+    def complex_dtype(self, name):
+        """
+        Complex Dtype
+
+        Returns the dtype used for a complex signal.
+        """
+        return complex_types[self.real_dtype(name)]
+
+    def composite_dtype(self, name=None):
+        """
+        Composite Dtype
+
+        Returns the dtype used for the parts of a composite value, such as the
+        real and imaginary parts of a complex signal or the members of
+        a struct or group.  The names of the members are not known when the
+        parts are converted, so this is the widest precision any of them may
+        require.
+
+        name (str):
+            The name of the composite signal; if not given, as for a group,
+            any signal may be a member.
+        """
+        dtypes = [self.dtype]
+        for pattern, dtype in self.overrides:
+            if name is None or fnmatch.fnmatchcase(name, pattern):
+                dtypes.append(dtype)
+            elif pattern.startswith(name + ':') or any(c in pattern for c in '*?['):
+                dtypes.append(dtype)
+        return np.finfo(max(complex_types[d] for d in dtypes)).dtype
+
+    def relative_error(self, name):
+        """
+        Relative Error
+
+        Returns the largest relative error introduced by storing a value of the
+        named signal.
+        """
+        return np.finfo(self.real_dtype(name)).eps/2
@@ -0,0 +1,408 @@
+"""
+Write PSF File
+
+Writes signals held in NumPy arrays to ASCII PSF files, and synthesizes PSF
+files of arbitrary size for testing and benchmarking.
+
+Each row of the VALUE section, which holds the values of every signal at one
+point of the sweep, follows the same pattern.  So a format string is built
+once for a row, and a block of rows is formatted with a single operation
+rather than a call per value.
+"""
+
+# License {{{1
+# Copyright (C) 2018-2023 Kenneth S. Kundert
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see [http://www.gnu.org/licenses/].
+
+
+# Imports {{{1
+from .convert import digits
+from inform import Error
+import numpy as np
+
+
+# Globals {{{1
+DEFAULT_CHUNK = 4096   # rows formatted at once
+kinds = {
+    # kind: (analysis type, sweep, sweep units, complex, logarithmic)
+    'tran': ('tran', 'time', 's', False, False),
+    'ac': ('ac', 'freq', 'Hz', True, True),
+    'noise': ('noise', 'freq', 'Hz', False, True),
+    'dcop': ('dc', None, None, False, False),
+}
+
+
+# Utilities {{{1
+# quote() {{{2
+def quote(text):
+    """
+    Quote
+
+    Returns text as a quoted PSF string.
+    """
+    text = str(text).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{text}"'
+
+
+# _literal() {{{2
+def _literal(text):
+    # returns text as a quoted string that can be used in a format string
+    return quote(text).replace('%', '%%')
+
+
+# _named_value() {{{2
+def _named_value(name, value):
+    if isinstance(value, str):
+        return f'{quote(name)} {quote(value)}\n'
+    if isinstance(value, (bool, int, np.integer)):
+        return f'{quote(name)} {int(value)}\n'
+    return f'{quote(name)} {float(value)!r}\n'
+
+
+# _type() {{{2
+def _type(name, values, units):
+    # returns the definition of a scalar type
+    kind = 'COMPLEX' if np.iscomplexobj(values) else 'FLOAT'
+    return f'{quote(name)} {kind} DOUBLE PROP(\n"units" {quote(units)}\n)\n'
+
+
+# _format() {{{2
+def _format(values):
+    # returns the format of a value, complex values are given as a pair
+    values = np.asarray(values)
+    dtype = values.real.dtype if values.dtype.kind in 'fc' else np.dtype(float)
+    fmt = f'%.{digits.get(dtype.itemsize, 17) - 1}e'
+    if values.dtype.kind == 'c':
+        return f'({fmt} {fmt})'
+    return fmt
+
+
+# _columns() {{{2
+def _columns(values):
+    # returns the real columns needed to hold the values
+    values = np.asarray(values)
+    if values.dtype.kind == 'c':
+        return [values.real, values.imag]
+    return [values]
+
+
+# write_psf() {{{1
+def write_psf(
+    path, signals, abscissa=None, sweep='time', sweep_units='s', log=False,
+    units=None, group=None, header=None, chunk=DEFAULT_CHUNK
+):
+    """
+    Write PSF
+
+    Writes signals to an ASCII PSF file.
+
+    path (str or Path):
+        The path to the PSF file.
+    signals (dict):
+        Maps signal names to their values.  The values may be real or complex.
+        A struct is given as a dictionary that maps the names of its members to
+        their values.  If the file is swept, the values are arrays with one
+        value per point of the sweep, otherwise they are scalars.
+    abscissa (array):
+        The values of the sweep.  If None, the file is not swept, as is the
+        case for DC operating points.
+    sweep (str):
+        The name of the sweep.
+    sweep_units (str):
+        The units of the sweep.
+    log (bool):
+        Recommend a logarithmic axis for the sweep.
+    units (dict):
+        Maps signal names to their units.  The units of a member of a struct
+        are given using its full name, which is the name of the struct and the
+        name of the member joined by a colon in swept files and by a period in
+        unswept files, the same names used by :class:`psf_utils.PSF`.
+    group (str):
+        If given, the scalar signals are collected into a group of this name,
+        as is done by Spectre for AC analyses.
+    header (dict):
+        Values for the HEADER section.
+    chunk (int):
+        The number of rows formatted at once.
+
+    Example::
+
+        >>> import numpy as np
+        >>> from psf_utils import PSF
+        >>> from psf_utils.write import write_psf
+        >>> time = np.linspace(0, 1e-6, 101)
+        >>> out = np.sin(2*np.pi*1e6*time)
+        >>> write_psf('sine.tran', dict(out=out), time, units=dict(out='V'))
+        >>> psf = PSF('sine.tran', use_cache=False)
+        >>> np.array_equal(psf.get_signal('out').ordinate, out)
+        True
+
+    """
+    units = units or {}
+    swept = abscissa is not None
+    separator = ':' if swept else '.'
+    if swept:
+        abscissa = np.asarray(abscissa, dtype=float)
+        length = len(abscissa)
+
+    def check(values, name):
+        values = np.asarray(values)
+        if swept and values.shape != (length,):
+            raise Error('wrong number of values.', culprit=name)
+        return values
+
+    # gather the types and traces
+    # a trace is a scalar signal or a struct; each is given by its name, its
+    # type, its values, and the format of a value
+    types = {}  # maps the key of a type to its name and definition
+    traces = []
+    grouped = []
+    for name, values in signals.items():
+        if isinstance(values, dict):
+            members = [
+                (m, check(v, (name, m)), units.get(f'{name}{separator}{m}', ''))
+                for m, v in values.items()
+            ]
+            key = tuple((m, np.iscomplexobj(v), u) for m, v, u in members)
+            if key not in types:
+                type_name = f'struct{len(types) + 1}'
+                body = ''.join(_type(m, v, u) for m, v, u in members)
+                types[key] = (
+                    type_name,
+                    f'{quote(type_name)} STRUCT(\n{body}) PROP(\n"key" "inst"\n)\n'
+                )
+            format = '(\n' + ''.join(_format(v) + '\n' for m, v, u in members) + ')'
+            traces.append((name, types[key][0], [v for m, v, u in members], format))
+        else:
+            values = check(values, name)
+            u = units.get(name, '')
+            key = (np.iscomplexobj(values), u)
+            if key not in types:
+                type_name = u or ('Complex' if key[0] else 'Real')
+                while type_name in {t[0] for t in types.values()}:
+                    type_name += "'"
+                types[key] = (type_name, _type(type_name, values, u))
+            trace = (name, types[key][0], [values], _format(values))
+            if group and swept:
+                grouped.append(trace)
+            else:
+                traces.append(trace)
+
+    with open(path, 'w', newline='\n') as f:
+        # HEADER
+        f.write('HEADER\n')
+        for name, value in (header or {'PSFversion': '1.00'}).items():
+            f.write(_named_value(name, value))
+        if not swept and not traces:
+            f.write('END\n')
+            return
+
+        # TYPE
+        f.write('TYPE\n')
+        if swept:
+            f.write('"sweep" FLOAT DOUBLE PROP(\n"key" "sweep"\n)\n')
+        for type_name, definition in types.values():
+            f.write(definition)
+
+        if not swept:
+            # each value in an unswept file is given along with its type
+            f.write('VALUE\n')
+            for name, type_name, values, format in traces:
+                if format.startswith('(%'):
+                    # the reader expects bare pairs for complex scalars here
+                    format = format[1:-1]
+                row = f'{_literal(name)} {_literal(type_name)} {format}\n'
+                f.write(row % tuple(c.item() for v in values for c in _columns(v)))
+            f.write('END\n')
+            return
+
+        # SWEEP
+        f.write('SWEEP\n')
+        f.write(f'{quote(sweep)} "sweep" PROP(\n')
+        f.write('"sweep_direction" 0\n')
+        f.write(f'"units" {quote(sweep_units)}\n')
+        f.write('"plot" 0\n')
+        f.write(f'"grid" {3 if log else 1}\n')
+        f.write(')\n')
+
+        # TRACE
+        # while writing the traces, build the format of a row of the VALUE
+        # section and gather the columns that provide its values
+        f.write('TRACE\n')
+        row = [f'{_literal(sweep)} %.16e\n']
+        columns = [abscissa]
+        if grouped:
+            f.write(f'{quote(group)} GROUP {len(grouped)}\n')
+            for name, type_name, values, format in grouped:
+                f.write(f'{quote(name)} {quote(type_name)}\n')
+                columns.extend(_columns(values[0]))
+            row.append(
+                f'{_literal(group)} ' + '\n'.join(t[3] for t in grouped) + '\n'
+            )
+        for name, type_name, values, format in traces:
+            f.write(f'{quote(name)} {quote(type_name)}\n')
+            row.append(f'{_literal(name)} {format}\n')
+            for v in values:
+                columns.extend(_columns(v))
+        row = ''.join(row)
+
+        # VALUE
+        f.write('VALUE\n')
+        block = np.empty((min(chunk, length), len(columns)))
+        for start in range(0, length, chunk):
+            n = min(chunk, length - start)
+            for i, column in enumerate(columns):
+                block[:n, i] = column[start:start + n]
+            f.write((row*n) % tuple(block[:n].ravel().tolist()))
+        f.write('END\n')
+
+
+# write_signals() {{{1
+def write_signals(psf, path, names=None):
+    """
+    Write Signals
+
+    Writes signals held in a PSF object to an ASCII PSF file.  Members of
+    structs are written as individual signals named as in the PSF object.
+
+    psf (PSF):
+        The PSF data.
+    path (str or Path):
+        The path to the PSF file.
+    names (list of str):
+        Names of the signals, all numeric signals if None.
+    """
+    if names is None:
+        names = [
+            n for n, s in psf.signals.items()
+            if 'string' not in (s.type.kind or '')
+        ]
+    signals = {}
+    units = {}
+    for name in names:
+        signal = psf.get_signal(name)
+        ordinate = signal.ordinate
+        if isinstance(ordinate, float):
+            ordinate = float(ordinate)   # strips the units from a Quantity
+        signals[name] = ordinate
+        units[name] = signal.units or ''
+    sweep = psf.get_sweep(-1)
+    if sweep:
+        write_psf(
+            path, signals, sweep.abscissa, sweep=sweep.name,
+            sweep_units=sweep.units or '', log=psf.log_x(sweep), units=units,
+            header=psf.meta,
+        )
+    else:
+        write_psf(path, signals, units=units, header=psf.meta)
+
+
+# synthesize() {{{1
+def synthesize(
+    path, points=1000, signals=10, kind='tran', structs=0, group=None,
+    seed=None, chunk=DEFAULT_CHUNK
+):
+    """
+    Synthesize
+
+    Writes a PSF file filled with synthetic signals.  Used to measure how the
+    time needed to read a file scales with its size, so the values are
+    plausible but carry no meaning.
+
+    path (str or Path):
+        The path to the PSF file.
+    points (int):
+        The number of points in the sweep, ignored for DC operating points.
+    signals (int):
+        The number of scalar signals.
+    kind (str):
+        The kind of analysis, which determines the sweep and the type of the
+        values: tran (real values versus time), ac (complex values versus
+        frequency), noise (real values versus frequency) or dcop (real values,
+        not swept).
+    structs (int):
+        The number of structs, each of which holds the noise contributions of a
+        device, as found in noise analyses.
+    group (str):
+        If given, the scalar signals are collected into a group of this name,
+        as is done by Spectre for AC analyses.
+    seed (int):
+        Seed for the random number generator.
+    chunk (int):
+        The number of rows formatted at once.
+
+    Returns the values of the signals, as passed to :func:`write_psf`.
+    """
+    try:
+        analysis, sweep, sweep_units, cplx, log = kinds[kind]
+    except KeyError:
+        raise Error(
+            f'unknown kind: {kind}.', codicil=f"Choose from {', '.join(kinds)}."
+        )
+    rng = np.random.default_rng(seed)
+    units = {}
+    values = {}
+
+    if sweep is None:
+        abscissa = None
+        for i in range(signals):
+            values[f'n{i}'] = rng.normal()
+            units[f'n{i}'] = 'V'
+        for i in range(structs):
+            rn, fn = rng.uniform(0, 1e-16, 2)
+            values[f'M{i}'] = dict(rn=rn, fn=fn, total=rn + fn)
+        header = {
+            'PSFversion': '1.00', 'simulator': 'psf_utils',
+            'analysis type': analysis, 'analysis name': 'op',
+        }
+    else:
+        if log:
+            abscissa = np.logspace(0, 9, points)
+        else:
+            abscissa = np.linspace(0, 1e-6, points)
+        # each signal is a random mix of a few shapes plus a little noise
+        x = abscissa/abscissa[-1]
+        for i in range(signals):
+            name = f'n{i}'
+            if cplx:
+                pole = 10**rng.uniform(2, 8)
+                values[name] = rng.uniform(1, 100)/(1 + 1j*abscissa/pole)
+            else:
+                freq = rng.integers(1, 20)
+                values[name] = (
+                    rng.uniform(-1, 1)*np.sin(2*np.pi*freq*x + rng.uniform(0, 6))
+                    + rng.normal(0, 1e-3, points)
+                )
+            units[name] = 'V'
+        for i in range(structs):
+            corner = 10**rng.uniform(3, 6)
+            rn = np.full(points, rng.uniform(1e-18, 1e-16))
+            fn = rn*corner/abscissa if log else rn*rng.uniform(0, 1, points)
+            values[f'M{i}'] = dict(rn=rn, fn=fn, total=rn + fn)
+        header = {
+            'PSFversion': '1.00', 'simulator': 'psf_utils',
+            'analysis type': analysis, 'analysis name': analysis,
+        }
+    for name, members in values.items():
+        if isinstance(members, dict):
+            separator = ':' if sweep else '.'
+            for member in members:
+                units[f'{name}{separator}{member}'] = 'V^2/Hz'
+
+    write_psf(
+        path, values, abscissa, sweep=sweep, sweep_units=sweep_units, log=log,
+        units=units, group=group, header=header, chunk=chunk,
+    )
+    return values
@@ -5,10 +5,11 @@ from parametrize_from_file import parametrize, Namespace
 import pytest
 from functools import partial
 from voluptuous import Schema, Optional, Required
-from psf_utils import PSF
+from psf_utils import PSF, UnknownSignal
 from pathlib import Path
 from shlib import Run, rm
 import math
+import numpy as np
 
 
 # Utilities {{{1
@@ -289,3 +290,1587 @@ def test_units_to_latex():
     result = PSF.units_to_latex("V/A")
     # Currently returns input unchanged
     assert result == "V/A"
+
+# Row Index Tests {{{1
+def test_row_index():
+    """Test that the row index locates rows in the VALUE section"""
+    from psf_utils.index import RowIndex, get_row_index, index_filepath
+    test_dir = Path(__file__).parent
+    psf_file = test_dir / "../samples/pnoise.raw/pss.td.pss"
+    index_file = index_filepath(psf_file)
+    rm(index_file)
+
+    try:
+        psf = PSF(psf_file, use_cache=False, update_cache=False)
+        abscissa = psf.get_sweep().abscissa
+        data = psf_file.read_bytes()
+
+        index = RowIndex.build(data, stride=10)
+        assert index.rows == len(abscissa)
+        assert index.abscissa == pytest.approx(abscissa[::10])
+        row, offset = index.locate_row(123)
+        assert row == 120
+        assert data[offset:].startswith(b'"time" ')
+        row, offset = index.locate(abscissa[57])
+        assert row == 50
+        first, begin, end = index.window(abscissa[57], abscissa[75])
+        assert first == 50
+        assert begin == index.offsets[5] and end == index.offsets[8]
+
+        # index is saved and reused
+        index = get_row_index(psf_file)
+        assert index_file.exists()
+        assert get_row_index(psf_file).rows == index.rows
+
+        # DC files have no rows to index
+        assert RowIndex.build((test_dir / "../samples/fracpole.dc").read_bytes()) is None
+    finally:
+        rm(index_file)
+
+# Measurement Tests {{{1
+def test_measure():
+    """Test vectorized waveform measurements on a batch of waveforms"""
+    from psf_utils import measure as m
+    x = np.linspace(0, 10e-6, 10001)
+    sine = np.sin(2*np.pi*1e6*x)
+    batch = np.stack([sine, np.sin(2*np.pi*2e6*x)])
+
+    assert m.period(x, batch) == pytest.approx([1e-6, 0.5e-6])
+    assert m.frequency(x, sine) == pytest.approx(1e6)
+    assert m.cross(x, batch, level=0, edge='fall') == pytest.approx([0.5e-6, 0.25e-6])
+    assert m.cross(x, sine, level=0, occurrence=-1) == pytest.approx(9e-6)
+    assert m.duty_cycle(x, batch, level=0) == pytest.approx([50, 50], abs=0.01)
+    assert np.isnan(m.cross(x, sine, level=2))
+
+    tau = 1e-6
+    rc = 1 - np.exp(-x/tau)
+    assert m.rise_time(x, rc, final=1) == pytest.approx(math.log(9)*tau, rel=1e-4)
+    assert m.fall_time(x, 1-rc, initial=1, final=0) == pytest.approx(math.log(9)*tau, rel=1e-4)
+    assert m.settling_time(x, rc, tol=0.01, final=1) == pytest.approx(math.log(100)*tau, rel=1e-4)
+    assert m.overshoot(x, rc) == 0
+    ringing = 1 - np.exp(-x/tau)*np.cos(2*np.pi*1e6*x)
+    assert m.overshoot(x, ringing) > 50
+    delayed = np.sin(2*np.pi*1e6*(x - 0.1e-6))
+    assert m.delay(x, delayed, sine, level=0, edge='fall') == pytest.approx(0.1e-6, rel=1e-3)
+
+    test_dir = Path(__file__).parent
+    psf = PSF(test_dir / "../samples/pnoise.raw/pss.td.pss")
+    results = m.measure(psf, ['topref', 'topva'], 'cross', level=0, edge='fall')
+    assert results['topref'] == pytest.approx(3.8168e-6, rel=1e-4)
+
+    # real signals keep their sign when measured alongside complex ones
+    psf.signals['topva'].ordinate = psf.get_signal('topva').ordinate + 0j
+    results = m.measure(psf, ['topref', 'topva'], 'cross', level=0, edge='fall')
+    assert results['topref'] == pytest.approx(3.8168e-6, rel=1e-4)
+
+def test_measure_frequency_domain():
+    """Test batched frequency-domain measurements"""
+    from psf_utils import measure as m
+    f = np.logspace(0, 9, 901)
+    s = 2j*np.pi*f
+    p1, p2, p3 = 2*np.pi*1e3, 2*np.pi*1e7, 2*np.pi*1e8
+    gains = np.stack([
+        1e4/((1 + s/p1)*(1 + s/p2)*(1 + s/p3)),
+        100/(1 + s/(2*np.pi*1e5)),
+    ])
+
+    ugf = m.unity_gain_frequency(f, gains, log_x=True)
+    assert ugf == pytest.approx([7.844e6, 9.9995e6], rel=1e-3)
+    su = 2j*np.pi*ugf[0]
+    expected = 180 + np.degrees(np.angle(1e4/((1 + su/p1)*(1 + su/p2)*(1 + su/p3))))
+    assert m.phase_margin(f, gains, log_x=True) == pytest.approx([expected, 90.57], abs=0.01)
+    margin = m.gain_margin(f, gains, log_x=True)
+    assert margin[0] == pytest.approx(20.83, abs=0.01)
+    assert np.isnan(margin[1])
+    assert m.bandwidth(f, gains[1], log_x=True) == pytest.approx(1e5, rel=0.01)
+
+    white = np.full(len(f), 4e-18)
+    assert m.integrated_noise(f, white, 1e3, 1e6) == pytest.approx(math.sqrt(4e-18*(1e6 - 1e3)))
+    assert m.integrated_noise(f, np.sqrt(white), density='amplitude') == pytest.approx(
+        math.sqrt(4e-18*(1e9 - 1))
+    )
+
+    test_dir = Path(__file__).parent
+    psfs = [test_dir / "../samples/fracpole.ac", test_dir / "../samples/fracpole.spac"]
+    names, table = m.measure_files(psfs, ['z2', 'z6'], 'bandwidth')
+    assert names == ['z2', 'z6']
+    assert table.shape == (2, 2)
+    assert table[0] == pytest.approx(table[1])
+    assert table[0] == pytest.approx([141.26e-6, 1.8226e-3], rel=1e-4)
+
+    # measure() passes the phase of AC signals to the phase measurements
+    ac = PSF(test_dir / "../samples/pnoise.raw/aclog.ac")
+    f = ac.get_sweep().abscissa
+    s = 2j*np.pi*f
+    loop = 1e3/((1 + s/(2*np.pi*1e2))*(1 + s/(2*np.pi*1e5))*(1 + s/(2*np.pi*2e5)))
+    ac.signals['top'].ordinate = loop
+    for measurement in ['phase_margin', 'gain_margin', 'phase_crossover']:
+        func = m.measurements[measurement]
+        expected = func(f, loop, log_x=ac.log_x(ac.get_sweep()))
+        result = m.measure(ac, ['top'], measurement)['top']
+        assert np.isfinite(result)
+        assert result == pytest.approx(expected)
+    assert m.measure(ac, ['top'], 'phase_margin')['top'] < 90
+
+# Noise Tests {{{1
+def test_noise_rank():
+    """Test integration and ranking of noise contributors"""
+    from psf_utils.noise import rank, integrate_contributions
+    from psf_utils.measure import integrated_noise
+    test_dir = Path(__file__).parent
+    psf = PSF(test_dir / "../samples/pnoise.raw/noiref.noise")
+    freq = psf.get_sweep().abscissa
+    band = (1e3, 1e6)
+
+    by_instance = rank(psf, band)
+    assert [c.name for c in by_instance] == ['RESref', 'RESva', 'Rref', 'Rva']
+    expected = integrated_noise(freq, psf.get_signal('RESref:total').ordinate, *band)
+    assert by_instance[0].rms == pytest.approx(expected)
+    assert sum(c.fraction for c in by_instance) == pytest.approx(1)
+
+    by_type = rank(psf, band, by='type', top=2)
+    assert [c.name for c in by_type] == ['fn', 'rn']
+    assert by_type[0].power + by_type[1].power == pytest.approx(by_instance[0].power)
+
+    by_contributor = rank(psf, band, by='contributor', patterns=['RESref'])
+    assert {c.name for c in by_contributor} == {'RESref:fn', 'RESref:rn'}
+    powers = integrate_contributions(psf, ['RESref:fn', 'RESref:rn'], band)
+    assert powers == pytest.approx(sorted(c.power for c in by_contributor)[::-1])
+
+
+def test_noise_columns(tmp_path):
+    """Test integrating contributions where their values are held"""
+    import shutil
+    from psf_utils.measure import band_weights
+    from psf_utils.noise import _block, integrate_contributions, rank
+    test_dir = Path(__file__).parent
+
+    # signals of the fast reader are integrated as columns of its block
+    psf = PSF(
+        test_dir / "../samples/pnoise.raw/pss.td.pss",
+        use_cache=False, update_cache=False
+    )
+    names = list(psf.signals)
+    assert all(_block(psf.get_signal(n).ordinate) for n in names)
+    band = (1e-7, 2e-6)
+    weights = band_weights(psf.get_sweep().abscissa, *band)
+    expected = [psf.get_signal(n).ordinate @ weights for n in names]
+    assert integrate_contributions(psf, names[::-1], band) == pytest.approx(expected[::-1])
+
+    # ranking from a compressed cache reads no signal objects
+    psf_file = tmp_path / 'noiref.noise'
+    shutil.copy(test_dir / "../samples/pnoise.raw/noiref.noise", psf_file)
+    psf = PSF(psf_file, compress_cache=True)
+    band = (1e3, 1e6)
+    for by in ['instance', 'type', 'contributor']:
+        loaded = rank(psf, band, by)
+        cached = rank(psf_file, band, by)
+        assert [c.name for c in cached] == [c.name for c in loaded]
+        assert [c.power for c in cached] == pytest.approx([c.power for c in loaded])
+        assert [c.units for c in cached] == [c.units for c in loaded]
+
+# Expression Tests {{{1
+def test_expressions():
+    """Test compilation and evaluation of signal expressions"""
+    from inform import Error
+    from psf_utils.expr import compile, is_expression
+    test_dir = Path(__file__).parent
+    psf = PSF(test_dir / "../samples/fracpole.ac")
+    freq = psf.get_sweep().abscissa
+    z2 = psf.get_signal('z2').ordinate
+    z6 = psf.get_signal('z6').ordinate
+
+    signal = psf.eval('(z6-z2)/2')
+    assert signal.ordinate == pytest.approx((z6 - z2)/2)
+    assert signal.units == 'V'
+    signal = psf.eval('db(z6/z2)')
+    assert signal.ordinate == pytest.approx(20*np.log10(np.absolute(z6/z2)))
+    assert signal.units == 'dB'
+    assert psf.eval('V(z6,z2)').ordinate == pytest.approx(z6 - z2)
+    assert psf.eval('-z6^2').ordinate == pytest.approx(-z6**2)
+    assert psf.eval('2*-z6').ordinate == pytest.approx(-2*z6)
+    signal = psf.eval('deriv(mag(z6))')
+    assert signal.ordinate == pytest.approx(np.gradient(np.absolute(z6), freq))
+    assert signal.units == 'V/Hz'
+
+    # common subexpressions are computed once and unused signals are not read
+    plan = compile('(z6-z2)/2', 'db(z6-z2)', 'ph(z6-z2)')
+    assert plan.signals == ['z6', 'z2']
+    assert len(plan.steps) == 7
+
+    assert is_expression('a-b') and is_expression('db(a)')
+    assert not is_expression('R1:*')
+    for bad in ['z6+', '(z6', 'foo(z6)', 'z6 z2', 'V(z6,z2,z2)']:
+        with pytest.raises(Error):
+            psf.eval(bad)
+    with pytest.raises(UnknownSignal):
+        psf.eval('z6-nonexistent')
+
+# Resampling Tests {{{1
+def test_resample():
+    """Test block resampling onto a common grid"""
+    from psf_utils.resample import resample, uniform_grid, log_grid
+    x = np.array([0, 1, 3, 4.])
+    y = np.array([[0, 1, 3, 4], [1, 1, 0, 0]], dtype=float)
+    grid = np.array([-1, 0, 0.5, 2, 3.5, 4, 5])
+
+    expected = np.array([np.interp(grid, x, row) for row in y])
+    assert resample(x, y, grid) == pytest.approx(expected)
+    assert resample(x, y, grid, chunk=2) == pytest.approx(expected)
+    assert resample(x, list(y), grid, chunk=3) == pytest.approx(expected)
+    assert resample(x, y[0], grid) == pytest.approx(expected[0])
+    assert resample(x, y, grid, kind='hold')[0] == pytest.approx([0, 0, 0, 1, 3, 4, 4])
+    filled = resample(x, y, grid, fill=np.nan)
+    assert np.isnan(filled[:, [0, -1]]).all()
+    assert resample(x, y[1] + 1j, grid).imag == pytest.approx(np.ones(len(grid)))
+
+    assert uniform_grid(0, 1, step=0.25) == pytest.approx([0, 0.25, 0.5, 0.75, 1])
+    assert log_grid(1, 1000, per_decade=1) == pytest.approx([1, 10, 100, 1000])
+
+    test_dir = Path(__file__).parent
+    psf = PSF(test_dir / "../samples/pnoise.raw/pss.td.pss")
+    sweep = psf.get_sweep()
+    grid = uniform_grid(0, sweep.abscissa[-1], 501)
+    names, values = psf.resample(grid, ['top', 'topref'])
+    assert values.shape == (2, 501)
+    top = psf.get_signal('top').ordinate
+    assert values[0] == pytest.approx(np.interp(grid, sweep.abscissa, top))
+
+# Spectrum Tests {{{1
+def test_spectrum():
+    """Test windowed spectra and converter metrics"""
+    from psf_utils.spectrum import spectrum, metrics, window, signal_spectra
+    from inform import Error
+
+    # a sine with known harmonics and noise, on a nonuniform time grid
+    rng = np.random.default_rng(0)
+    n = 4096
+    f0 = 1e3
+    t = np.sort(rng.uniform(0, 1e-1, 8*n))
+    t[0], t[-1] = 0, 1e-1
+    tone = np.sin(2*np.pi*f0*t)
+    distorted = tone + 1e-3*np.sin(2*np.pi*3*f0*t)
+
+    spec = spectrum(t, [tone, distorted], points=n, window_name='blackmanharris')
+    assert spec.power.shape == (2, n//2 + 1)
+    m = metrics(spec)
+    assert m.fundamental == pytest.approx([f0, f0])
+    assert m.signal == pytest.approx([0.5, 0.5], rel=1e-3)
+    assert m.thd[1] == pytest.approx(-60, abs=0.1)
+    assert m.thd[0] < -80
+    assert m.sfdr[1] == pytest.approx(60, abs=0.5)
+    assert m.enob[1] == pytest.approx((m.sndr[1] - 1.76)/6.02)
+
+    # a single signal gives scalar metrics, welch averaging preserves power
+    single = metrics(spectrum(t, distorted, points=n, segments=4))
+    assert single.signal == pytest.approx(0.5, rel=1e-2)
+    assert single.thd == pytest.approx(-60, abs=0.5)
+
+    assert window('hann', 4) == pytest.approx([0, 0.5, 1, 0.5])
+    with pytest.raises(Error):
+        window('bogus', 4)
+
+    test_dir = Path(__file__).parent
+    psf = PSF(test_dir / "../samples/pnoise.raw/pss.td.pss")
+    spec = signal_spectra(psf, ['top', 'topref'], points=1024)
+    assert spec.power.shape == (2, 513)
+
+# Diff Tests {{{1
+def test_diff():
+    """Test comparison against a golden run"""
+    from psf_utils.diff import compare
+    test_dir = Path(__file__).parent
+    golden = PSF(test_dir / "../samples/pnoise.raw/pss.td.pss")
+    assert compare(golden, golden).passed
+
+    # perturb one signal of a copy of the golden run
+    psf = PSF(test_dir / "../samples/pnoise.raw/pss.td.pss")
+    top = golden.get_signal('top').ordinate
+    psf.signals['top'].ordinate = top.copy()
+    psf.signals['top'].ordinate[7] += 1e-3 + 2e-3*abs(top[7])
+    del psf.signals['topva']
+    result = compare(psf, golden, atol=1e-3, rtol=1e-3)
+    assert not result.passed
+    assert result.missing == ['topva']
+    assert [d.name for d in result.differences] == ['top']
+    difference = result.differences[0]
+    assert difference.index == 7
+    assert difference.location == golden.get_sweep().abscissa[7]
+    assert difference.ratio > 1
+
+    # early exit stops after the first block with a difference
+    result = compare(psf, golden, ['top', 'topref'], early_exit=True, block=1)
+    assert result.compared == 1
+
+    # differing sweeps are interpolated, uncovered points are differences
+    aclog = PSF(test_dir / "../samples/pnoise.raw/aclog.ac")
+    aclin = PSF(test_dir / "../samples/pnoise.raw/aclin.ac")
+    assert compare(aclin, aclog).passed
+    result = compare(aclog, aclin, worst=2)
+    assert len(result.differences) == 2
+    assert np.isnan(result.differences[0].value)
+    assert not result.differences[0].covered
+
+    # a file matches itself, including its NaN and infinite values
+    import warnings
+    info = PSF(test_dir / "../samples/dcOpInfo.info.psfascii")
+    values = [np.asarray(s.ordinate) for s in info.signals.values()]
+    assert any(np.isnan(v).any() for v in values if v.dtype.kind == 'f')
+    assert any(np.isinf(v).any() for v in values if v.dtype.kind == 'f')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert compare(info, info).passed
+
+    # real signals keep their sign when compared alongside complex ones
+    psf.signals['top'].ordinate = -top
+    for run in (psf, golden):
+        run.signals['topref'].ordinate = run.get_signal('topref').ordinate + 0j
+    result = compare(psf, golden, ['top', 'topref'])
+    difference = result.differences[0]
+    assert difference.name == 'top'
+    assert np.isrealobj(difference.value)
+    assert difference.value == -difference.expected != 0
+
+# Bus Tests {{{1
+def test_bus():
+    """Test grouping of indexed signals into buses and decoding"""
+    from psf_utils.bus import decode, expand_range, pack, split_bit
+    from psf_utils.show import expand_args
+
+    assert split_bit('I48.LOGIC_OUT<3>') == ('I48.LOGIC_OUT', 3)
+    assert split_bit('out') is None
+    assert expand_range('d<2:0>') == ['d<2>', 'd<1>', 'd<0>']
+    assert expand_range('d<0:1>') == ['d<0>', 'd<1>']
+    signals = ['d<0>', 'd<1>', 'd<2>', 'e<0>']
+    assert expand_args(signals, ['d<1:0>']) == ['d<0>', 'd<1>']
+
+    # 3 runs of a 3 bit bus, bits ordered msb first
+    logic = np.array([
+        [[0, 0, 1], [0, 1, 0], [1, 1, 1]],
+        [[1, 1, 1], [1, 1, 1], [1, 1, 1]],
+        [[0, 0, 0], [0, 0, 0], [0, 0, 1]],
+    ], dtype=bool)
+    assert pack(logic, [2, 1, 0]).tolist() == [[1, 3, 5], [7, 7, 7], [0, 0, 1]]
+    assert pack(logic, [2, 1, 0], signed=True)[1].tolist() == [-1, -1, -1]
+    assert decode(0.8*logic, [2, 1, 0], 0.4)[0].tolist() == [1, 3, 5]
+
+    test_dir = Path(__file__).parent
+    psf = PSF(test_dir / "../samples/bus_chevrons.tran")
+    bus = psf.get_bus('I48.LOGIC_OUT')
+    assert bus.bits == [3]
+    assert bus.ordinate.shape == (1, 3)
+    assert bus.units == 'V'
+    # member signals share storage with the bus
+    assert np.shares_memory(psf.get_signal('I48.LOGIC_OUT<3>').ordinate, bus.ordinate)
+    assert bus.decode().tolist() == [0, 8, 0]
+    sweep = psf.get_sweep()
+    assert bus.decode(at=[1e-9], abscissa=sweep.abscissa).tolist() == [8]
+    assert [b.name for b in psf.all_buses()] == ['I48.LOGIC_OUT']
+    with pytest.raises(UnknownSignal):
+        psf.get_bus('I48')
+
+    # the bus keeps the precision of its bits
+    psf = PSF(
+        test_dir / "../samples/bus_chevrons.tran",
+        use_cache=False, update_cache=False, dtype='float32'
+    )
+    bus = psf.get_bus('I48.LOGIC_OUT')
+    assert bus.ordinate.dtype == np.float32
+    assert psf.get_signal('I48.LOGIC_OUT<3>').ordinate.dtype == np.float32
+
+# Compact Signal Tests {{{1
+def test_compact():
+    """Test run-length storage of piecewise-constant signals"""
+    from psf_utils.compact import compact
+    x = np.arange(12.)
+    y = np.array([0, 0, 0, 1, 1, 1, 1, 0, 0, 0, 0, 0], dtype=float)
+    runs = compact(y, x, max_fraction=1)
+    assert runs.starts.tolist() == [0, 3, 7]
+    assert runs.expand() == pytest.approx(y)
+    assert runs.value_at([0, 4, 11]).tolist() == [0, 1, 0]
+    assert runs.transitions().tolist() == [3, 7]
+    assert runs.transitions(edge='rise').tolist() == [3]
+    assert runs.count(edge='fall') == 1
+    assert compact(x, x) is None            # not worth compacting
+
+    # with a tolerance, values change by no more than the tolerance
+    noisy = y + 1e-4*np.sin(x)
+    runs = compact(noisy, x, tol=1e-2, max_fraction=1)
+    assert len(runs.starts) == 3
+    assert np.max(np.absolute(runs.expand() - noisy)) <= 1e-2
+
+    # strings form runs only when identical
+    states = np.array(['idle']*5 + ['run']*4 + ['idle']*3)
+    runs = compact(states, x, tol=1e-2, max_fraction=1)
+    assert runs.starts.tolist() == [0, 5, 9]
+    assert runs.expand().tolist() == states.tolist()
+
+    test_dir = Path(__file__).parent
+    psf_file = test_dir / "../samples/dan-zilla.psfascii"
+    full = PSF(psf_file, use_cache=False, update_cache=False)
+    psf = PSF(psf_file, use_cache=False, update_cache=False, compact=True)
+    signal = psf.get_signal('vdd')
+    assert 'ordinate' not in signal.__dict__
+    assert signal.compact.count() == 0
+    assert signal.ordinate == pytest.approx(full.get_signal('vdd').ordinate)
+    assert 'ordinate' in signal.__dict__
+    for name, sig in psf.signals.items():
+        assert sig.ordinate == pytest.approx(full.get_signal(name).ordinate)
+
+# Storage Precision Tests {{{1
+def test_storage_precision():
+    """Test storing signals in reduced precision"""
+    from psf_utils.storage import Storage
+    import psf_utils.fast as fast
+    from inform import Error
+    test_dir = Path(__file__).parent
+    psf_file = test_dir / "../samples/pnoise.raw/pss.td.pss"
+    full = PSF(psf_file, use_cache=False, update_cache=False)
+
+    # fast reader, with an override
+    psf = PSF(psf_file, dtype='float32', dtypes={'topref': 'float64'}, update_cache=False)
+    assert psf.get_sweep().abscissa.dtype == np.float64
+    assert psf.get_signal('top').ordinate.dtype == np.float32
+    assert psf.get_signal('topref').ordinate.dtype == np.float64
+    bound = psf.storage.relative_error('top')
+    assert bound == pytest.approx(2**-24)
+    top = full.get_signal('top').ordinate
+    assert psf.get_signal('top').ordinate == pytest.approx(top, rel=bound, abs=0)
+
+    # the fast reader converts the parts of complex values at their precision
+    ac_file = test_dir / "../samples/fracpole.ac"
+    section = ac_file.read_text().split('\nVALUE\n')[1].rsplit('END', 1)[0]
+    values, rows, partial = fast.read_swept(section, Storage('single'))
+    assert {part.dtype for value in values['group'] for part in value} == {np.dtype(np.float32)}
+    values, rows, partial = fast.read_swept(section, Storage('half', {'z6': 'double'}))
+    assert {part.dtype for value in values['group'] for part in value} == {np.dtype(np.float64)}
+    psf = PSF(ac_file, dtype='single', update_cache=False)
+    assert psf.load_stats.fast_path is True
+    assert psf.get_signal('z6').ordinate.dtype == np.complex64
+    z6 = PSF(ac_file, use_cache=False, update_cache=False).get_signal('z6').ordinate
+    assert psf.get_signal('z6').ordinate == pytest.approx(z6, rel=2**-23, abs=0)
+
+    # a cache written with a different precision is not used
+    cache_file = Path(str(psf_file) + '.cache')
+    PSF(psf_file, dtype='float32')
+    assert PSF(psf_file).get_signal('top').ordinate.dtype == np.float64
+    assert cache_file.exists()
+
+    assert Storage('float32') == Storage(np.float32)
+    assert Storage().is_default()
+    with pytest.raises(Error):
+        Storage('int32')
+
+# Compressed Cache Tests {{{1
+def test_compressed_cache():
+    """Test the chunked compressed cache and windowed reads"""
+    from psf_utils import cache
+    test_dir = Path(__file__).parent
+    psf_file = test_dir / "../samples/pnoise.raw/pss.td.pss"
+    cache_file = Path(str(psf_file) + '.cache')
+    full = PSF(psf_file, use_cache=False, update_cache=False)
+
+    # round trip through small chunks with each codec
+    for codec in cache.codecs:
+        cache.write(cache_file, full.__dict__, codec, chunk=300)
+        assert cache.is_compressed(cache_file)
+        psf = PSF(psf_file)
+        for name, signal in full.signals.items():
+            assert np.array_equal(psf.get_signal(name).ordinate, signal.ordinate)
+        assert np.array_equal(psf.get_sweep().abscissa, full.get_sweep().abscissa)
+
+        # a window only reads the chunks that overlap it
+        time = full.get_sweep().abscissa
+        start, stop = time[450], time[700]
+        t, values = cache.read_window(psf_file, start, stop, ['top', 'topref'])
+        assert np.array_equal(t, time[450:701])
+        assert np.array_equal(values['top'], full.get_signal('top').ordinate[450:701])
+    t, values = cache.read_window(psf_file)
+    assert len(t) == len(time) and len(values) == len(full.signals)
+
+    # complex signals and the default chunk size
+    ac_file = test_dir / "../samples/pnoise.raw/aclin.ac"
+    ac = PSF(ac_file, use_cache=False, compress_cache='lzma')
+    assert cache.is_compressed(Path(str(ac_file) + '.cache'))
+    cached = PSF(ac_file)
+    for name, signal in ac.signals.items():
+        assert np.array_equal(cached.get_signal(name).ordinate, signal.ordinate)
+
+    # restore ordinary caches
+    PSF(psf_file, use_cache=False)
+    PSF(ac_file, use_cache=False)
+    assert not cache.is_compressed(cache_file)
+
+# Conversion Tests {{{1
+def test_convert(tmp_path, monkeypatch):
+    """Test conversion to other formats"""
+    from psf_utils.convert import convert, convert_files, find_psf_files, writers
+    from inform import Error
+    test_dir = Path(__file__).parent
+    psf_file = test_dir / "../samples/pnoise.raw/pss.td.pss"
+    psf = PSF(psf_file)
+    time = psf.get_sweep().abscissa
+    top = psf.get_signal('top').ordinate
+
+    # npz, in small chunks and reduced precision
+    convert(psf, tmp_path / 'pss.npz', dtype='float32', chunk=100)
+    data = np.load(tmp_path / 'pss.npz')
+    assert set(data.files) == set(psf.signals) | {'time'}
+    assert data['time'].dtype == np.float64
+    assert np.array_equal(data['time'], time)
+    assert data['top'].dtype == np.float32
+    assert data['top'] == pytest.approx(top, rel=1e-7, abs=1e-30)
+
+    # csv reproduces values exactly, complex signals are split
+    convert(psf, tmp_path / 'pss.csv', names=['top'], chunk=100)
+    table = np.loadtxt(tmp_path / 'pss.csv', delimiter=',', skiprows=1)
+    assert np.array_equal(table[:, 0], time)
+    assert np.array_equal(table[:, 1], top)
+    ac = PSF(test_dir / "../samples/pnoise.raw/aclin.ac")
+    convert(ac, tmp_path / 'ac.csv', names=['top'])
+    with open(tmp_path / 'ac.csv') as f:
+        assert f.readline().strip() == '"freq","top.real","top.imag"'
+
+    # unswept files give one row
+    dc = PSF(test_dir / "../samples/asereq.dcop")
+    convert(dc, tmp_path / 'dc.npz', names=['C1.cap'])
+    assert np.load(tmp_path / 'dc.npz')['C1.cap'] == pytest.approx([1e-6])
+
+    # batch conversion of a directory
+    results = convert_files(
+        [test_dir / "../samples/pnoise.raw"], tmp_path / 'out', names=['top*'], jobs=2
+    )
+    found = find_psf_files(test_dir / "../samples/pnoise.raw")
+    assert [r[0] for r in results] == found
+    converted = [out for psf_file, out, error in results if not error]
+    assert tmp_path / 'out/pss.td.pss.npz' in converted
+    data = np.load(tmp_path / 'out/pss.td.pss.npz')
+    assert sorted(data.files) == ['time', 'top', 'topref', 'topva']
+
+    with pytest.raises(Error):
+        convert(psf, tmp_path / 'pss.bogus')
+
+    # files without signals and unexpected failures are reported per file
+    header = test_dir / "../samples/header.psf"
+    results = convert_files([header, psf_file], tmp_path / 'out', format='csv')
+    assert [r[2] for r in results] == ['no signals to convert.', None]
+    def fail(path, columns, chunk):
+        raise ValueError('bad value')
+    monkeypatch.setitem(writers, 'csv', fail)
+    results = convert_files([psf_file], tmp_path / 'out', format='csv')
+    assert results[0][2] == 'unexpected error: ValueError: bad value.'
+
+
+def test_convert_streaming(tmp_path, monkeypatch):
+    """Test converting from the compressed cache a block at a time"""
+    import shutil
+    from psf_utils import cache, convert
+    test_dir = Path(__file__).parent
+    psf_file = tmp_path / 'pss.td.pss'
+    shutil.copy(test_dir / "../samples/pnoise.raw/pss.td.pss", psf_file)
+    psf = PSF(psf_file, use_cache=False, update_cache=False)
+    time = psf.get_sweep().abscissa
+    top = psf.get_signal('top').ordinate
+
+    # the first conversion loads the file and writes a compressed cache
+    assert convert.cached_columns(psf_file) is None
+    convert.convert_file(psf_file, tmp_path / 'first.npz')
+    assert cache.is_compressed(str(psf_file) + '.cache')
+
+    # later conversions stream from the cache without loading the file
+    monkeypatch.setattr(convert, 'PSF', None)
+    convert.convert_file(psf_file, tmp_path / 'pss.csv', 'csv', ['top*'], chunk=100)
+    table = np.loadtxt(tmp_path / 'pss.csv', delimiter=',', skiprows=1)
+    assert np.array_equal(table[:, 0], time)
+    assert np.array_equal(table[:, 1], top)
+    with open(tmp_path / 'pss.csv') as f:
+        assert f.readline().strip() == '"time","top","topref","topva"'
+    opened = []
+    def open_lazily(path):
+        opened.append(path)
+        return cache.open_lazily(path)
+    monkeypatch.setattr(convert, 'open_lazily', open_lazily)
+    convert.convert_file(psf_file, tmp_path / 'pss.npz', dtype='float32')
+    assert len(opened) == 2     # once to describe the signals, once to read them
+    data = np.load(tmp_path / 'pss.npz')
+    assert sorted(data.files) == sorted(np.load(tmp_path / 'first.npz').files)
+    assert data['top'].dtype == np.float32
+    assert data['top'] == pytest.approx(top, rel=1e-7, abs=1e-30)
+    columns = convert.cached_columns(psf_file, ['top'], 'float16')
+    assert columns.dtype_of(columns.signals[0]) == np.float16
+
+
+def test_convert_columnar(tmp_path):
+    """Test conversion to the formats that require optional packages"""
+    from psf_utils.convert import convert
+    test_dir = Path(__file__).parent
+    psf = PSF(test_dir / "../samples/pnoise.raw/pss.td.pss")
+    top = psf.get_signal('top').ordinate
+    h5py = pytest.importorskip('h5py')
+    convert(psf, tmp_path / 'pss.h5', chunk=100)
+    with h5py.File(tmp_path / 'pss.h5') as f:
+        assert np.array_equal(f['top'][:], top)
+    pq = pytest.importorskip('pyarrow.parquet')
+    convert(psf, tmp_path / 'pss.parquet', chunk=100)
+    assert np.array_equal(pq.read_table(tmp_path / 'pss.parquet')['top'].to_numpy(), top)
+
+
+# Data Frame Tests {{{1
+def test_frames():
+    """Test the views used by the pandas and xarray adapters"""
+    from psf_utils.frames import as_block, stack_runs
+    from inform import Error
+    test_dir = Path(__file__).parent
+    psf_file = test_dir / "../samples/pnoise.raw/pss.td.pss"
+
+    # signals from the fast reader form a single block
+    psf = PSF(psf_file, use_cache=False)
+    names = ['top', 'topref', 'topva']
+    ordinates = [psf.get_signal(n).ordinate for n in names]
+    block = as_block(ordinates)
+    assert block.shape == (len(ordinates[0]), 3)
+    assert all(np.shares_memory(block, o) for o in ordinates)
+    assert np.array_equal(block[:, 1], ordinates[1])
+    assert as_block([ordinates[0], ordinates[2], ordinates[1]]) is None
+    assert as_block([ordinates[0], ordinates[0].copy()]) is None
+
+    # runs are stacked into one array that the signals then share
+    runs = [PSF(psf_file, use_cache=False) for i in range(3)]
+    time, stacked = stack_runs(runs, ['top'])
+    assert stacked['top'].shape == (3, len(time))
+    for i, run in enumerate(runs):
+        assert np.shares_memory(run.get_signal('top').ordinate, stacked['top'])
+        assert np.array_equal(run.get_signal('top').ordinate, ordinates[0])
+    other = PSF(test_dir / "../samples/joop-banaan.tran")
+    with pytest.raises(Error):
+        stack_runs([psf, other])
+
+
+def test_frames_optional():
+    """Test the pandas and xarray adapters"""
+    from psf_utils.frames import runs_to_xarray
+    test_dir = Path(__file__).parent
+    psf_file = test_dir / "../samples/pnoise.raw/pss.td.pss"
+    psf = PSF(psf_file, use_cache=False)
+    top = psf.get_signal('top').ordinate
+
+    pytest.importorskip('pandas')
+    frame = psf.to_pandas()
+    assert frame.index.name == 'time'
+    assert np.array_equal(frame['top'].to_numpy(), top)
+    assert np.shares_memory(frame.to_numpy(), top)
+
+    pytest.importorskip('xarray')
+    dataset = psf.to_xarray(['top'])
+    assert dataset['top'].attrs['units'] == psf.get_signal('top').units
+    assert np.shares_memory(dataset['top'].values, top)
+    runs = [PSF(psf_file, use_cache=False) for i in range(2)]
+    dataset = runs_to_xarray(runs, ['top'])
+    assert dataset['top'].dims == ('run', 'time')
+    assert np.shares_memory(dataset['top'].values, runs[1].get_signal('top').ordinate)
+
+
+# Writer Tests {{{1
+def test_write(tmp_path):
+    """Test writing and synthesizing PSF files"""
+    from psf_utils.write import synthesize, write_psf
+    from inform import Error
+    test_dir = Path(__file__).parent
+
+    # each kind of synthetic file reads back exactly
+    cases = [
+        ('tran', dict(structs=1)),
+        ('ac', dict(group='group')),
+        ('noise', dict(structs=2)),
+        ('dcop', dict(structs=2)),
+    ]
+    for kind, kwargs in cases:
+        path = tmp_path / f'synthetic.{kind}'
+        values = synthesize(path, points=200, signals=4, kind=kind, seed=0, **kwargs)
+        psf = PSF(path, use_cache=False)
+        separator = '.' if kind == 'dcop' else ':'
+        expected = {}
+        for name, v in values.items():
+            if isinstance(v, dict):
+                expected.update({f'{name}{separator}{m}': w for m, w in v.items()})
+            else:
+                expected[name] = v
+        assert list(psf.signals) == list(expected)
+        for name, v in expected.items():
+            assert np.array_equal(np.asarray(psf.get_signal(name).ordinate), v)
+        if kind != 'dcop':
+            assert len(psf.get_sweep().abscissa) == 200
+            assert psf.log_x() == (kind != 'tran')
+            assert psf.get_signal('n0').units == 'V'
+
+    # a file copied from a PSF object matches the original
+    psf = PSF(test_dir / "../samples/pnoise.raw/noiref.noise")
+    psf.write(tmp_path / 'copy.noise')
+    copy = PSF(tmp_path / 'copy.noise', use_cache=False)
+    assert list(copy.signals) == list(psf.signals)
+    assert copy.meta == psf.meta
+    for name, signal in psf.signals.items():
+        assert np.array_equal(copy.get_signal(name).ordinate, signal.ordinate)
+        assert copy.get_signal(name).units == signal.units
+
+    # awkward names and single precision
+    x = np.linspace(0, 1, 11)
+    y = np.float32(x**2)
+    write_psf(tmp_path / 'odd.tran', {'v("a" 50%)': y}, x)
+    odd = PSF(tmp_path / 'odd.tran', dtype='float32')
+    assert np.array_equal(odd.get_signal('v("a" 50%)').ordinate, y)
+
+    with pytest.raises(Error):
+        write_psf(tmp_path / 'bad.tran', dict(out=x[1:]), x)
+    with pytest.raises(Error):
+        synthesize(tmp_path / 'bad.tran', kind='bogus')
+
+
+# Benchmark Tests {{{1
+def test_benchmark(tmp_path):
+    """Test the benchmark harness"""
+    from psf_utils.benchmark import run_benchmarks, compare, scaling, save, load
+    results = run_benchmarks(
+        ['tran'], points=[100, 400], signals=[3], phases_=['parse', 'load'],
+        repeat=1, directory=tmp_path,
+    )
+    assert [(r['points'], r['phase']) for r in results] == [
+        (100, 'parse'), (100, 'load'), (400, 'parse'), (400, 'load')
+    ]
+    assert all(r['time'] > 0 and r['allocated'] > 0 for r in results)
+    assert set(scaling(results)) == {('tran', 3, 'parse'), ('tran', 3, 'load')}
+    save(tmp_path / 'results.json', results)
+    assert load(tmp_path / 'results.json') == results
+
+    # regressions are found in time and allocations, short times are ignored
+    baseline = [
+        dict(kind='tran', points=100, signals=3, phase='load', time=1.0, allocated=100),
+        dict(kind='tran', points=100, signals=3, phase='parse', time=1e-4, allocated=100),
+    ]
+    slower = [
+        dict(baseline[0], time=1.5, allocated=110),
+        dict(baseline[1], time=1.0, allocated=100),
+    ]
+    regressions = compare(slower, baseline, threshold=1.2)
+    assert [(r[0][3], r[1]) for r in regressions] == [('load', 'time')]
+    assert compare(slower, baseline, threshold=2) == []
+
+
+# Load Statistics Tests {{{1
+def test_load_stats(tmp_path):
+    """Test the statistics gathered while loading"""
+    import pickle
+    import shutil
+    test_dir = Path(__file__).parent
+    collected = []
+    PSF.load_hook = collected.append
+    try:
+        # fast reader, then a cache hit
+        psf_file = tmp_path / 'pss.td.pss'
+        shutil.copy(test_dir / "../samples/pnoise.raw/pss.td.pss", psf_file)
+        stats = PSF(psf_file).load_stats
+        assert stats.cache == 'miss'
+        assert stats.fast_path is True
+        assert stats.fallback is None
+        assert stats.bytes == psf_file.stat().st_size
+        assert stats.rows == 1601
+        assert stats.signals == 8
+        assert stats.memory == 8*1601*8
+        for phase in ['read', 'decode', 'parse', 'fast reader', 'build', 'cache write']:
+            assert stats.times[phase] >= 0
+        assert stats.total >= sum(t for p, t in stats.times.items() if p != 'fast reader')
+        psf = PSF(psf_file)
+        assert psf.load_stats.cache == 'hit'
+        assert list(psf.load_stats.times) == ['cache read']
+        with open(str(psf_file) + '.cache', 'rb') as f:
+            assert 'load_stats' not in pickle.load(f)
+
+        # slow path gives the reason
+        uneven = tmp_path / 'uneven.tran'
+        uneven.write_text(mixed_psf.replace('"out" 2\n', '"out" 2 2.5\n') + 'END\n')
+        stats = PSF(uneven, use_cache=False).load_stats
+        assert stats.cache == 'not used'
+        assert stats.fast_path is False
+        assert stats.fallback.startswith('rows differ in length, line ')
+        assert 'fast reader not used' in stats.summary()
+        assert len(collected) == 3
+        assert collected[-1] is stats
+    finally:
+        PSF.load_hook = None
+
+
+# Fast Reader Tests {{{1
+mixed_psf = '''
+HEADER
+"PSFversion" "1.00"
+"analysis type" "tran"
+TYPE
+"sweep" FLOAT DOUBLE PROP(
+"key" "sweep"
+)
+"V" FLOAT DOUBLE PROP(
+"units" "V"
+)
+"C" COMPLEX DOUBLE
+"N" INT LONG
+SWEEP
+"time" "sweep" PROP(
+"units" "s"
+)
+TRACE
+"out" "V"
+"g" GROUP 2
+"a" "C"
+"b" "V"
+"n" "N"
+VALUE
+"time" 0
+"out" 1.5 PROP(
+"units" "V"
+)
+"g" (1 -2.5)
+3
+"n" 7
+"time" 1.0e-9
+"out" 2
+"g" (nan 0.5)
+-4.25
+"n" 8
+"time" 2.0e-9
+"out" 2.5
+'''.lstrip()
+
+
+def test_fast_reader(tmp_path, monkeypatch):
+    """Test that the fast reader gives the same results as the parser"""
+    import psf_utils.fast as fast
+    test_dir = Path(__file__).parent
+    mixed = tmp_path / 'mixed.tran'
+    mixed.write_text(mixed_psf + 'END\n')
+    paths = [mixed] + sorted(
+        p for p in (test_dir / '../samples').glob('**/*.*')
+        if p.is_file() and not p.name.startswith('.')
+        and p.suffix not in ['.index', '.cache']
+    )
+
+    def load():
+        return [PSF(p, use_cache=False) for p in paths]
+
+    psfs = load()
+    for psf in psfs:
+        assert psf.load_stats.fast_path is not False, psf.load_stats.filename
+        assert psf.load_stats.fallback is None
+    stats = psfs[0].load_stats
+    assert stats.fast_path is True
+    assert stats.partial is True
+    assert 'partial last row discarded' in stats.summary()
+    assert stats.rows == 2
+    assert list(psfs[0].get_signal('a').ordinate)[0] == 1-2.5j
+    assert psfs[0].get_signal('n').ordinate.dtype.kind == 'i'
+
+    # force use of the parser and compare
+    def refuse(section, *args):
+        raise fast.Fallback('refused')
+    monkeypatch.setattr(fast, 'read_swept', refuse)
+    monkeypatch.setattr(fast, 'read_unswept', refuse)
+    parsed = load()
+    for psf, expected in zip(psfs[1:], parsed[1:]):
+        assert expected.load_stats.fast_path is not True
+        assert psf.signals.keys() == expected.signals.keys()
+        sweep = psf.get_sweep()
+        if sweep:
+            assert np.array_equal(sweep.abscissa, expected.get_sweep().abscissa)
+        for name, signal in psf.signals.items():
+            ordinate = np.asarray(signal.ordinate)
+            reference = np.asarray(expected.signals[name].ordinate)
+            assert ordinate.dtype == reference.dtype, name
+            assert type(signal.ordinate) is type(expected.signals[name].ordinate)
+            if ordinate.dtype.kind in 'fc':
+                assert np.array_equal(ordinate, reference, equal_nan=True), name
+            else:
+                assert np.array_equal(ordinate, reference), name
+    monkeypatch.undo()
+
+    # rows that differ fall back to the parser, giving the reason and line
+    lines = mixed_psf.splitlines()
+    reordered = tmp_path / 'reordered.tran'
+    first = lines.index('"out" 2')
+    lines[first:first + 4] = lines[first + 1:first + 4] + lines[first:first + 1]
+    reordered.write_text('\n'.join(lines[:-2]) + '\nEND\n')
+    psf = PSF(reordered, use_cache=False)
+    stats = psf.load_stats
+    assert stats.fast_path is False
+    assert stats.fallback == f'row 2 differs from the first, line {first + 1}'
+    assert list(psf.get_signal('out').ordinate) == [1.5, 2]
+
+
+# Progress Tests {{{1
+def test_progress(tmp_path):
+    """Test progress reporting and cancellation"""
+    import io
+    import shutil
+    from psf_utils import Cancelled
+    from psf_utils.cache import atomic_write
+    from psf_utils.progress import ProgressBar
+    test_dir = Path(__file__).parent
+    psf_file = tmp_path / 'pss.td.pss'
+    shutil.copy(test_dir / "../samples/pnoise.raw/pss.td.pss", psf_file)
+    cache_file = tmp_path / 'pss.td.pss.cache'
+
+    # progress is reported for each phase, ending with everything done
+    reports = []
+    psf = PSF(psf_file, progress=reports.append)
+    phases = []
+    for report in reports:
+        if report.phase not in phases:
+            phases.append(report.phase)
+        assert report.filename == str(psf_file)
+    assert phases == ['read', 'decode', 'parse', 'build', 'cache write', 'index write']
+    for phase, units in [('read', 'B'), ('parse', 'chars'), ('build', 'signals')]:
+        done = [r for r in reports if r.phase == phase]
+        assert done[-1].fraction == 1
+        assert done[-1].units == units
+        assert [r.done for r in done] == sorted(r.done for r in done)
+    assert reports[0].total == psf_file.stat().st_size
+    assert cache_file.exists()
+    reports = []
+    PSF(psf_file, progress=reports.append)
+    assert {r.phase for r in reports} == {'cache read'}
+
+    # cancelling leaves the existing cache untouched and no temporary files
+    import os
+    contents = b'previous cache'
+    cache_file.write_bytes(contents)
+    stat = cache_file.stat()
+    os.utime(psf_file, (stat.st_atime + 10, stat.st_mtime + 10))
+    for cancel in ['read', 'parse', 'cache write']:
+        phase = []
+        with pytest.raises(Cancelled) as exception:
+            PSF(
+                psf_file,
+                progress = lambda r: phase.append(r.phase),
+                cancel = lambda: cancel in phase
+            )
+        assert str(exception.value) == f'{psf_file}: load cancelled.'
+        assert cache_file.read_bytes() == contents
+        assert sorted(p.name for p in tmp_path.iterdir()) == [
+            'pss.td.pss', 'pss.td.pss.cache', 'pss.td.pss.index'
+        ]
+
+    # an interrupted write leaves the original
+    with pytest.raises(KeyboardInterrupt):
+        with atomic_write(cache_file) as f:
+            f.write(b'partial')
+            raise KeyboardInterrupt
+    assert cache_file.read_bytes() == contents
+    assert len(list(tmp_path.iterdir())) == 3
+
+    # the parser also reports progress when the fast reader is not used
+    uneven = tmp_path / 'uneven.tran'
+    uneven.write_text(mixed_psf.replace('"out" 2\n', '"out" 2 2.5\n') + 'END\n')
+    reports = []
+    psf = PSF(uneven, use_cache=False, progress=reports.append)
+    assert psf.load_stats.fast_path is False
+    assert [r.fraction for r in reports if r.phase == 'parse'][-1] == 1
+
+    # progress bar
+    stream = io.StringIO()
+    with ProgressBar(stream=stream) as progress:
+        PSF(psf_file, use_cache=False, update_cache=False, progress=progress)
+        assert '100%' in stream.getvalue()
+    assert stream.getvalue().endswith('\r')
+    with ProgressBar(enabled=False) as progress:
+        assert progress is None
+
+
+# Asynchronous Loading Tests {{{1
+def test_aio(tmp_path):
+    """Test asynchronous loading and chunk iteration"""
+    import asyncio
+    import shutil
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from psf_utils import aio
+    test_dir = Path(__file__).parent
+    psf_file = tmp_path / 'pss.td.pss'
+    shutil.copy(test_dir / "../samples/pnoise.raw/pss.td.pss", psf_file)
+    expected = PSF(psf_file, use_cache=False, update_cache=False)
+    loads = []
+    PSF.load_hook = loads.append
+
+    async def concurrent():
+        # the requests share one load, reporting progress on the event loop
+        loop = threading.get_ident()
+        threads = set()
+        report = lambda p: threads.add(threading.get_ident())
+        first, second = await asyncio.gather(
+            PSF.aopen(psf_file, progress=report), aio.open_psf(psf_file)
+        )
+        assert first is second
+        assert threads == {loop}
+        assert not aio._flights
+        return first
+
+    async def cancelled(executor):
+        # cancelling the only request cancels the load
+        task = asyncio.ensure_future(aio.open_psf(psf_file, executor, use_cache=False))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not aio._flights
+
+    async def chunks(**kwargs):
+        blocks = [b async for b in aio.iter_chunks(psf_file, ['top'], **kwargs)]
+        time = np.concatenate([t for t, v in blocks])
+        top = np.concatenate([v['top'] for t, v in blocks])
+        return len(blocks), time, top
+
+    try:
+        psf = asyncio.run(concurrent())
+        assert len(loads) == 1
+        assert np.array_equal(psf.get_signal('top').ordinate, expected.get_signal('top').ordinate)
+
+        gate = threading.Event()
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(gate.wait)    # hold the load until it is cancelled
+            cache_file = tmp_path / 'pss.td.pss.cache'
+            cache_file.unlink()
+            asyncio.run(cancelled(executor))
+            gate.set()
+        assert not cache_file.exists()
+        assert len(loads) == 1
+
+        # without a compressed cache the file is loaded and sliced
+        count, time, top = asyncio.run(chunks(rows=500))
+        assert count == 4
+        assert np.array_equal(time, expected.get_sweep().abscissa)
+        assert np.array_equal(top, expected.get_signal('top').ordinate)
+
+        # with one the blocks are read from the cache
+        PSF(psf_file, use_cache=False, compress_cache=True)
+        loads.clear()
+        count, time, top = asyncio.run(chunks(rows=700))
+        assert count == 3
+        assert not loads
+        assert np.array_equal(time, expected.get_sweep().abscissa)
+        assert np.array_equal(top, expected.get_signal('top').ordinate)
+        count, time, top = asyncio.run(chunks())
+        assert count == 1
+    finally:
+        PSF.load_hook = None
+
+
+# Server Tests {{{1
+def test_server(tmp_path, monkeypatch):
+    """Test serving loaded files from a resident process"""
+    import os
+    import shutil
+    import sys
+    import threading
+    import time
+    from psf_utils import server, show
+    if not server.supported:
+        pytest.skip('unix domain sockets are not available')
+    test_dir = Path(__file__).parent
+    psf_file = tmp_path / 'aclin.ac'
+    shutil.copy(test_dir / "../samples/pnoise.raw/aclin.ac", psf_file)
+    other_file = tmp_path / 'dcswp.dc'
+    shutil.copy(test_dir / "../samples/dcswp.dc", other_file)
+    socket = tmp_path / 'server.sock'
+
+    # without a server, fetch declines
+    assert server.fetch(psf_file, socket=socket) is None
+
+    daemon = server.Server(socket, max_files=1, idle=0)
+    thread = threading.Thread(target=daemon.serve, daemon=True)
+    thread.start()
+    for i in range(100):
+        if socket.exists():
+            break
+        time.sleep(0.05)
+    try:
+        expected = PSF(psf_file, use_cache=False, update_cache=False)
+        psf = server.fetch(psf_file, socket=socket)
+        assert psf.load_stats.cache == 'server'
+        assert psf.get_sweep().name == expected.get_sweep().name
+        assert np.array_equal(psf.get_sweep().abscissa, expected.get_sweep().abscissa)
+        assert psf.signals.keys() == expected.signals.keys()
+        for name, signal in expected.signals.items():
+            assert np.array_equal(psf.get_signal(name).ordinate, signal.ordinate)
+            assert psf.get_signal(name).units == signal.units
+
+        # the arrays are mapped, and changes to them remain private
+        ordinate = psf.get_signal('iRESref:p').ordinate
+        assert not ordinate.flags.owndata
+        ordinate[:] = 0
+        again = server.fetch(psf_file, socket=socket)
+        assert np.array_equal(
+            again.get_signal('iRESref:p').ordinate,
+            expected.get_signal('iRESref:p').ordinate
+        )
+        response, fds = server.request('status', socket)
+        assert [f['hits'] for f in response['files']] == [2]
+
+        # a file already held is served while another is being loaded
+        fetched = []
+        with daemon.loading:
+            fetcher = threading.Thread(
+                target = lambda: fetched.append(server.fetch(psf_file, socket=socket))
+            )
+            fetcher.start()
+            fetcher.join(5)
+        assert fetched and fetched[0] is not None
+
+        # a changed file is reloaded
+        shutil.copy(other_file, psf_file)
+        stat = psf_file.stat()
+        os.utime(psf_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        changed = server.fetch(psf_file, socket=socket)
+        assert changed.get_sweep().name == PSF(other_file).get_sweep().name
+
+        # only the most recently used file is kept
+        server.fetch(other_file, socket=socket)
+        response, fds = server.request('status', socket)
+        assert [f['path'] for f in response['files']] == [str(other_file.resolve())]
+
+        # a file that cannot be loaded is left to the client
+        assert server.fetch(tmp_path / 'missing.tran', socket=socket) is None
+    finally:
+        server.request('stop', socket)
+        thread.join(5)
+    assert not thread.is_alive()
+    assert not socket.exists()
+
+    # the commands load the file themselves if the server cannot be imported
+    monkeypatch.setitem(sys.modules, 'psf_utils.server', None)
+    assert show.fetch(psf_file) is None
+
+
+# Shared Memory Tests {{{1
+def _shared_signal(args):
+    # run in a worker process by test_shared()
+    handle, name = args
+    ordinate = handle.attach().get_signal(name).ordinate
+    return ordinate.sum(), ordinate.flags.owndata
+
+def test_shared():
+    """Test publishing data in shared memory"""
+    import gc
+    import multiprocessing
+    import pickle
+    from inform import Error
+    test_dir = Path(__file__).parent
+    psf = PSF(test_dir / "../samples/pnoise.raw/aclin.ac")
+    names = list(psf.signals)
+
+    with psf.share() as handle:
+        assert len(pickle.dumps(handle)) < 200
+
+        # attaching gives read-only views of the shared memory
+        shared = handle.attach()
+        assert shared.load_stats.cache == 'shared'
+        assert np.array_equal(shared.get_sweep().abscissa, psf.get_sweep().abscissa)
+        for name in names:
+            ordinate = shared.get_signal(name).ordinate
+            assert np.array_equal(ordinate, psf.get_signal(name).ordinate)
+            assert not ordinate.flags.owndata
+            assert not ordinate.flags.writeable
+
+        # as it does in other processes
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+            with context.Pool(2) as pool:
+                results = pool.map(_shared_signal, [(handle, n) for n in names])
+            for name, (total, owned) in zip(names, results):
+                assert total == psf.get_signal(name).ordinate.sum()
+                assert not owned
+
+        # only the publisher may close it
+        copy = pickle.loads(pickle.dumps(handle))
+        with pytest.raises(Error):
+            copy.close()
+
+    # once closed no more processes can attach, existing views remain
+    with pytest.raises(Error, match='no longer available'):
+        copy.attach()
+    assert shared.get_signal(names[0]).ordinate.sum() == psf.get_signal(names[0]).ordinate.sum()
+
+    # a discarded handle releases its memory
+    handle = psf.share()
+    copy = pickle.loads(pickle.dumps(handle))
+    del handle
+    gc.collect()
+    with pytest.raises(Error):
+        copy.attach()
+
+
+# Catalog Tests {{{1
+def test_catalog(tmp_path, monkeypatch):
+    """Test cataloging a directory of PSF files"""
+    import os
+    import shutil
+    from psf_utils import catalog
+    from psf_utils.catalog import Catalog, CATALOG_FILENAME
+    from psf_utils.index import index_filepath
+    test_dir = Path(__file__).parent
+    results = tmp_path / 'results.raw'
+    shutil.copytree(test_dir / "../samples/pnoise.raw", results)
+    shutil.copy(test_dir / "../samples/dcswp.dc", results)
+    for path in results.glob('*.*'):
+        if path.suffix in ('.cache', '.index'):
+            path.unlink()
+
+    # the catalog agrees with the files
+    built = Catalog.build(results, jobs=2)
+    assert (results / CATALOG_FILENAME).exists()
+    assert 'logFile' not in [e.path for e in built.select()]
+    for entry in built.select():
+        psf = PSF(built.path(entry), use_cache=False, update_cache=False)
+        assert entry.signals == list(psf.signals)
+        assert entry.analysis == psf.meta['analysis type']
+        sweep = psf.get_sweep()
+        assert entry.rows == len(sweep.abscissa)
+        assert entry.start == sweep.abscissa[0]
+        assert entry.stop == sweep.abscissa[-1]
+        assert entry.units == sweep.units
+    assert [e.path for e in built.select('noise')] == ['noiref.noise', 'noiva.noise']
+    found = {e.path: names for e, names in built.find('out')}
+    assert sorted(found) == [
+        'noiref.noise', 'noiva.noise', 'pnoiref.pnoise', 'pnoiva.pnoise'
+    ]
+    assert [e.path for e, names in built.find('Vd:*', analysis='dc')] == ['dcswp.dc']
+
+    # only files that changed are scanned again
+    scanned = []
+    scan = catalog.scan
+    monkeypatch.setattr(catalog, 'scan', lambda p: scanned.append(p.name) or scan(p))
+    again = Catalog.build(results)
+    assert not scanned
+    assert [e.__dict__ for e in again] == [e.__dict__ for e in built]
+    changed = results / 'aclin.ac'
+    shutil.copy(results / 'aclog.ac', changed)
+    stat = changed.stat()
+    os.utime(changed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    (results / 'noiva.noise').unlink()
+    again = Catalog.build(results)
+    assert scanned == ['aclin.ac']
+    assert again.entries['aclin.ac'].rows == built.entries['aclog.ac'].rows
+    assert 'noiva.noise' not in again.entries
+    scanned.clear()
+    Catalog.build(results, refresh=True)
+    assert len(scanned) == len(again)
+
+    # an unreadable catalog is ignored
+    (results / CATALOG_FILENAME).write_text('garbage')
+    assert len(Catalog.build(results)) == len(again)
+
+    # an unreadable index is ignored and a trace of unknown type is listed
+    odd = results / 'odd.ac'
+    odd.write_text(
+        (results / 'aclog.ac').read_text().replace('"top" "V"', '"top" "Unknown"')
+    )
+    index_filepath(odd).write_bytes(b'garbage')
+    entry = scan(odd)
+    assert 'top' in entry['signals']
+    assert entry['rows'] == again.entries['aclog.ac'].rows
+
+
+# Interning Tests {{{1
+def test_interning(tmp_path, monkeypatch):
+    """Test sharing sweeps, headers and types between PSF objects"""
+    import gc
+    import shutil
+    from psf_utils import interning
+    test_dir = Path(__file__).parent
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'run{i}' / 'pss.td.pss'
+        path.parent.mkdir()
+        shutil.copy(test_dir / "../samples/pnoise.raw/pss.td.pss", path)
+        paths.append(path)
+    other = tmp_path / 'run0' / 'aclin.ac'
+    shutil.copy(test_dir / "../samples/pnoise.raw/aclin.ac", other)
+
+    # nothing is shared unless requested
+    plain = PSF(paths[0], update_cache=False)
+    plain.get_sweep().abscissa *= 1e9
+    assert not (tmp_path / 'run0' / interning.STORE_DIRNAME).exists()
+
+    # identical sweeps are shared, headers and types are private
+    first, second = [PSF(p, intern=True) for p in paths[:2]]
+    assert first.get_sweep().abscissa is second.get_sweep().abscissa
+    assert not first.get_sweep().abscissa.flags.writeable
+    assert first.meta is not second.meta
+    assert first.meta == second.meta
+    for (k1, v1), (k2, v2) in zip(first.meta.items(), second.meta.items()):
+        assert k1 is k2
+        assert v1 is v2 or not isinstance(v1, str)
+    first.meta['extra'] = 1
+    assert 'extra' not in second.meta
+    for name, type in first.types.items():
+        assert second.types[name] is not type
+        assert second.types[name].name is type.name
+    for name, signal in first.signals.items():
+        assert second.get_signal(name).meta is second.meta
+        assert not np.shares_memory(second.get_signal(name).ordinate, signal.ordinate)
+    ac = PSF(other, intern=True)
+    assert ac.get_sweep().abscissa is not first.get_sweep().abscissa
+
+    # caches refer to a single copy of the sweep
+    abscissa = first.get_sweep().abscissa
+    store = tmp_path / 'run0' / interning.STORE_DIRNAME
+    assert len(list(store.glob('*.npy'))) == 2
+    cache_file = paths[0].with_suffix('.pss.cache')
+    assert abscissa.tobytes() not in cache_file.read_bytes()
+
+    # and the sweep is not read again while it is held
+    third = PSF(paths[0], intern=True)
+    assert third.load_stats.cache == 'hit'
+    assert third.get_sweep().abscissa is abscissa
+    assert np.array_equal(third.get_signal('top').ordinate, first.get_signal('top').ordinate)
+
+    # a load that does not intern gets a writable copy from the store
+    private = PSF(paths[0])
+    assert private.load_stats.cache == 'hit'
+    assert private.get_sweep().abscissa is not abscissa
+    private.get_sweep().abscissa *= 1e9
+
+    # otherwise it is read from the store
+    expected = abscissa.copy()
+    del first, second, third, abscissa
+    gc.collect()
+    assert not any(a.size == 1601 for a in interning._arrays.values())
+    fourth = PSF(paths[1], intern=True)
+    assert fourth.load_stats.cache == 'hit'
+    assert np.array_equal(fourth.get_sweep().abscissa, expected)
+
+    # a missing sweep is a cache miss, the file is then reparsed
+    PSF(paths[2], intern=True)
+    shutil.rmtree(tmp_path / 'run2' / interning.STORE_DIRNAME)
+    del fourth
+    gc.collect()
+    fifth = PSF(paths[2], intern=True)
+    assert fifth.load_stats.cache == 'miss'
+    assert np.array_equal(fifth.get_sweep().abscissa, expected)
+
+    # sweeps are removed from the store once no cache uses them
+    monkeypatch.setattr(interning, 'GRACE', 0)
+    assert len(list(store.glob('*.npy'))) == 2
+    paths[0].touch()
+    PSF(paths[0])
+    assert len(list(store.glob('*.npy'))) == 1
+    other.with_suffix('.ac.cache').unlink()
+    interning.SweepStore(other.parent).prune()
+    assert not list(store.glob('*.npy'))
+
+
+def _record_sweeps(args):
+    # run in a worker process by test_sweep_references()
+    from psf_utils import interning
+    directory, caches = args
+    store = interning.SweepStore(directory)
+    for cache in caches:
+        store.record(cache, [cache])
+
+
+def test_sweep_references(tmp_path):
+    """Test that caches written by several processes are all recorded"""
+    from concurrent.futures import ProcessPoolExecutor
+    from psf_utils import interning
+    (tmp_path / interning.STORE_DIRNAME).mkdir()
+    caches = [[f'{i}.{j}.cache' for j in range(50)] for i in range(4)]
+    for cache in sum(caches, []):
+        (tmp_path / cache).touch()
+    with ProcessPoolExecutor(4) as executor:
+        list(executor.map(_record_sweeps, [(tmp_path, c) for c in caches]))
+    references = interning.SweepStore(tmp_path)._read_references()
+    assert sorted(references) == sorted(sum(caches, []))
+
+
+# Nested Sweep Tests {{{1
+def nested_psf(temps, vdds, lengths=None, order=None):
+    # returns the text of a transient analysis nested within sweeps of
+    # temperature and supply voltage
+    lines = '''
+HEADER
+"PSFversion" "1.00"
+"analysis type" "tran"
+TYPE
+"sweep" FLOAT DOUBLE PROP(
+"key" "sweep"
+)
+"V" FLOAT DOUBLE PROP(
+"units" "V"
+)
+SWEEP
+"temp" "sweep" PROP(
+"key" "sweep"
+)
+"vdd" "sweep" PROP(
+"key" "sweep"
+)
+"time" "sweep" PROP(
+"key" "sweep"
+)
+TRACE
+"out" "V"
+"in" "V"
+VALUE
+'''.lstrip().splitlines()
+    blocks = order or [(t, v) for t in temps for v in vdds]
+    for i, (temp, vdd) in enumerate(blocks):
+        if vdd == blocks[0][1] or order:
+            lines.append(f'"temp" {temp}')
+        lines.append(f'"vdd" {vdd}')
+        for t in range(lengths[i] if lengths else 4):
+            lines.append(f'"time" {t*1e-9:e}')
+            lines.append(f'"out" {temp + 1000*vdd + t}')
+            lines.append(f'"in" {t}')
+    return '\n'.join(lines + ['END', ''])
+
+
+def test_nested(tmp_path, monkeypatch):
+    """Test signals of nested sweeps as N-dimensional arrays"""
+    import psf_utils.fast as fast
+    from psf_utils import cache
+    from psf_utils.catalog import scan
+    from psf_utils.nested import read_slice
+    from inform import Error
+    path = tmp_path / 'nested.tran'
+    path.write_text(nested_psf([-40, 27, 125], [1.0, 1.2]))
+
+    psf = PSF(path)
+    assert psf.load_stats.fast_path is True
+    assert psf.load_stats.rows == 24
+    assert psf.get_sweep().name == 'temp'
+    assert psf.get_sweep(-1).name == 'time'
+    temp = psf.get_sweep(0)
+    assert list(temp.abscissa) == [-40, 27, 125]
+    assert list(temp.starts) == [0, 8, 16]
+    assert list(psf.get_sweep(1).starts) == [0, 4, 8, 12, 16, 20]
+
+    # the parser and the cache give the same results
+    def refuse(section, *args):
+        raise fast.Fallback('refused')
+    monkeypatch.setattr(fast, 'read_nested', refuse)
+    for other in [PSF(path, use_cache=False), PSF(path)]:
+        for sweep, expected in zip(other.sweeps, psf.sweeps):
+            assert np.array_equal(sweep.abscissa, expected.abscissa)
+            assert np.array_equal(sweep.starts, expected.starts) or sweep.starts is None
+        assert np.array_equal(other.get_signal('out').ordinate, psf.get_signal('out').ordinate)
+    assert other.load_stats.cache == 'hit'
+    monkeypatch.undo()
+
+    # the array is a view of the signal
+    out = psf.get_array('out')
+    assert out.dims == ('temp', 'vdd', 'time')
+    assert out.shape == (3, 2, 4)
+    assert out.units == 'V'
+    assert np.shares_memory(out.ordinate, psf.get_signal('out').ordinate)
+    assert list(out.axes[0].values) == [-40, 27, 125]
+    assert list(out.axes[2].values) == [0, 1e-9, 2e-9, 3e-9]
+    expected = (
+        np.array([-40, 27, 125])[:, None, None]
+        + 1000*np.array([1.0, 1.2])[None, :, None]
+        + np.arange(4)[None, None, :]
+    )
+    assert np.array_equal(out.ordinate, expected)
+
+    # selection
+    hot = out.sel(temp=125)
+    assert hot.dims == ('vdd', 'time')
+    assert np.shares_memory(hot.ordinate, out.ordinate)
+    assert np.array_equal(hot.ordinate, expected[2])
+    corners = out.sel(temp=[-40, 125], vdd=[1.2])
+    assert corners.shape == (2, 1, 4)
+    assert np.array_equal(corners.ordinate, expected[[0, 2]][:, [1]])
+    assert list(corners.axes[0].values) == [-40, 125]
+    assert out.sel({'vdd': 1.0}, temp=27).dims == ('time',)
+    assert out.isel(time=-1).dims == ('temp', 'vdd')
+    assert np.array_equal(out.isel(time=slice(1, 3)).axes[-1].values, [1e-9, 2e-9])
+    with pytest.raises(Error, match='not found'):
+        out.sel(temp=0)
+    with pytest.raises(Error, match='unknown axis'):
+        out.sel(vss=0)
+
+    # reductions
+    worst = out.max()
+    assert worst.dims == ('time',)
+    assert np.array_equal(worst.ordinate, expected.max(axis=(0, 1)))
+    assert np.allclose(out.mean('vdd').ordinate, expected.mean(axis=1))
+    assert out.std('temp', 'time').dims == ('vdd',)
+    assert out.reduce(np.ptp, 'temp').shape == (2, 4)
+
+    # blocks of different lengths must be resampled
+    ragged = tmp_path / 'ragged.tran'
+    ragged.write_text(nested_psf([27, 125], [1.0, 1.2], lengths=[4, 3, 4, 5]))
+    psf = PSF(ragged)
+    with pytest.raises(Error, match='differs between blocks'):
+        psf.get_array('out')
+    out = psf.get_array('out', grid=[0, 1.5e-9, 3e-9])
+    assert out.shape == (2, 2, 3)
+    assert np.allclose(out.ordinate[0, 1], [1227, 1228.5, 1229])
+
+    # the outer sweeps must form a grid
+    scrambled = tmp_path / 'scrambled.tran'
+    scrambled.write_text(nested_psf(
+        None, None, order=[(27, 1.0), (27, 1.2), (125, 1.2), (125, 1.0)]
+    ))
+    with pytest.raises(Error, match='do not form a grid'):
+        PSF(scrambled).get_array('out')
+
+    # the catalog describes the inner sweep
+    entry = scan(path)
+    assert entry['sweep'] == 'time'
+    assert entry['outer'] == ['temp', 'vdd']
+    assert entry['rows'] == 24
+    assert entry['start'] == 0 and entry['stop'] == 3e-9
+
+    # a slice is read from a compressed cache without reading other blocks
+    path = tmp_path / 'long.tran'
+    path.write_text(nested_psf([-40, 27, 125], [1.0, 1.2], lengths=[100]*6))
+    psf = PSF(path)
+    attributes = {k: v for k, v in psf.__dict__.items() if k != 'load_stats'}
+    cache.write(path.with_suffix('.tran.cache'), attributes, chunk=100)
+    read = []
+    original = cache._read
+    def spy(stream, info, first=0, last=None):
+        read.append((first, last))
+        return original(stream, info, first, last)
+    monkeypatch.setattr(cache, '_read', spy)
+    arrays = read_slice(path, ['out'], temp=27, vdd=1.2)
+    assert arrays['out'].dims == ('time',)
+    assert np.array_equal(arrays['out'].ordinate, 1227 + np.arange(100))
+    assert np.allclose(arrays['out'].axes[0].values, np.arange(100)*1e-9)
+    assert set(read) == {(3, 3)}
+
+    # unnested files have a single axis
+    psf = PSF(Path(__file__).parent / '../samples/pnoise.raw/pss.td.pss')
+    top = psf.get_array('top')
+    assert top.dims == ('time',)
+    assert np.shares_memory(top.ordinate, psf.get_signal('top').ordinate)
+
+
+def test_nested_parsers(monkeypatch):
+    """Test that parsers keep the sweeps of their own file"""
+    import psf_utils.fast as fast
+    from psf_utils.parse import ParsePSF
+    from psf_utils.progress import Monitor
+    test_dir = Path(__file__).parent
+    content = nested_psf([-40, 27, 125], [1.0, 1.2], lengths=[300]*6)
+    other = (test_dir / '../samples/fracpole.ac').read_text()
+
+    # use the parser, which consults the sweeps for every value, and parse
+    # another file while it is underway, as happens with concurrent loads
+    def refuse(section, *args):
+        raise fast.Fallback('refused')
+    monkeypatch.setattr(fast, 'read_nested', refuse)
+    def progress(p):
+        if p.phase == 'parse' and p.done:
+            ParsePSF().parse('fracpole.ac', other)
+    monitor = Monitor(progress, interval=0)
+    monitor.start('parse', len(content), 'chars')
+    sections = ParsePSF().parse('nested.tran', content, monitor=monitor)
+    assert sections[4]['temp'].rows == [0, 600, 1200]
+    assert sections[4]['vdd'].rows == [0, 300, 600, 900, 1200, 1500]